@@ -0,0 +1,127 @@
+"""Порог приёма работы.
+
+Работа принимается, если её оценка не ниже квантиля ACCEPT_QUANTILE
+оценок последних ACCEPT_WINDOW законченных задач. Прежде на каждую
+оценку выбирались оценки всех законченных задач. Здесь окно хранится
+в памяти: ID задач по возрастанию в кольцевом буфере и оценки
+в отсортированном списке, порог находится бинарным поиском.
+"""
+
+import bisect
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, List
+
+from dotenv import load_dotenv
+
+from models import Task
+
+# pylint: disable=no-member
+
+# Загрузка переменных из .env
+load_dotenv()
+# Сколько последних законченных задач учитывается
+ACCEPT_WINDOW = int(os.getenv("ACCEPT_WINDOW", "100"))
+# Доля оценок окна ниже порога
+ACCEPT_QUANTILE = float(os.getenv("ACCEPT_QUANTILE", "0.25"))
+# Статусы задач, которые ещё не закончены или сняты блогером
+UNFINISHED = (0, 1, -1)
+
+
+class AcceptanceThreshold:
+    """Оценки последних законченных задач по ID задачи.
+
+    Загружается при первом обращении, затем обновляется вызовами
+    on_task_changed. Все изменения статуса и оценки задач должны
+    сопровождаться вызовом on_task_changed, иначе нужен invalidate.
+    """
+
+    def __init__(
+        self, window: int = ACCEPT_WINDOW, quantile: float = ACCEPT_QUANTILE
+    ):
+        self.window = window
+        self.quantile = quantile
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        """Очищает окно"""
+        # ID задач окна по возрастанию, старые вытесняются слева
+        self._ids: Deque[int] = deque()
+        # ID задачи -> оценка
+        self._scores: Dict[int, float] = {}
+        # Оценки окна по возрастанию
+        self._sorted: List[float] = []
+
+    def invalidate(self):
+        """Сбрасывает окно, следующее обращение перечитает БД"""
+        with self._lock:
+            self._loaded = False
+
+    def load(self) -> "AcceptanceThreshold":
+        """Загружает оценки последних законченных задач из БД"""
+        with self._lock:
+            self._reset()
+            rows = (
+                Task.select(Task.id, Task.score)
+                .where(Task.status.not_in(UNFINISHED))
+                .order_by(Task.id.desc())
+                .limit(self.window)
+                .tuples()
+            )
+            for task_id, score in reversed(list(rows)):
+                self._ids.append(task_id)
+                self._scores[task_id] = score
+            self._sorted = sorted(self._scores.values())
+            self._loaded = True
+        return self
+
+    def get_threshold(self) -> float:
+        """Пороговая оценка приёма работы. Пока законченных задач нет,
+        принимается любая работа"""
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            if not self._sorted:
+                return 0.0
+            index = int(len(self._sorted) * self.quantile)
+            return self._sorted[min(index, len(self._sorted) - 1)]
+
+    def _insert(self, task_id: int, score: float):
+        """Добавляет задачу в окно, вытесняя самую старую"""
+        if self._ids and task_id < self._ids[-1]:
+            self._ids.insert(bisect.bisect_left(self._ids, task_id), task_id)
+        else:
+            self._ids.append(task_id)
+        self._scores[task_id] = score
+        bisect.insort(self._sorted, score)
+        if len(self._ids) > self.window:
+            self._remove_score(self._scores.pop(self._ids.popleft()))
+
+    def _remove_score(self, score: float):
+        """Убирает оценку из отсортированного списка"""
+        del self._sorted[bisect.bisect_left(self._sorted, score)]
+
+    def on_task_changed(self, task: Task):
+        """Задача выдана, снята, просрочена, оценена или опубликована"""
+        with self._lock:
+            if not self._loaded:
+                return
+            finished = task.status not in UNFINISHED
+            if task.id in self._scores:
+                if not finished:
+                    # Окно сократилось, место займёт задача из БД
+                    self.invalidate()
+                    return
+                self._remove_score(self._scores[task.id])
+                self._scores[task.id] = task.score
+                bisect.insort(self._sorted, task.score)
+            elif finished and (
+                len(self._ids) < self.window or task.id > self._ids[0]
+            ):
+                self._insert(task.id, task.score)
+
+
+acceptance = AcceptanceThreshold()
@@ -1,15 +1,25 @@
 """Модуль обработки административных команд и функций"""
 
 import csv
+import tempfile
 
-from typing import List
-from aiogram import F, Router
+from typing import Callable, List, Set
+from aiogram import Bot, F, Router
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import CallbackQuery, Message
-from peewee import JOIN, Case
+from aiogram.types import (
+    BufferedInputFile,
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    Message,
+)
+from peewee import JOIN, Case, chunked
 
+from acceptance import acceptance
+from capacity import ReviewQueue
+from catalogue import catalogue
 from common import (
     add_reviewer,
     error_handler,
@@ -18,18 +28,28 @@ from common import (
     send_task,
     send_new_review_request,
 )
+from course_import import (
+    CourseDiff,
+    CourseImporter,
+    parse_number,
+    read_csv_rows,
+)
+from executor import run_db_heavy
 from filters import IsAdmin
 from models import (
-    Course,
     Review,
     ReviewRequest,
-    Role,
     Task,
     Theme,
     User,
-    UserRole,
     Video,
 )
+from outbox import outbox
+from rating_state import check_consistency, rating_state
+from reviewer_pool import reviewer_pool
+from roles import registry
+from scheduler import scheduler
+from supervisor import supervisor
 
 # pylint: disable=no-member
 
@@ -42,6 +62,12 @@ class UploadVideo(StatesGroup):  # pylint: disable=too-few-public-methods
     wait_upload = State()
 
 
+class ImportCourses(StatesGroup):  # pylint: disable=too-few-public-methods
+    """Класс состояний для подтверждения загрузки курсов из CSV."""
+
+    wait_confirm = State()
+
+
 @router.callback_query(F.data.startswith("del_rr_"))
 @error_handler()
 async def del_rr(callback: CallbackQuery):
@@ -62,13 +88,17 @@ async def del_rr(callback: CallbackQuery):
     if task.status != 1:
         task.status = 1
         task.save()
+        await run_db_heavy(rating_state.on_task_changed, task)
+        acceptance.on_task_changed(task)
+        catalogue.on_task_changed(task)
         await callback.message.reply(
             text="Проверка по задаче возобновлена",
         )
 
     await callback.message.reply(text="Запрос на проверку и отзыв удалён")
 
-    await callback.bot.send_message(
+    await outbox.send(
+        "send_message",
         chat_id=rr.reviewer.tg_id,
         text="Ваш отзыв и запрос на проверку видео удален. "
         "Ожидайте следующее видео на проверку. "
@@ -76,11 +106,14 @@ async def del_rr(callback: CallbackQuery):
         f"{r.comment}",
     )
 
-    await callback.bot.send_message(
+    await outbox.send(
+        "send_message",
         chat_id=task.implementer.tg_id,
         text=f"Отзыв по вашему видео удален.\n\n{r.comment}",
     )
 
+    await run_db_heavy(rating_state.on_request_deleted, rr)
+    reviewer_pool.on_request_deleted(rr)
     rr.delete_instance(recursive=True)
     await add_reviewer(callback.bot, video.id)
 
@@ -169,6 +202,37 @@ async def report_blogers(message: Message):
     )
 
 
+@router.message(Command("check_rating"), IsAdmin())
+@error_handler()
+async def check_rating(message: Message):
+    """Сверка инкрементальных рейтингов с полным пересчётом."""
+    mismatches = await run_db_heavy(check_consistency)
+    lines = [f"⚖️📊<b>Расхождений рейтингов: {len(mismatches)}</b>"]
+    lines += [
+        f"{user_id}|{name}|{value:.4f}|{full:.4f}"
+        for user_id, name, value, full in mismatches[:20]
+    ]
+    await message.answer(text="\n".join(lines), parse_mode="HTML")
+
+
+@router.message(Command("jobs"), IsAdmin())
+@error_handler()
+async def jobs_stats(message: Message):
+    """Статистика запусков фоновых задач."""
+    await message.answer(text=supervisor.get_report(), parse_mode="HTML")
+
+
+@router.message(Command("queue"), IsAdmin())
+@error_handler()
+async def queue_stats(message: Message):
+    """Очередь проверки видео и загрузка проверяющих."""
+    queue = await run_db_heavy(ReviewQueue().load)
+    report = queue.get_report(
+        reviewer_pool.get_total_slots(), reviewer_pool.get_vacant_count()
+    )
+    await message.answer(text=report, parse_mode="HTML")
+
+
 @router.message(Command("add_role"), IsAdmin())
 @error_handler()
 async def add_role(message: Message):
@@ -180,7 +244,7 @@ async def add_role(message: Message):
         )
         return
     role_name = data[2]
-    role = Role.get_or_none(name=role_name)
+    role = registry.get_role(role_name)
     if role is None:
         await message.answer(text=f"📤🙅‍♂🔑Нет роли {role_name}")
         return
@@ -192,7 +256,9 @@ async def add_role(message: Message):
             text=f"📤🙅‍♂👩‍💻⏮🆔Нет пользователя с юзернейм {username}"
         )
         return
-    UserRole.get_or_create(user=user, role=role)
+    registry.add_user_role(user, role)
+    reviewer_pool.on_role_changed(user)
+    catalogue.on_role_changed(user)
     await message.answer(text="🔑🚮Роль добавлена")
 
 
@@ -331,71 +397,91 @@ async def report_tasks(message: Message):
     )
 
 
+async def _read_csv(bot: Bot, file_id: str, process: Callable):
+    """Скачивает CSV файл и передаёт его строки process в потоке БД."""
+    with tempfile.TemporaryFile() as file:
+        await bot.download(file_id, destination=file)
+        file.seek(0)
+        return await run_db_heavy(process, read_csv_rows(file))
+
+
 @router.message(F.document.file_name.endswith(".csv"), IsAdmin())
 @error_handler()
 async def add_course(message: Message, state: FSMContext):
-    """Загружает курсы и темы из CSV файла."""
-    file = await message.bot.download(message.document.file_id)
+    """Сравнивает CSV файл с курсами и темами и предлагает загрузить."""
     try:
-        table = _parse_csv_file(file)
-        videos_to_upload = _process_theme_rows(table)
-        await _send_upload_response(message, state, videos_to_upload)
-
+        diff = await _read_csv(
+            message.bot, message.document.file_id, CourseDiff().compare
+        )
     except (csv.Error, UnicodeDecodeError, ValueError, IndexError) as e:
         await message.answer(f"Ошибка при чтении CSV: {e}")
+        return
+    if not diff.has_changes():
+        await message.answer(f"{diff.get_report()}\n\nИзменений нет.")
+        return
+    await state.set_data({"import_file_id": message.document.file_id})
+    await state.set_state(ImportCourses.wait_confirm)
+    await message.answer_document(
+        document=BufferedInputFile(diff.get_diff_file(), filename="diff.csv"),
+        caption=f"{diff.get_report()}\n\nЗагрузить?",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    InlineKeyboardButton(
+                        text="✅Загрузить", callback_data="import_apply"
+                    ),
+                    InlineKeyboardButton(
+                        text="❌Отменить", callback_data="import_cancel"
+                    ),
+                ]
+            ]
+        ),
+    )
 
 
-def _parse_csv_file(file) -> List[List[str]]:
-    """Читает CSV файл и возвращает данные в виде списка строк."""
-    file.seek(0)
-    return csv.reader(file.read().decode("utf-8").splitlines())
-
-
-def _process_theme_rows(table: List[List[str]]) -> List[dict]:
-    """Обрабатывает строки CSV, создаёт/обновляет курсы и темы."""
-    videos_to_upload = []
-    for row in table:
-        if not row[0]:  # Пустая строка курса → пропуск
-            break
-        course = _get_or_create_course(row[0])
-        theme = _update_or_create_theme(course, row[1:4])
-        if len(row) > 4 and row[4]:  # Есть реализатор → добавляем видео
-            video_data = _prepare_video_row(theme, row[4:6])
-            videos_to_upload.append(video_data)
-    return videos_to_upload
-
-
-def _get_or_create_course(title: str) -> Course:
-    """Возвращает существующий курс или создаёт новый."""
-    course, _ = Course.get_or_create(title=title)
-    return course
-
-
-def _update_or_create_theme(course: Course, row: List[str]) -> Theme:
-    """Обновляет или создаёт тему курса."""
-    theme = Theme.get_or_none(course=course, title=row[0])
-    if not theme:
-        return Theme.create(
-            course=course,
-            title=row[0],
-            url=row[1],
-            complexity=float(row[2].replace(",", ".")),
+@router.callback_query(
+    F.data == "import_apply", IsAdmin(), ImportCourses.wait_confirm
+)
+@error_handler()
+async def import_apply(callback: CallbackQuery, state: FSMContext):
+    """Загружает курсы и темы из подтверждённого CSV файла."""
+    data = await state.get_data()
+    await state.clear()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    try:
+        importer = await _read_csv(
+            callback.bot, data["import_file_id"], CourseImporter().import_rows
         )
-    return _update_theme(theme, row[1], float(row[2].replace(",", ".")))
+    except (csv.Error, UnicodeDecodeError, ValueError, IndexError) as e:
+        await callback.message.answer(f"Ошибка при чтении CSV: {e}")
+        return
+    catalogue.on_themes_changed()
+    if importer.changed_complexity:
+        rating_state.invalidate()
+    videos_to_upload = [
+        _prepare_video_row(Theme(id=theme_id, title=title), row)
+        for theme_id, title, row in importer.videos
+    ]
+    await callback.message.answer(importer.get_report())
+    await _send_upload_response(
+        callback.message, state, videos_to_upload, importer.user_ids
+    )
 
 
-def _update_theme(theme: Theme, new_url: str, new_complexity: float) -> Theme:
-    """Обновляет URL и сложность темы, если они изменились."""
-    if theme.url != new_url or theme.complexity != new_complexity:
-        theme.url = new_url
-        theme.complexity = new_complexity
-        theme.save()
-    return theme
+@router.callback_query(
+    F.data == "import_cancel", IsAdmin(), ImportCourses.wait_confirm
+)
+@error_handler()
+async def import_cancel(callback: CallbackQuery, state: FSMContext):
+    """Отменяет загрузку CSV файла."""
+    await state.clear()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.message.answer("Загрузка отменена")
 
 
 def _prepare_video_row(theme: Theme, row: List[str]) -> dict:
     """Готовит данные видео для загрузки."""
-    score = float(row[1].replace(",", ".")) if len(row) > 1 and row[1] else 0.0
+    score = parse_number(row[1]) if len(row) > 1 and row[1] else 0.0
     status = 2 if score >= 0.8 else (-2 if score else 1)
     return {
         "theme": theme.id,
@@ -410,11 +496,14 @@ async def _send_upload_response(
     message: Message,
     state: FSMContext,
     videos_to_upload: List[dict],
+    user_ids: Set[int],
 ) -> None:
     """Отправляет ответ пользователю в зависимости от результата."""
     if not videos_to_upload:
-        await message.answer("↗️❔📐 Темы курса загружены. Видео не требуются.")
-        _update_user_scores()
+        await message.answer(
+            "↗️❔📐 Темы курса загружены. Видео не требуются."
+        )
+        await run_db_heavy(_update_user_scores, user_ids)
     else:
         await state.set_data({"load_videos": videos_to_upload})
         await state.set_state(UploadVideo.wait_upload)
@@ -423,10 +512,11 @@ async def _send_upload_response(
         )
 
 
-def _update_user_scores() -> None:
-    """Обновляет баллы всех пользователей."""
-    for user in User.select():
-        user.update_bloger_score()
+def _update_user_scores(user_ids: Set[int]) -> None:
+    """Обновляет баллы пользователей, затронутых загрузкой."""
+    for batch in chunked(user_ids, 500):
+        for user in User.select().where(User.id.in_(batch)):
+            user.update_bloger_score()
 
 
 @router.message(F.video, IsAdmin(), UploadVideo.wait_upload)
@@ -453,19 +543,31 @@ async def upload_video(message: Message, state: FSMContext):
         score=score,
         due_date=get_date_time(0),
     )
+    scheduler.schedule_task(task)
 
-    Video.get_or_create(
+    video, created = Video.get_or_create(
         task=task,
         file_id=message.video.file_id,
         duration=message.video.duration,
     )
+    if created:
+        await run_db_heavy(rating_state.on_video_uploaded, video)
+    else:
+        await run_db_heavy(rating_state.on_task_changed, task)
+    acceptance.on_task_changed(task)
+    catalogue.on_task_changed(task)
 
-    implementer.update_bloger_score()
-    await message.bot.send_message(
+    await run_db_heavy(implementer.update_bloger_score)
+    ratings = await run_db_heavy(
+        rating_state.get_bloger_ratings, implementer.id
+    )
+    report = await run_db_heavy(implementer.get_bloger_report, ratings)
+    await outbox.send(
+        "send_message",
         chat_id=implementer.tg_id,
         text=(
             f"📹📂👨‍💼Видео на тему {theme.title} загружено администратором."
-            f"\n\n{implementer.get_bloger_report()}"
+            f"\n\n{report}"
         ),
         parse_mode="HTML",
         disable_web_page_preview=True,
@@ -9,16 +9,33 @@ from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher
 
 from admin import router as admin_router
-from bloger import loop as bloger_loop
+from bloger import check_expired_task, check_old_task, update_ratings
 from bloger import router as bloger_router
-from channel import loop as channel_loop
+from channel import publish_poll, publish_video
 from channel import router as channel_router
+from common import flush_admin_digest
 from common import router as common_router
-from reviewer import loop as reviewer_loop
+from digest import admin_digest
+from executor import shutdown as executor_shutdown
+from middlewares import UserContextMiddleware
+from migrations import migrate
+from outbox import outbox
+from reviewer import check_old_reviewer_requests, send_notify_reviewers
 from reviewer import router as reviewer_router
+from roles import registry
+from scheduler import (
+    CHANNEL_POLL,
+    CHANNEL_VIDEO,
+    RATINGS,
+    REVIEW_DUE,
+    REVIEW_REMINDER,
+    TASK_DUE,
+    TASK_RESERVE,
+    get_next_time,
+    scheduler,
+)
 from user import router as user_router
 
-# pylint: disable=too-few-public-methods
 # Загрузка переменных из .env
 load_dotenv()
 TG_TOKEN = os.getenv("TG_TOKEN")  # Чтение токена из .env
@@ -30,37 +47,65 @@ bot = Bot(token=TG_TOKEN)
 dp = Dispatcher()
 
 
-async def sleep():
-    """Рассчитывает время до следующего часа и приостанавливает выполнение."""
+def register_jobs():
+    """Назначает обработчики событий планировщика и загружает сроки"""
     now = datetime.now()
-    sleep_seconds = datetime(
-        year=now.year,
-        month=now.month,
-        day=now.day,
-        hour=now.hour,
-    ) + timedelta(hours=1)
-    sleep_seconds = (sleep_seconds - now).seconds + 1
-    await asyncio.sleep(sleep_seconds)
-
-
-async def loop():
-    """Основной цикл выполнения задач."""
-    while Singleton.LOOP:
-        asyncio.create_task(channel_loop(bot))
-        asyncio.create_task(reviewer_loop(bot))
-        asyncio.create_task(bloger_loop(bot))
-        await sleep()
+    scheduler.register(
+        RATINGS,
+        update_ratings,
+        period=timedelta(hours=1),
+        first=get_next_time(now),
+    )
+    scheduler.register(TASK_RESERVE, check_old_task)
+    scheduler.register(TASK_DUE, check_expired_task)
+    scheduler.register(REVIEW_REMINDER, send_notify_reviewers)
+    scheduler.register(REVIEW_DUE, check_old_reviewer_requests)
+    scheduler.register(
+        CHANNEL_VIDEO,
+        publish_video,
+        period=timedelta(days=1),
+        first=get_next_time(now, hour=18),
+    )
+    scheduler.register(
+        CHANNEL_POLL,
+        publish_poll,
+        period=timedelta(days=1),
+        first=get_next_time(now, hour=8),
+    )
+    scheduler.load()
 
 
 async def on_startup():
     """Обертка для запуска параллельного процесса."""
-    asyncio.create_task(loop())
+    outbox.start(bot)
+    admin_digest.start(flush_admin_digest)
+    scheduler.start(bot)
+
+
+async def on_shutdown():
+    """Останавливает планировщик и отменяет идущие фоновые задачи,
+    отправляет остаток сводки и останавливает отправку очереди,
+    неотправленное остаётся в БД."""
+    await scheduler.stop()
+    await admin_digest.stop()
+    await outbox.stop()
 
 
 async def main():
     """Старт бота."""
 
+    migrate()
+    # Миграции могли объединить пользователей и удалить роли
+    registry.invalidate()
+    register_jobs()
+
     dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
+    # Пользователь и роли загружаются один раз на обновление,
+    # до перебора роутеров
+    dp.message.outer_middleware(UserContextMiddleware())
+    dp.callback_query.outer_middleware(UserContextMiddleware())
 
     dp.include_routers(
         channel_router,
@@ -74,12 +119,6 @@ async def main():
     await dp.start_polling(bot)
 
 
-class Singleton:
-    """Класс для хранения глобального состояния."""
-
-    LOOP = True
-
-
 if __name__ == "__main__":
     asyncio.run(main())
-    Singleton.LOOP = False
+    executor_shutdown()
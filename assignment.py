@@ -0,0 +1,337 @@
+"""Выдача тем свободным блогерам и видео свободным проверяющим.
+
+Прежний алгоритм на каждого блогера запрашивал его подписки, в ключе
+сортировки курсов считал среднюю оценку отдельным запросом, а для
+каждого курса дважды выбирал темы. Здесь свободные блогеры, подписки,
+средние оценки и свободные темы загружаются несколькими
+сгруппированными запросами, сопоставление идёт в памяти, а задачи
+создаются пакетной вставкой в той же транзакции.
+
+Проверяющие назначались по одному с рекурсивным повтором, и каждый
+шаг заново искал видео без проверяющих и свободных проверяющих.
+ReviewAssigner находит все свободные места один раз и заполняет их
+за один проход, выбирая проверяющих из пула в памяти reviewer_pool.
+"""
+
+import os
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Set, Tuple
+
+from dotenv import load_dotenv
+from peewee import JOIN, chunked, fn
+
+from capacity import ReviewCapacity, review_capacity
+from models import (
+    Course,
+    ReviewRequest,
+    Task,
+    Theme,
+    User,
+    UserCourse,
+    UserRole,
+    Video,
+    db,
+)
+from reviewer_pool import ReviewerPool, reviewer_pool
+
+# pylint: disable=no-member
+
+# Загрузка переменных из .env
+load_dotenv()
+# Автоматическая выдача тем блогерам, по умолчанию выключена
+AUTO_ASSIGN_TASKS = os.getenv("AUTO_ASSIGN_TASKS", "0") == "1"
+# Оценка курса, по которому у блогера ещё нет оценённых задач
+DEFAULT_COURSE_SCORE = 0.8
+
+
+def get_due_date(hours: int, now: datetime = None) -> datetime:
+    """Срок через hours часов от начала текущего часа, как get_date_time"""
+    now = (now or datetime.now()).replace(minute=0, second=0, microsecond=0)
+    return now + timedelta(hours=hours)
+
+
+def get_task_hours(theme: Theme) -> int:
+    """Часов на запись видео по теме: не меньше трёх суток"""
+    return max(int(theme.complexity * 72 + 1), 72)
+
+
+class TaskAssigner:
+    """Сопоставляет свободных блогеров и свободные темы.
+
+    Блогеры перебираются по убыванию рейтинга. Каждому достаётся тема
+    с наименьшим ID из подписанного свободного курса с наибольшей
+    средней оценкой блогера. Курс с выданной темой перестаёт быть
+    свободным, поэтому по курсу одновременно ведётся одна задача.
+    """
+
+    def __init__(self, bloger_role_id: int):
+        self.bloger_role_id = bloger_role_id
+        self.blogers: List[User] = []
+        # ID блогера -> ID свободных курсов, на которые он подписан
+        self.subscriptions: Dict[int, Set[int]] = {}
+        # (ID блогера, ID курса) -> средняя оценка задач
+        self.scores: Dict[Tuple[int, int], float] = {}
+        # ID курса -> свободные темы по возрастанию ID
+        self.themes: Dict[int, Deque[Theme]] = {}
+
+    @staticmethod
+    def _select_busy_courses():
+        """Подзапрос курсов, по которым ведутся работы"""
+        return (
+            Theme.select(Theme.course)
+            .join(Task)
+            .where(Task.status.in_([0, 1]))
+        )
+
+    def _select_free_blogers(self):
+        """Подзапрос ID блогеров без задачи в работе"""
+        busy = Task.select(Task.implementer).where(Task.status.in_([0, 1]))
+        return UserRole.select(UserRole.user).where(
+            (UserRole.role == self.bloger_role_id) & UserRole.user.not_in(busy)
+        )
+
+    def load(self) -> "TaskAssigner":
+        """Загружает блогеров, подписки, оценки и темы"""
+        free_blogers = self._select_free_blogers()
+        busy_courses = self._select_busy_courses()
+
+        self.blogers = sorted(
+            User.select().where(User.id.in_(free_blogers)),
+            key=lambda user: (-user.bloger_rating, user.id),
+        )
+
+        self.subscriptions = {}
+        for row in (
+            UserCourse.select(UserCourse.user, UserCourse.course)
+            .where(
+                UserCourse.user.in_(free_blogers)
+                & UserCourse.course.not_in(busy_courses)
+            )
+            .tuples()
+        ):
+            self.subscriptions.setdefault(row[0], set()).add(row[1])
+
+        self.scores = {
+            (bloger_id, course_id): score
+            for bloger_id, course_id, score in (
+                Task.select(Task.implementer, Theme.course, fn.AVG(Task.score))
+                .join(Theme)
+                .where(Task.implementer.in_(free_blogers))
+                .group_by(Task.implementer, Theme.course)
+                .tuples()
+            )
+        }
+
+        # Темы, по которым ведутся или удачно закончены работы
+        taken = Task.select(Task.theme).where(Task.status >= 0)
+        self.themes = {}
+        for theme in (
+            Theme.select()
+            .where(Theme.course.not_in(busy_courses) & Theme.id.not_in(taken))
+            .order_by(Theme.id)
+        ):
+            self.themes.setdefault(theme.course_id, deque()).append(theme)
+        return self
+
+    def get_course_score(self, bloger_id: int, course_id: int) -> float:
+        """Средняя оценка блогера по курсу"""
+        return self.scores.get((bloger_id, course_id)) or DEFAULT_COURSE_SCORE
+
+    def match(self) -> List[Tuple[User, Theme]]:
+        """Сопоставляет блогеров и темы, не обращаясь к БД"""
+        pairs = []
+        for bloger in self.blogers:
+            courses = [
+                course_id
+                for course_id in self.subscriptions.get(bloger.id, ())
+                if self.themes.get(course_id)
+            ]
+            if not courses:
+                continue
+            course_id = min(
+                courses,
+                key=lambda course_id, bloger_id=bloger.id: (
+                    -self.get_course_score(bloger_id, course_id),
+                    course_id,
+                ),
+            )
+            pairs.append((bloger, self.themes.pop(course_id)[0]))
+        return pairs
+
+    @staticmethod
+    def create_tasks(pairs: List[Tuple[User, Theme]]) -> List[Task]:
+        """Создаёт задачи пакетной вставкой и возвращает их вместе
+        с блогерами и темами. Вызывается в транзакции после load:
+        у блогеров из pairs других задач в работе нет"""
+        if not pairs:
+            return []
+        now = datetime.now()
+        rows = [
+            {
+                "implementer": bloger.id,
+                "theme": theme.id,
+                "at_created": now,
+                "due_date": get_due_date(get_task_hours(theme), now),
+            }
+            for bloger, theme in pairs
+        ]
+        for batch in chunked(rows, 100):
+            query = Task.insert_many(batch)
+            query.execute()  # pylint: disable=no-value-for-parameter
+        return list(
+            Task.select(Task, User, Theme)
+            .join_from(Task, User)
+            .join_from(Task, Theme)
+            .where(
+                (Task.status == 0)
+                & Task.implementer.in_([bloger.id for bloger, _ in pairs])
+            )
+            .order_by(Task.id)
+        )
+
+    def assign(self) -> List[Task]:
+        """Выдаёт темы одной транзакцией и возвращает новые задачи"""
+        with db.atomic():
+            return self.create_tasks(self.load().match())
+
+
+class ReviewAssigner:
+    """Назначает свободных проверяющих на видео, которым их не хватает.
+
+    Видео перебираются по убыванию рейтинга блогера, места каждого
+    видео заполняются проверяющими по убыванию рейтинга. Проверяющий
+    не получает своё видео и тему, которую уже проверял. Видео без
+    подходящих проверяющих пропускается, остальные заполняются дальше.
+    Проверяющих выбирает пул, новые запросы нужно передать ему через
+    on_request_changed после завершения транзакции. Ограничения берутся
+    из ReviewCapacity.
+    """
+
+    def __init__(
+        self,
+        pool: ReviewerPool = reviewer_pool,
+        capacity: ReviewCapacity = review_capacity,
+    ):
+        self.pool = pool
+        self.capacity = capacity
+        # Сколько запросов ещё можно выдать
+        self.limit = 0
+        # Видео и число свободных мест на них
+        self.videos: List[Tuple[Video, int]] = []
+        # Видео, на которые не нашлось проверяющих
+        self.skipped: List[Video] = []
+        # Видео, на котором закончились свободные проверяющие
+        self.exhausted: Video = None
+
+    def _select_videos(self):
+        """Видео на проверке и число действующих запросов по ним"""
+        count = fn.COUNT(ReviewRequest.id)
+        return (
+            Video.select(Video, Task, Theme, Course, count.alias("requests"))
+            .join(Task)
+            .join(Theme)
+            .join(Course)
+            .join_from(Task, User)
+            .join_from(
+                Video,
+                ReviewRequest,
+                JOIN.LEFT_OUTER,
+                on=(ReviewRequest.video == Video.id)
+                & (ReviewRequest.status >= 0),
+            )
+            .where(Task.status == 1)
+            .group_by(Video.id)
+            .having(count < self.capacity.per_video)
+            .order_by(User.bloger_rating.desc(), Video.id)
+        )
+
+    def load(self, video_id: int = None) -> "ReviewAssigner":
+        """Загружает свободные места, проверяющих и проверенные темы.
+        С video_id — одно место на это видео без общего ограничения"""
+        query = self._select_videos()
+        if video_id is not None:
+            self.limit = 1
+            query = query.where(Video.id == video_id)
+        elif self.capacity.concurrency > 0:
+            self.limit = self.capacity.concurrency - (
+                ReviewRequest.select().where(ReviewRequest.status == 0).count()
+            )
+        else:
+            self.limit = self.pool.get_free_slots()
+        self.videos = []
+        if self.limit > 0:
+            per_video = self.capacity.per_video
+            self.videos = [
+                (video, min(per_video - video.requests, self.limit))
+                for video in query
+            ]
+        return self
+
+    def match(self) -> List[Tuple[int, Video]]:
+        """Заполняет места по пулу проверяющих, не обращаясь к БД.
+        Возвращает пары (ID проверяющего, видео)"""
+        pairs = []
+        # Сколько запросов выбрано каждому проверяющему за проход
+        used: Dict[int, int] = Counter()
+        # ID темы -> проверяющие, выбранные на неё за проход
+        theme_reviewers: Dict[int, Set[int]] = {}
+        free = self.pool.get_free_slots()
+        self.skipped = []
+        self.exhausted = None
+        for video, slots in self.videos:
+            if len(pairs) >= self.limit or self.exhausted is not None:
+                break
+            task: Task = video.task
+            excluded = theme_reviewers.setdefault(task.theme_id, set())
+            for _ in range(min(slots, self.limit - len(pairs))):
+                if len(pairs) >= free:
+                    self.exhausted = video
+                    break
+                reviewer_id = self.pool.pick(
+                    task.theme_id, excluded | {task.implementer_id}, used
+                )
+                if reviewer_id is None:
+                    self.skipped.append(video)
+                    break
+                used[reviewer_id] += 1
+                excluded.add(reviewer_id)
+                pairs.append((reviewer_id, video))
+        return pairs
+
+    def create_requests(
+        self, pairs: List[Tuple[int, Video]]
+    ) -> List[ReviewRequest]:
+        """Создаёт запросы на проверку пакетной вставкой и возвращает их
+        вместе с видео, задачами, темами, курсами и пользователями.
+        Вызывается в транзакции"""
+        if not pairs:
+            return []
+        now = datetime.now()
+        due_date = get_due_date(self.capacity.hours, now)
+        query = ReviewRequest.select(fn.MAX(ReviewRequest.id))
+        last_id = query.scalar() or 0  # pylint: disable=no-value-for-parameter
+        rows = [
+            {
+                "reviewer": reviewer_id,
+                "video": video.id,
+                "at_created": now,
+                "due_date": due_date,
+            }
+            for reviewer_id, video in pairs
+        ]
+        for batch in chunked(rows, 100):
+            query = ReviewRequest.insert_many(batch)
+            query.execute()  # pylint: disable=no-value-for-parameter
+        return list(
+            ReviewRequest.select_with_task()
+            .where(ReviewRequest.id > last_id)
+            .order_by(ReviewRequest.id)
+        )
+
+    def assign(self, video_id: int = None) -> List[ReviewRequest]:
+        """Назначает проверяющих одной транзакцией и возвращает новые
+        запросы на проверку. Пропущенные видео остаются в skipped
+        и exhausted"""
+        with db.atomic():
+            return self.create_requests(self.load(video_id).match())
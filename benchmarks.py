@@ -0,0 +1,2150 @@
+"""Замеры производительности на синтетической базе данных.
+
+Запуск: python benchmarks.py <сценарий> [параметры]
+Каждый сценарий создаёт временную БД и не трогает sqlite.db.
+"""
+
+import argparse
+import asyncio
+import csv
+import functools
+import io
+import os
+import random
+import re
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+from aiogram.methods import SendMessage
+from aiogram.types import CallbackQuery, Chat, Message, Update
+from aiogram.types import User as TgUser
+from peewee import JOIN, chunked, fn
+
+from acceptance import AcceptanceThreshold
+from assignment import (
+    ReviewAssigner,
+    TaskAssigner,
+    get_due_date,
+    get_task_hours,
+)
+from capacity import ReviewCapacity, ReviewQueue
+from catalogue import CourseCatalogue
+from course_import import (
+    CHANGED,
+    NEW,
+    CourseDiff,
+    CourseImporter,
+    read_csv_rows,
+)
+from digest import CATEGORIES, MESSAGE_LIMIT, Digest
+from editor import MessageEditor
+from executor import run_db, run_db_heavy
+from models import (
+    MODELS,
+    Course,
+    Review,
+    ReviewRequest,
+    Role,
+    Task,
+    Theme,
+    User,
+    UserCourse,
+    UserRole,
+    Video,
+    SQLITE_PROFILES,
+    db,
+    get_pragmas,
+)
+from notifier import Notifier
+from outbox import Outbox
+from rating import RatingEngine, create_rating_engine
+from rating_state import RatingState, check_consistency
+from reviewer_pool import ReviewerPool
+from scheduler import TASK_DUE, Scheduler, get_next_time
+from supervisor import Supervisor
+
+# pylint: disable=no-member,too-many-lines
+
+ADMIN_ROLE_ID, BLOGER_ROLE_ID, REVIEWER_ROLE_ID = 1, 2, 3
+
+
+def percentile(data: List[float], q: float) -> float:
+    """Возвращает q-й перцентиль (0..100) по методу ближайшего ранга"""
+    if len(data) == 0:
+        return 0.0
+    data = sorted(data)
+    index = max(0, min(len(data) - 1, round(q / 100 * len(data)) - 1))
+    return data[index]
+
+
+def init_database(path: str, profile: str = None):
+    """Переключает модели на новую БД и создаёт таблицы"""
+    db.init(path, pragmas=get_pragmas(profile))
+    db.create_tables(MODELS)
+
+
+def _insert(model, rows: List[Dict]):
+    """Вставляет строки пачками"""
+    for batch in chunked(rows, 100):
+        model.insert_many(batch).execute()
+
+
+def fill_database(  # pylint: disable=too-many-locals
+    users: int, courses: int = 20, themes: int = 20, seed: int = 0
+):
+    """Заполняет БД синтетическими пользователями, задачами и отзывами"""
+    rnd = random.Random(seed)
+    now = datetime.now()
+    with db.atomic():
+        _insert(
+            Role,
+            [{"name": n} for n in ("Админ", "Блогер", "Проверяющий")],
+        )
+        _insert(
+            User,
+            [
+                {
+                    "tg_id": 1000 + i,
+                    "username": f"user{i}",
+                    "comment": f"Фамилия{i} Имя Отчество",
+                }
+                for i in range(users)
+            ],
+        )
+        user_ids = list(range(1, users + 1))
+        reviewer_ids = user_ids[::3]
+        user_roles = [{"user": 1, "role": ADMIN_ROLE_ID}]
+        user_roles += [{"user": i, "role": BLOGER_ROLE_ID} for i in user_ids]
+        user_roles += [
+            {"user": i, "role": REVIEWER_ROLE_ID} for i in reviewer_ids
+        ]
+        _insert(UserRole, user_roles)
+
+        _insert(Course, [{"title": f"Курс {i}"} for i in range(courses)])
+        _insert(
+            Theme,
+            [
+                {
+                    "course": c + 1,
+                    "title": f"Тема {c}.{t}",
+                    "url": f"https://example.com/{c}/{t}",
+                    "complexity": round(rnd.uniform(0.2, 2.0), 3),
+                }
+                for c in range(courses)
+                for t in range(themes)
+            ],
+        )
+        _insert(
+            UserCourse,
+            [
+                {"user": u, "course": c}
+                for u in user_ids
+                for c in rnd.sample(range(1, courses + 1), min(3, courses))
+            ],
+        )
+
+        tasks, videos, rrs, reviews = [], [], [], []
+        for user_id in user_ids:
+            for _ in range(3):
+                at_created = now - timedelta(hours=rnd.randint(48, 24 * 60))
+                status = rnd.choice([-2, -1, 0, 1, 2, 2, 3, 3])
+                tasks.append(
+                    {
+                        "implementer": user_id,
+                        "theme": rnd.randint(1, courses * themes),
+                        "at_created": at_created,
+                        "due_date": at_created + timedelta(hours=72),
+                        "status": status,
+                        "score": (
+                            rnd.uniform(0.4, 1.0)
+                            if status in (-2, 2, 3)
+                            else 0.0
+                        ),
+                    }
+                )
+                if status in (0, -1):
+                    continue
+                videos.append(
+                    {
+                        "task": len(tasks),
+                        "file_id": len(tasks),
+                        "at_created": at_created
+                        + timedelta(hours=rnd.randint(1, 48)),
+                        "duration": rnd.randint(60, 1200),
+                    }
+                )
+                for reviewer_id in rnd.sample(reviewer_ids, 3):
+                    rr_created = videos[-1]["at_created"] + timedelta(
+                        hours=rnd.randint(1, 12)
+                    )
+                    rr_status = rnd.choice([-1, 1, 1, 1])
+                    rrs.append(
+                        {
+                            "reviewer": reviewer_id,
+                            "video": len(videos),
+                            "status": rr_status,
+                            "at_created": rr_created,
+                            "due_date": rr_created + timedelta(hours=25),
+                        }
+                    )
+                    if rr_status != 1:
+                        continue
+                    reviews.append(
+                        {
+                            "review_request": len(rrs),
+                            "score": round(rnd.uniform(0, 5), 1),
+                            "comment": "Отзыв",
+                            "at_created": rr_created
+                            + timedelta(hours=rnd.randint(1, 24)),
+                        }
+                    )
+        _insert(Task, tasks)
+        _insert(Video, videos)
+        _insert(ReviewRequest, rrs)
+        _insert(Review, reviews)
+
+
+@contextmanager
+def temporary_database(
+    users: int, profile: str = None, courses: int = 20, themes: int = 20
+) -> Iterator[None]:
+    """Создаёт и заполняет временную БД на время сценария"""
+    with tempfile.TemporaryDirectory() as tmp:
+        init_database(os.path.join(tmp, "bench.db"), profile)
+        fill_database(users=users, courses=courses, themes=themes)
+        try:
+            yield
+        finally:
+            db.close()
+
+
+def with_database(func: Callable) -> Callable:
+    """Запускает сценарий на временной БД"""
+
+    def wrapper(args):
+        with temporary_database(
+            args.users, courses=args.courses, themes=args.themes
+        ):
+            func(args)
+
+    return wrapper
+
+
+class QueryCounter:
+    """Считает SQL-запросы, выполненные через db"""
+
+    def __init__(self):
+        self.count = 0
+        self._execute_sql = None
+
+    def __enter__(self):
+        self._execute_sql = db.execute_sql
+
+        def execute_sql(*args, **kwargs):
+            self.count += 1
+            return self._execute_sql(*args, **kwargs)
+
+        db.execute_sql = execute_sql
+        return self
+
+    def __exit__(self, *exc):
+        del db.execute_sql
+
+
+def print_latency(title: str, latencies: List[float]):
+    """Печатает перцентили задержек в миллисекундах"""
+    print(
+        f"{title:<12} n={len(latencies):<5} "
+        f"p50={percentile(latencies, 50) * 1000:8.2f}ms "
+        f"p99={percentile(latencies, 99) * 1000:8.2f}ms "
+        f"max={max(latencies) * 1000:8.2f}ms"
+    )
+
+
+async def _simulate_updates(
+    offload: bool, updates: int, heavy_share: float
+) -> List[float]:
+    """Имитирует поток обновлений: лёгкие поиски пользователя
+    вперемешку с тяжёлыми пересчётами рейтинга"""
+    rnd = random.Random(1)
+    users: List[User] = list(User.select())
+    reviewers: List[User] = users[::3]
+    latencies: List[float] = []
+
+    async def light(tg_id: int, arrived: float):
+        if offload:
+            await run_db(User.get_or_none, tg_id=tg_id)
+        else:
+            User.get_or_none(tg_id=tg_id)
+        latencies.append(time.perf_counter() - arrived)
+
+    async def heavy(user: User):
+        if offload:
+            await run_db_heavy(user.update_reviewer_rating)
+        else:
+            user.update_reviewer_rating()
+
+    # Обновления приходят по расписанию, не зависящему от цикла событий,
+    # поэтому его блокировка попадает в задержку
+    handlers = []
+    started = time.perf_counter()
+    for i in range(updates):
+        arrived = started + i * 0.002
+        await asyncio.sleep(max(0.0, arrived - time.perf_counter()))
+        if rnd.random() < heavy_share:
+            coro = heavy(rnd.choice(reviewers))
+        else:
+            coro = light(rnd.choice(users).tg_id, arrived)
+        handlers.append(asyncio.create_task(coro))
+    await asyncio.gather(*handlers)
+    return latencies
+
+
+@with_database
+def bench_executor(args):
+    """Задержка лёгких обработчиков при параллельных тяжёлых запросах"""
+    for title, offload in (("inline", False), ("executor", True)):
+        latencies = asyncio.run(
+            _simulate_updates(offload, args.updates, args.heavy_share)
+        )
+        print_latency(title, latencies)
+
+
+def _write_reviews(rr_ids: List[int]):
+    """Закрывает запросы на проверку отзывами, как это делает get_review"""
+    try:
+        for rr_id in rr_ids:
+            rr: ReviewRequest = ReviewRequest.get_by_id(rr_id)
+            Review.create(review_request=rr, score=4.0, comment="Отзыв")
+            rr.status = 1
+            rr.save()
+    finally:
+        db.close()
+
+
+def bench_pragmas(args):
+    """Скорость записи отзывов под каждым профилем настроек SQLite"""
+    for profile in SQLITE_PROFILES:
+        with temporary_database(args.users, profile):
+            video_ids = [v.id for v in Video.select(Video.id)]
+            rr_ids = [
+                ReviewRequest.create(
+                    reviewer=1,
+                    video=video_ids[i % len(video_ids)],
+                    due_date=datetime.now(),
+                ).id
+                for i in range(args.updates)
+            ]
+            batches = [rr_ids[i :: args.threads] for i in range(args.threads)]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.threads) as pool:
+                list(pool.map(_write_reviews, batches))
+            elapsed = time.perf_counter() - started
+            print(
+                f"{profile:<12} writes={len(rr_ids):<5} "
+                f"threads={args.threads} "
+                f"{len(rr_ids) / elapsed:9.1f} reviews/s"
+            )
+
+
+def _update_user_ratings(users: List[User]):
+    """Пересчёт баллов и рейтингов по одному пользователю"""
+    for user in users:
+        user.update_bloger_score()
+        user.update_bloger_rating()
+        user.update_reviewer_score()
+        user.update_reviewer_rating()
+
+
+@with_database
+def bench_rating(args):
+    """Пересчёт рейтингов всех пользователей: по одному и RatingEngine"""
+    users: List[User] = list(User.select())
+    sample = users[: args.sample]
+
+    with QueryCounter() as counter:
+        started = time.perf_counter()
+        _update_user_ratings(sample)
+        elapsed = time.perf_counter() - started
+    per_user = elapsed / len(sample)
+    print(
+        f"{'per-user':<12} sample={len(sample):<5} "
+        f"{per_user * 1000:8.2f}ms/user "
+        f"~{per_user * len(users):8.2f}s for {len(users)} users "
+        f"~{counter.count / len(sample) * len(users):.0f} queries"
+    )
+
+    with QueryCounter() as counter:
+        started = time.perf_counter()
+        RatingEngine().load().update_all()
+        elapsed = time.perf_counter() - started
+    print(
+        f"{'engine':<12} users={len(users):<6} "
+        f"{elapsed:8.2f}s {counter.count} queries"
+    )
+
+
+def _get_user_method_values(user: User) -> List[float]:
+    """Баллы и рейтинги пользователя методами models.User"""
+    return [
+        user.get_bloger_rating_from_scores(),
+        user.get_bloger_rating_from_over(),
+        user.get_bloger_rating_from_duration(),
+        user.get_reviewer_rating_from_score(),
+        user.get_reviewer_rating_from_over(),
+        user.get_reviewer_rating_from_duration(),
+    ]
+
+
+def _get_engine_values(engine: RatingEngine, user: User) -> List[float]:
+    """Баллы и рейтинги пользователя по движку рейтингов"""
+    return [
+        *engine.get_bloger_ratings(user.id),
+        *engine.get_reviewer_ratings(user.id),
+    ]
+
+
+def _get_legacy_review_hours(user_id: int, limit_dt: datetime) -> List[float]:
+    """Часы проверки видео проверяющим прежним запросом по одному
+    пользователю, как в User.get_reviewer_rating_from_duration до
+    общего запроса ReviewRequest.select_review_times"""
+    hours = (
+        fn.julianday(Review.at_created)
+        - fn.julianday(ReviewRequest.at_created)
+    ) * 24
+    return sorted(
+        value
+        for value, in Review.select(hours)
+        .join(ReviewRequest)
+        .where(
+            (ReviewRequest.status == 1)
+            & (ReviewRequest.reviewer == user_id)
+            & (ReviewRequest.at_created > limit_dt)
+        )
+        .tuples()
+    )
+
+
+def check_review_hours(engine: RatingEngine, users: List[User]) -> int:
+    """Сверяет часы проверки, которые движок получил общим запросом,
+    с прежним запросом по каждому проверяющему. Возвращает число
+    сверенных отзывов"""
+    checked = 0
+    for user in users:
+        expected = _get_legacy_review_hours(user.id, engine.limit_dt)
+        actual = sorted(engine.review_durations.get(user.id, []))
+        if len(actual) != len(expected) or any(
+            abs(value - full) > 1e-6 for value, full in zip(actual, expected)
+        ):
+            raise AssertionError(
+                f"Часы проверки проверяющего {user.id} расходятся "
+                "с прежним запросом"
+            )
+        checked += len(actual)
+    return checked
+
+
+def _add_history(user_id: int, size: int):
+    """Добавляет пользователю принятые задачи и проверенные им видео"""
+    now = datetime.now()
+    for _ in range(size):
+        task = Task.create(
+            implementer=user_id,
+            theme=1,
+            status=2,
+            score=0.9,
+            due_date=now,
+        )
+        video = Video.create(task=task, file_id=0, duration=600)
+        rr = ReviewRequest.create(
+            reviewer=user_id, video=video, status=1, due_date=now
+        )
+        Review.create(review_request=rr, score=4.5, comment="Отзыв")
+
+
+@with_database
+def bench_reports(args):
+    """Количество запросов отчёта пользователя не растёт с историей"""
+    user: User = User.get_by_id(1)
+    ratings = (1.0, 1.0, 1.0)
+    counts = []
+    for size in (0, args.sample // 5, args.sample * 2):
+        _add_history(user.id, size)
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            user.get_report(ratings, ratings)
+            elapsed = time.perf_counter() - started
+        counts.append(counter.count)
+        print(
+            f"history+={size:<4} queries={counter.count:<3} "
+            f"{elapsed * 1000:8.2f}ms"
+        )
+    if len(set(counts)) != 1:
+        raise AssertionError(f"Число запросов отчёта растёт: {counts}")
+
+
+def _get_scores(engine: RatingEngine, user: User) -> List[float]:
+    """Баллы блогера и проверяющего по движку рейтингов"""
+    return [
+        engine.bloger_scores.get(user.id, 0),
+        engine.reviewer_scores.get(user.id, 0),
+    ]
+
+
+@with_database
+def bench_backends(args):
+    """Скорость движков рейтингов и расхождение с методами models.User
+    на выборке пользователей и с RatingEngine на всех пользователях"""
+    users: List[User] = list(User.select())
+    sample = users[: args.sample]
+    expected = {user.id: _get_user_method_values(user) for user in sample}
+    reference = RatingEngine().load()
+    print(f"review_hours checked={check_review_hours(reference, users)}")
+    for backend in ("python", "numpy"):
+        started = time.perf_counter()
+        engine = create_rating_engine(backend).load()
+        elapsed = time.perf_counter() - started
+        user_diff = max(
+            abs(value - full)
+            for user in sample
+            for value, full in zip(
+                _get_engine_values(engine, user), expected[user.id]
+            )
+        )
+        engine_diff = max(
+            abs(value - full)
+            for user in users
+            for value, full in zip(
+                _get_engine_values(engine, user) + _get_scores(engine, user),
+                _get_engine_values(reference, user)
+                + _get_scores(reference, user),
+            )
+        )
+        print(
+            f"{backend:<8} users={len(users):<6} load={elapsed:7.3f}s "
+            f"user_diff={user_diff:.2e} engine_diff={engine_diff:.2e}"
+        )
+
+
+def _max_id(model) -> int:
+    """Наибольший ID в таблице"""
+    return model.select(fn.MAX(model.id)).scalar()
+
+
+def _apply_random_event(state: RatingState, rnd: random.Random):
+    """Случайное событие, записанное в БД и переданное состоянию"""
+    kind = rnd.choice(["review", "review", "expire", "drop", "video", "task"])
+    if kind in ("review", "expire"):
+        rr = ReviewRequest.create(
+            reviewer=rnd.choice(range(1, _max_id(User) + 1, 3)),
+            video=rnd.randint(1, _max_id(Video)),
+            due_date=datetime.now(),
+        )
+        state.on_request_changed(rr)
+        if kind == "expire":
+            rr.status = -1
+            rr.save()
+            state.on_request_changed(rr)
+            return kind, rr.reviewer
+        review = Review.create(
+            review_request=rr, score=rnd.randint(0, 50) / 10, comment="Отзыв"
+        )
+        rr.status = 1
+        rr.save()
+        state.on_review_created(review)
+        return kind, rr.reviewer
+
+    if kind == "task":
+        task = Task.create(
+            implementer=rnd.randint(1, _max_id(User)),
+            theme=rnd.randint(1, _max_id(Theme)),
+            due_date=datetime.now(),
+        )
+        state.on_task_changed(task)
+        return kind, task.implementer
+
+    task = Task.select().where(Task.status == 0).order_by(fn.Random()).first()
+    if task is None:
+        return kind, None
+    if kind == "drop":
+        task.status = -1
+        task.save()
+        state.on_task_changed(task)
+    else:
+        video = Video.create(task=task, file_id=0, duration=300)
+        task.status = 1
+        task.save()
+        state.on_video_uploaded(video)
+    return kind, task.implementer
+
+
+@with_database
+def bench_incremental(args):
+    """Стоимость рейтинга на событие: пересчёт по пользователю
+    и инкрементальные агрегаты, в конце сверка с полным пересчётом"""
+    rnd = random.Random(0)
+    state = RatingState().load()
+    full, incremental = [], []
+    for _ in range(args.updates):
+        kind, user = _apply_random_event(state, rnd)
+        if user is None:
+            continue
+        if kind in ("review", "expire"):
+            full_update, state_update = (
+                user.update_reviewer_rating,
+                state.update_reviewer_rating,
+            )
+        else:
+            full_update, state_update = (
+                user.update_bloger_rating,
+                state.update_bloger_rating,
+            )
+        started = time.perf_counter()
+        if len(full) < args.sample:
+            full_update()
+            full.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        state_update(user)
+        incremental.append(time.perf_counter() - started)
+    print_latency("full", full)
+    print_latency("incremental", incremental)
+
+    mismatches = check_consistency(state)
+    print(f"mismatches={len(mismatches)}")
+    checked = check_review_hours(RatingEngine().load(), list(User.select()))
+    print(f"review_hours checked={checked}")
+    for mismatch in mismatches[:10]:
+        print(mismatch)
+
+
+class _FakeBot:
+    """Бот с задержкой ответа Telegram. Первый ответ — RetryAfter,
+    первое сообщение в чат 0 — сетевая ошибка"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.delivered: Dict[int, List[int]] = {}
+        self.flood = True
+        self.network_error = True
+
+    async def send_message(self, chat_id: int, text: str, **_):
+        """Имитирует отправку сообщения"""
+        await asyncio.sleep(self.latency)
+        method = SendMessage(chat_id=chat_id, text=text)
+        if self.flood:
+            self.flood = False
+            raise TelegramRetryAfter(
+                method=method,
+                message="Flood control exceeded",
+                retry_after=1,
+            )
+        if self.network_error and chat_id == 0:
+            self.network_error = False
+            raise TelegramNetworkError(method=method, message="Timeout")
+        self.delivered.setdefault(chat_id, []).append(int(text))
+
+    @property
+    def sent(self) -> int:
+        """Число доставленных сообщений"""
+        return sum(len(texts) for texts in self.delivered.values())
+
+
+async def _wait_outbox(box: Outbox, timeout: float = 60) -> float:
+    """Ждёт опустошения очереди, возвращает время ожидания"""
+    started = time.perf_counter()
+    while await run_db(box.get_pending_count):
+        if time.perf_counter() - started > timeout:
+            raise AssertionError("Очередь не опустела")
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+
+def _check_order(bot: _FakeBot):
+    """Сообщения каждого чата доставлены по порядку постановки"""
+    for chat_id, texts in bot.delivered.items():
+        if texts != sorted(texts):
+            raise AssertionError(f"Нарушен порядок в чате {chat_id}")
+
+
+async def _outbox_latency(admins: int, latency: float):
+    """Время возврата управления обработчику: по очереди и outbox"""
+    bot = _FakeBot(latency)
+    bot.flood = bot.network_error = False
+    started = time.perf_counter()
+    for chat_id in range(admins):
+        await bot.send_message(chat_id=chat_id, text="0")
+    print(
+        f"{'sequential':<12} admins={admins:<4} "
+        f"handler={(time.perf_counter() - started) * 1000:8.2f}ms"
+    )
+
+    bot = _FakeBot(latency)
+    box = Outbox(poll_interval=0.2, limiter=Notifier())
+    started = time.perf_counter()
+    await box.send_many("send_message", range(admins), text="0")
+    returned = time.perf_counter() - started
+    box.start(bot)
+    await _wait_outbox(box)
+    await box.stop()
+    print(
+        f"{'outbox':<12} admins={admins:<4} "
+        f"handler={returned * 1000:8.2f}ms "
+        f"delivered={bot.sent} in {time.perf_counter() - started:.2f}s "
+        "(с одним RetryAfter 1s и одной сетевой ошибкой)"
+    )
+
+
+async def _outbox_burst(chats: int, per_chat: int, latency: float):
+    """Пачка сообщений в несколько чатов с остановкой посередине:
+    порядок в чатах и доставка после перезапуска"""
+    bot = _FakeBot(latency)
+    box = Outbox(poll_interval=0.2, limiter=Notifier())
+    for number in range(per_chat):
+        await box.send_many("send_message", range(chats), text=str(number))
+    box.start(bot)
+    await asyncio.sleep(1.5)
+    await box.stop()
+    pending = await run_db(box.get_pending_count)
+
+    restarted = Outbox(poll_interval=0.2, limiter=Notifier())
+    restarted.start(bot)
+    elapsed = await _wait_outbox(restarted)
+    await restarted.stop()
+    _check_order(bot)
+    total = chats * per_chat
+    if bot.sent < total:
+        raise AssertionError(f"Доставлено {bot.sent} из {total}")
+    print(
+        f"burst        messages={total:<5} pending_after_stop={pending:<5} "
+        f"drained_after_restart={elapsed:.2f}s "
+        f"delivered={bot.sent} (повторов {bot.sent - total}) "
+        f"retried={box.retried + restarted.retried}"
+    )
+
+
+async def _outbox_stress(chats: int, per_chat: int, workers: int):
+    """Пачка сообщений без ограничителя частоты и с частыми выборками:
+    сообщение, отправленное во время выборки, не отправляется снова"""
+    bot = _FakeBot(0)
+    bot.flood = bot.network_error = False
+    unlimited = Notifier(global_rate=1e9, chat_rate=1e9)
+    box = Outbox(workers=workers, poll_interval=0.01, limiter=unlimited)
+    for number in range(per_chat):
+        await box.send_many("send_message", range(chats), text=str(number))
+    box.start(bot)
+    elapsed = await _wait_outbox(box)
+    await box.stop()
+    _check_order(bot)
+    total = chats * per_chat
+    if bot.sent != total:
+        raise AssertionError(f"Доставлено {bot.sent} из {total}")
+    print(
+        f"stress       messages={total:<5} workers={workers:<3} "
+        f"drained={elapsed:.2f}s delivered={bot.sent}"
+    )
+
+
+@with_database
+def bench_outbox(args):
+    """Очередь исходящих сообщений: задержка обработчика, порядок
+    сообщений в чатах и доставка после перезапуска"""
+    for admins in (1, args.admins):
+        asyncio.run(_outbox_latency(admins, latency=0.05))
+    asyncio.run(_outbox_burst(args.admins, per_chat=5, latency=0.05))
+    asyncio.run(_outbox_stress(chats=10, per_chat=40, workers=8))
+
+
+def _check_tags(messages: List[str]):
+    """Разрыв сообщений не попал внутрь тегов: в каждом сообщении
+    теги закрыты"""
+    for text in messages:
+        for tag in ("a", "b"):
+            opened = len(re.findall(rf"<{tag}[ >]", text))
+            if opened != text.count(f"</{tag}>"):
+                raise AssertionError(f"Тег <{tag}> разрезан: {text[-80:]!r}")
+
+
+def bench_digest(args):
+    """Число сообщений администраторам за час пиковой нагрузки:
+    по одному на уведомление и сводками"""
+    rnd = random.Random(0)
+    categories = list(CATEGORIES)
+    for events in (args.sample, args.updates):
+        digest = Digest()
+        for number in range(events):
+            link = f'<a href="https://t.me/user{number}">Пользователь</a>'
+            digest.add(
+                rnd.choice(categories),
+                f"<b>Событие {number}</b>\n{link}\n" + "текст " * 20,
+            )
+        # Одно уведомление длиннее лимита: список из многих строк
+        digest.add(
+            "other",
+            "\n".join(
+                f'<a href="https://t.me/user{number}">Пользователь</a> '
+                + "<b>текст</b> " * 5
+                for number in range(events)
+            ),
+        )
+        messages = digest.pop_messages()
+        longest = max(len(text) for text in messages)
+        if longest > MESSAGE_LIMIT:
+            raise AssertionError(f"Сообщение длиннее лимита: {longest}")
+        _check_tags(messages)
+        print(
+            f"events={events:<5} admins={args.admins:<3} "
+            f"single={events * args.admins:<6} "
+            f"digest={len(messages) * args.admins:<5} "
+            f"longest={longest}"
+        )
+
+
+async def _expire_tasks(_bot, _since: datetime, now: datetime):
+    """Обработчик срока задач: запрос по диапазону, как check_expired_task"""
+    Task.update(status=-2).where(
+        (Task.status == 0) & (Task.due_date <= now)
+    ).execute()
+
+
+def _get_late_wakeups(start: datetime, hours: int) -> List[datetime]:
+    """Ежечасные пробуждения на секунду позже начала часа, одно из
+    которых опоздало больше чем на час"""
+    wakeups = []
+    now = start
+    while now < start + timedelta(hours=hours):
+        now += timedelta(hours=1, seconds=1)
+        if len(wakeups) == hours // 2:
+            now += timedelta(minutes=61)
+        wakeups.append(now)
+        now = now.replace(second=0)
+    return wakeups
+
+
+def _create_due_tasks(due_dates: List[datetime], users: int) -> List[int]:
+    """Закрывает выданные задачи и выдаёт новые с указанными сроками"""
+    rnd = random.Random(1)
+    Task.update(status=2).where(Task.status == 0).execute()
+    return [
+        Task.create(
+            implementer=rnd.randint(1, users),
+            theme=rnd.randint(1, _max_id(Theme)),
+            due_date=due_date,
+        ).id
+        for due_date in due_dates
+    ]
+
+
+def _count_open(task_ids: List[int]) -> int:
+    """Число задач, оставшихся выданными"""
+    return (
+        Task.select().where((Task.id << task_ids) & (Task.status == 0)).count()
+    )
+
+
+async def _run_due(sched: Scheduler):
+    """Запускает наступившие события и дожидается обработчиков"""
+    await asyncio.gather(*sched.run_due(None))
+
+
+def _run_scheduler(task_ids: List[int], start: datetime) -> int:
+    """Прогоняет планировщик с подменёнными часами до последнего срока,
+    четвёртое пробуждение опаздывает больше чем на час"""
+    clock = [start]
+    sched = Scheduler(clock=lambda: clock[0], jobs=Supervisor())
+    sched.register(TASK_DUE, _expire_tasks)
+    for task in Task.select().where(Task.id << task_ids):
+        sched.schedule(TASK_DUE, task.due_date)
+    runs = 0
+    while sched.get_next_time() is not None:
+        clock[0] = sched.get_next_time() + timedelta(seconds=1)
+        if runs == 3:
+            clock[0] += timedelta(minutes=61)
+        asyncio.run(_run_due(sched))
+        runs += 1
+    return runs
+
+
+@with_database
+def bench_scheduler(args):
+    """Просроченные задачи при опоздавшем пробуждении: сравнение
+    на равенство каждый час и планировщик с запросом по диапазону"""
+    hours = 48
+    rnd = random.Random(0)
+    start = get_next_time(datetime.now()) - timedelta(hours=1)
+    due_dates = [
+        start + timedelta(hours=rnd.randint(1, hours - 2))
+        for _ in range(args.sample * 10)
+    ]
+
+    task_ids = _create_due_tasks(due_dates, args.users)
+    wakeups = _get_late_wakeups(start, hours)
+    for now in wakeups:
+        dd = now.replace(minute=0, second=0)
+        Task.update(status=-2).where(
+            (Task.status == 0) & (Task.due_date == dd)
+        ).execute()
+    print(
+        f"{'hourly':<10} wakeups={len(wakeups):<4} "
+        f"missed={_count_open(task_ids)}"
+    )
+
+    task_ids = _create_due_tasks(due_dates, args.users)
+    runs = _run_scheduler(task_ids, start)
+    missed = _count_open(task_ids)
+    print(f"{'scheduler':<10} wakeups={runs:<4} missed={missed}")
+    if missed:
+        raise AssertionError(f"Планировщик пропустил задачи: {missed}")
+
+
+async def _supervise(jobs: Supervisor, runs: int) -> int:
+    """Запускает медленную задачу чаще, чем она выполняется, и задачу
+    с ошибкой. Возвращает наибольшее число одновременных запусков"""
+    active = [0, 0]
+
+    async def slow():
+        active[0] += 1
+        active[1] = max(active)
+        await asyncio.sleep(0.25)
+        active[0] -= 1
+
+    async def failing():
+        raise RuntimeError("Ошибка задачи")
+
+    for _ in range(runs):
+        jobs.start("slow", slow)
+        jobs.start("failing", failing)
+        await asyncio.sleep(0.1)
+    await jobs.wait()
+    jobs.start("slow", slow)
+    await asyncio.sleep(0.05)
+    await jobs.stop()
+    return active[1]
+
+
+def bench_jobs(args):
+    """Надзор за фоновыми задачами: запуски не накладываются,
+    ошибки и отмена при остановке записываются"""
+    jobs = Supervisor()
+    peak = asyncio.run(_supervise(jobs, args.sample // 5))
+    print(jobs.get_report().replace("<b>", "").replace("</b>", ""))
+    print(f"peak_concurrent={peak}")
+    if peak != 1:
+        raise AssertionError(f"Запуски задачи наложились: {peak}")
+
+
+def _legacy_assign(bloger_role_id: int) -> List[Task]:
+    """Прежний send_task без уведомлений: запросы на каждого блогера
+    и каждый курс"""
+    blogers = {
+        user_role.user
+        for user_role in UserRole.select(UserRole.user).where(
+            UserRole.role == bloger_role_id
+        )
+    }
+    active = set(Task.select(Task).where(Task.status.in_([0, 1])))
+    blogers -= {task.implementer for task in active}
+    courses = set(Course.select()) - {task.theme.course for task in active}
+    course_ids = [course.id for course in courses]
+    created = []
+    for bloger in sorted(
+        blogers, key=lambda user: user.bloger_rating, reverse=True
+    ):
+        by_bloger = {
+            user_course.course
+            for user_course in UserCourse.select().where(
+                (UserCourse.user == bloger.id)
+                & (UserCourse.course.in_(course_ids))
+            )
+        } & courses
+        for course in sorted(
+            by_bloger,
+            key=lambda course, blogger=bloger: (
+                Task.select(fn.AVG(Task.score))
+                .join(Theme)
+                .where(
+                    (Theme.course == course.id)
+                    & (Task.implementer == blogger.id)
+                )
+                .scalar()
+                or 0.8
+            ),
+            reverse=True,
+        ):
+            themes = set(
+                Theme.select().where(Theme.course == course.id)
+            ) - set(
+                Theme.select()
+                .join(Task)
+                .where((Task.status >= 0) & (Theme.course == course.id))
+            )
+            if not themes:
+                continue
+            theme = min(themes, key=lambda theme: theme.id)
+            created.append(
+                Task.create(
+                    implementer=bloger,
+                    theme=theme,
+                    due_date=get_due_date(get_task_hours(theme)),
+                )
+            )
+            break
+    return created
+
+
+def _run_assignment(title: str, assign: Callable[[], List[Task]]):
+    """Выдаёт темы в транзакции, которая затем откатывается.
+    Возвращает пары (ID блогера, ID темы)"""
+    with db.atomic() as transaction:
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            tasks = assign()
+            elapsed = time.perf_counter() - started
+        pairs = [(task.implementer_id, task.theme_id) for task in tasks]
+        shared = (
+            Task.select(Theme.course)
+            .join(Theme)
+            .where(Task.status.in_([0, 1]))
+            .group_by(Theme.course)
+            .having(fn.COUNT(Task.id) > 1)
+            .count()
+        )
+        transaction.rollback()
+    print(
+        f"{title:<8} tasks={len(pairs):<5} queries={counter.count:<6} "
+        f"{elapsed:8.3f}s courses_with_several_tasks={shared}"
+    )
+    return pairs, shared
+
+
+def _get_course_score(bloger_id: int, theme_id: int) -> float:
+    """Средняя оценка блогера по курсу темы, как в прежнем send_task"""
+    return (
+        Task.select(fn.AVG(Task.score))
+        .join(Theme)
+        .where(
+            (Theme.course == Theme.get_by_id(theme_id).course)
+            & (Task.implementer == bloger_id)
+        )
+        .scalar()
+        or 0.8
+    )
+
+
+@with_database
+def bench_assignment(_args):
+    """Выдача тем свободным блогерам: прежний алгоритм и TaskAssigner.
+    Перед замером все задачи в работе снимаются, поэтому свободны все
+    блогеры и все курсы"""
+    rnd = random.Random(0)
+    with db.atomic():
+        query = Task.update(status=-1).where(Task.status.in_([0, 1]))
+        query.execute()  # pylint: disable=no-value-for-parameter
+        # Различные рейтинги: порядок блогеров не зависит от порядка в set
+        for user in User.select(User.id):
+            user.bloger_rating = rnd.random()
+            user.save(only=[User.bloger_rating])
+    legacy, _ = _run_assignment(
+        "legacy", functools.partial(_legacy_assign, BLOGER_ROLE_ID)
+    )
+    engine, shared = _run_assignment(
+        "engine", TaskAssigner(BLOGER_ROLE_ID).assign
+    )
+    if shared or len({bloger for bloger, _ in engine}) != len(engine):
+        raise AssertionError("Курсу или блогеру выдано несколько задач")
+    if not legacy or not engine:
+        # При малых --courses/--themes свободных тем может не остаться
+        if legacy or engine:
+            raise AssertionError(
+                f"Выдано задач: прежним {len(legacy)}, движком {len(engine)}"
+            )
+        print("Свободных тем нет, сравнение первой выдачи пропущено")
+        return
+    # Среди курсов с равной оценкой прежний алгоритм выбирал
+    # произвольный, поэтому сравниваются блогер и оценка курса
+    first = [
+        (bloger_id, _get_course_score(bloger_id, theme_id))
+        for bloger_id, theme_id in (legacy[0], engine[0])
+    ]
+    if first[0] != first[1]:
+        raise AssertionError(f"Первая выдача различается: {first}")
+
+
+def _legacy_review_requests(limit: int) -> List[ReviewRequest]:
+    """Прежние send_new_review_request и add_reviewer без уведомлений:
+    каждый шаг заново ищет видео и свободных проверяющих"""
+    created = []
+    while ReviewRequest.select().where(ReviewRequest.status == 0).count() < (
+        limit
+    ):
+        video_ids = [
+            v.id
+            for v in Video.select(Video)
+            .join(
+                ReviewRequest,
+                JOIN.LEFT_OUTER,
+                on=(ReviewRequest.video == Video.id),
+            )
+            .join(Task, on=Task.id == Video.task)
+            .join(User, on=User.id == Task.implementer)
+            .where(
+                (Task.status == 1)
+                & (
+                    (ReviewRequest.status >= 0)
+                    | (ReviewRequest.status.is_null())
+                )
+            )
+            .group_by(Video.id)
+            .order_by(User.bloger_rating.desc())
+            .having(fn.COUNT(Video.id) < 5)
+        ]
+        if not video_ids:
+            break
+        video = Video.get_by_id(video_ids[0])
+        jobs_ids = [
+            u.id
+            for u in User.select(User)
+            .join(ReviewRequest)
+            .where(ReviewRequest.status == 0)
+            .group_by(ReviewRequest.reviewer)
+        ]
+        vacant = [
+            u.id
+            for u in User.select(User)
+            .join(UserRole)
+            .where(UserRole.role == REVIEWER_ROLE_ID)
+            .order_by(User.reviewer_rating.desc())
+            if u.id not in jobs_ids and u.id != video.task.implementer_id
+        ]
+        reviewed = {
+            rr.reviewer_id
+            for rr in ReviewRequest.select(ReviewRequest.reviewer)
+            .join(Video, on=Video.id == ReviewRequest.video)
+            .join(Task, on=Task.id == Video.task)
+            .where(Task.theme == video.task.theme_id)
+        }
+        candidates = [i for i in vacant if i not in reviewed]
+        if not candidates:
+            break
+        created.append(
+            ReviewRequest.create(
+                reviewer=candidates[0],
+                video=video,
+                due_date=get_due_date(25),
+            )
+        )
+    return created
+
+
+def _check_review_requests(
+    limit: int, capacity: ReviewCapacity = ReviewCapacity()
+):
+    """Открытых запросов не больше limit, у проверяющего не больше,
+    чем позволяет capacity, никто не проверяет своё видео и одну тему
+    дважды"""
+    rows = list(
+        ReviewRequest.select(
+            ReviewRequest.reviewer, Task.implementer, Task.theme
+        )
+        .join(Video)
+        .join(Task)
+        .where(ReviewRequest.status == 0)
+        .tuples()
+    )
+    ratings = dict(
+        User.select(User.id, User.reviewer_rating)
+        .where(User.id.in_({reviewer for reviewer, _, _ in rows}))
+        .tuples()
+    )
+    opened = Counter(reviewer for reviewer, _, _ in rows)
+    if len(rows) > limit or any(
+        count > capacity.get_parallel(ratings[reviewer])
+        for reviewer, count in opened.items()
+    ):
+        raise AssertionError("Превышено число открытых запросов")
+    if any(reviewer == implementer for reviewer, implementer, _ in rows):
+        raise AssertionError("Проверяющему выдано его же видео")
+    twice = (
+        ReviewRequest.select(ReviewRequest.reviewer, Task.theme)
+        .join(Video)
+        .join(Task)
+        .where(ReviewRequest.status >= 0)
+        .group_by(ReviewRequest.reviewer, Task.theme)
+        .having(fn.COUNT(ReviewRequest.id) > 1)
+    )
+    new = {(reviewer, theme) for reviewer, _, theme in rows}
+    if any(key in new for key in twice.tuples()):
+        raise AssertionError("Проверяющему выдана уже проверенная тема")
+
+
+def _run_review_assignment(
+    title: str,
+    limit: int,
+    assign: Callable[[], List[ReviewRequest]],
+    capacity: ReviewCapacity = ReviewCapacity(),
+) -> int:
+    """Назначает проверяющих в транзакции, которая затем откатывается.
+    Возвращает число новых запросов"""
+    with db.atomic() as transaction:
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            created = len(assign())
+            elapsed = time.perf_counter() - started
+        _check_review_requests(limit, capacity)
+        transaction.rollback()
+    print(
+        f"{title:<8} limit={limit:<5} requests={created:<5} "
+        f"queries={counter.count:<6} {elapsed:8.3f}s"
+    )
+    return created
+
+
+@with_database
+def bench_reviewers(args):
+    """Назначение проверяющих: рекурсивное по одному и ReviewAssigner.
+    Лимит открытых запросов равен --sample, чтобы заполнить много мест"""
+    for limit in (5, args.sample):
+        legacy = _run_review_assignment(
+            "legacy", limit, functools.partial(_legacy_review_requests, limit)
+        )
+        batch = _run_review_assignment(
+            "batch",
+            limit,
+            ReviewAssigner(
+                ReviewerPool(), ReviewCapacity(concurrency=limit)
+            ).assign,
+        )
+        if batch < legacy:
+            raise AssertionError(
+                f"Назначено меньше, чем прежде: {batch} < {legacy}"
+            )
+
+
+def _legacy_pick(theme_id: int, implementer_id: int) -> int:
+    """Выбор проверяющего прежним add_reviewer: два запроса и поиск
+    по спискам"""
+    reviewer_ids = [
+        u.id
+        for u in User.select(User)
+        .join(UserRole)
+        .where(UserRole.role == REVIEWER_ROLE_ID)
+        .order_by(User.reviewer_rating.desc())
+    ]
+    jobs_ids = [
+        u.id
+        for u in User.select(User)
+        .join(ReviewRequest)
+        .where(ReviewRequest.status == 0)
+        .group_by(ReviewRequest.reviewer)
+    ]
+    reviewed = [
+        rr.reviewer_id
+        for rr in ReviewRequest.select(ReviewRequest.reviewer)
+        .join(Video)
+        .join(Task)
+        .where(Task.theme == theme_id)
+        .group_by(ReviewRequest.reviewer)
+    ]
+    return next(
+        (
+            i
+            for i in reviewer_ids
+            if i not in jobs_ids and i != implementer_id and i not in reviewed
+        ),
+        None,
+    )
+
+
+def _apply_pool_event(pool: ReviewerPool, rnd: random.Random):
+    """Случайное изменение запросов или рейтинга, переданное пулу"""
+    kind = rnd.choice(("create", "create", "close", "delete", "rating"))
+    if kind == "create":
+        video = Video.get_by_id(rnd.randint(1, _max_id(Video)))
+        reviewer_id = pool.pick(
+            video.task.theme_id, (video.task.implementer_id,)
+        )
+        if reviewer_id is not None:
+            rr = ReviewRequest.create(
+                reviewer=reviewer_id, video=video, due_date=datetime.now()
+            )
+            pool.on_request_changed(rr)
+        return
+    if kind == "rating":
+        user = User.get_by_id(rnd.randint(1, _max_id(User)))
+        user.reviewer_rating = rnd.random()
+        user.save()
+        pool.on_rating_changed(user)
+        return
+    rr = (
+        ReviewRequest.select()
+        .where(ReviewRequest.status == 0)
+        .order_by(fn.RANDOM())
+        .first()
+    )
+    if rr is None:
+        return
+    if kind == "delete":
+        pool.on_request_deleted(rr)
+        rr.delete_instance(recursive=True)
+        return
+    rr.status = rnd.choice((-1, 1))
+    rr.save()
+    pool.on_request_changed(rr)
+
+
+def _time_picks(
+    title: str, pick: Callable[[int, int], int], videos: List[Video]
+) -> List[int]:
+    """Выбирает проверяющего на каждое видео и печатает стоимость"""
+    with QueryCounter() as counter:
+        started = time.perf_counter()
+        picked = [
+            pick(video.task.theme_id, video.task.implementer_id)
+            for video in videos
+        ]
+        elapsed = time.perf_counter() - started
+    print(
+        f"{title:<8} picks={len(videos):<5} queries={counter.count:<6} "
+        f"{elapsed / len(videos) * 1000:8.3f}ms/pick"
+    )
+    return picked
+
+
+@with_database
+def bench_pool(args):
+    """Пул проверяющих: выбор против запросов прежнего add_reviewer и
+    совпадение с перезагрузкой после потока изменений"""
+    rnd = random.Random(0)
+    videos = list(
+        Video.select(Video, Task).join(Task).order_by(fn.RANDOM()).limit(200)
+    )
+    pool = ReviewerPool().load()
+    expected = _time_picks("legacy", _legacy_pick, videos)
+    picked = _time_picks(
+        "pool",
+        lambda theme_id, author_id: pool.pick(theme_id, {author_id}),
+        videos,
+    )
+    if picked != expected:
+        raise AssertionError("Пул выбирает не тех проверяющих")
+
+    for _ in range(args.updates):
+        _apply_pool_event(pool, rnd)
+    fresh = ReviewerPool().load()
+    themes = [video.task.theme_id for video in videos]
+    if pool.get_vacant_ids() != fresh.get_vacant_ids() or [
+        pool.pick(theme_id) for theme_id in themes
+    ] != [fresh.pick(theme_id) for theme_id in themes]:
+        raise AssertionError("Пул разошёлся с БД")
+    print(
+        f"events={args.updates} vacant={len(fresh.get_vacant_ids())} "
+        "pool matches reload"
+    )
+
+
+def _run_capacity(title: str, capacity: ReviewCapacity):
+    """Назначает проверяющих по модели capacity в откатываемой
+    транзакции и печатает загрузку и ожидаемое время до оценки"""
+    pool = ReviewerPool(capacity).load()
+    slots = pool.get_total_slots()
+    with db.atomic() as transaction:
+        before = ReviewQueue(capacity).load()
+        started = time.perf_counter()
+        assigner = ReviewAssigner(pool, capacity)
+        created = len(assigner.assign())
+        elapsed = time.perf_counter() - started
+        _check_review_requests(capacity.get_limit(slots), capacity)
+        after = ReviewQueue(capacity).load()
+        transaction.rollback()
+    limit = capacity.get_limit(slots)
+    verdict = after.get_verdict_hours(limit)
+    print(
+        f"{title:<10} slots={slots:<5} limit={limit:<5} "
+        f"requests={created:<5} open={after.open_count:<5} "
+        f"load={after.open_count / limit if limit else 0:5.0%} "
+        f"unassigned={before.unassigned}->{after.unassigned:<6} "
+        f"verdict={verdict or 0:7.1f}h {elapsed:8.3f}s"
+    )
+
+
+@with_database
+def bench_capacity(_args):
+    """Модель пропускной способности: прежние 5 запросов на всех и по
+    одному на проверяющего против модели без общего ограничения со
+    ступенями по рейтингу"""
+    rnd = random.Random(0)
+    with db.atomic():
+        for user in User.select(User.id):
+            user.reviewer_rating = rnd.random()
+            user.save(only=[User.reviewer_rating])
+    _run_capacity("default", ReviewCapacity(concurrency=5, parallel="1"))
+    _run_capacity(
+        "tiers", ReviewCapacity(concurrency=0, parallel="0:1,0.5:2,0.8:3")
+    )
+
+
+def _legacy_limit_score() -> float:
+    """Прежний get_limit_score без вывода: оценки всех законченных
+    задач"""
+    score_data = [
+        t.score
+        for t in Task.select(Task.score)
+        .where(Task.status.not_in([0, 1, -1]))
+        .order_by(Task.id.desc())
+    ][:100]
+    score_data.sort()
+    return score_data[len(score_data) // 4]
+
+
+def _apply_task_event(threshold: AcceptanceThreshold, rnd: random.Random):
+    """Случайная смена статуса задачи, записанная в БД и переданная
+    порогу"""
+    kind = rnd.choice(["score", "score", "score", "publish", "expire", "drop"])
+    if kind == "score":
+        task = Task.create(
+            implementer=rnd.randint(1, _max_id(User)),
+            theme=rnd.randint(1, _max_id(Theme)),
+            due_date=datetime.now(),
+            score=rnd.random(),
+        )
+        task.status = 2 if task.score >= threshold.get_threshold() else -2
+    else:
+        statuses = {"publish": [2], "expire": [0], "drop": [0]}
+        task = (
+            Task.select()
+            .where(Task.status.in_(statuses.get(kind, [2, -2])))
+            .order_by(fn.Random())
+            .first()
+        )
+        if task is None:
+            return
+        task.status = {"publish": 3, "expire": -2, "drop": -1}[kind]
+    task.save()
+    threshold.on_task_changed(task)
+
+
+@with_database
+def bench_acceptance(args):
+    """Порог приёма работы: прежний get_limit_score против окна
+    в памяти, сверка после каждого события и после повторного открытия
+    задачи из окна"""
+    rnd = random.Random(0)
+    threshold = AcceptanceThreshold().load()
+    legacy, window = [], []
+    with QueryCounter() as legacy_queries:
+        for _ in range(args.sample):
+            started = time.perf_counter()
+            _legacy_limit_score()
+            legacy.append(time.perf_counter() - started)
+    with QueryCounter() as window_queries:
+        for _ in range(args.sample):
+            started = time.perf_counter()
+            threshold.get_threshold()
+            window.append(time.perf_counter() - started)
+    print_latency("legacy", legacy)
+    print_latency("window", window)
+    print(
+        f"queries legacy={legacy_queries.count} window={window_queries.count}"
+    )
+
+    for _ in range(args.updates):
+        _apply_task_event(threshold, rnd)
+        if threshold.get_threshold() != _legacy_limit_score():
+            raise AssertionError("Порог разошёлся с БД")
+    # Задача из окна снова на проверке: окно перечитывается
+    task = Task.get_by_id(
+        Task.select(fn.MAX(Task.id)).where(Task.status.in_([2, -2, 3]))
+    )
+    task.status = 1
+    task.save()
+    threshold.on_task_changed(task)
+    if threshold.get_threshold() != _legacy_limit_score():
+        raise AssertionError("Порог разошёлся с БД после открытия задачи")
+    print(f"events={args.updates} threshold matches legacy")
+
+
+def _legacy_catalogue_text(result: Dict[int, Dict]) -> str:
+    """Прежний get_text_by_result"""
+    text = "<b>Список курсов</b>\n"
+    for course in result.values():
+        text += (
+            f"\n<b>{course['title']}</b>|{course['bloger_count']} желающих\n"
+        )
+        text += "".join(course["themes"])
+    return text
+
+
+def _legacy_catalogue(user_id: int) -> Tuple[str, List[str]]:
+    """Прежний get_data_by_courses: запросы по каждому курсу и полная
+    отрисовка текста на каждую тему. Возвращает текст и callback_data
+    кнопок"""
+    themes_done = Theme.select(Theme.id).join(Task).where(Task.status >= 2)
+    data: Dict[int, Dict] = {}
+    for row in (
+        Course.select(
+            Course.id.alias("course_id"),
+            Course.title.alias("course_title"),
+            Theme.title.alias("theme_title"),
+            Theme.url.alias("theme_url"),
+            Theme.complexity.alias("theme_complexity"),
+        )
+        .join(Theme, on=Theme.course == Course.id)
+        .where(~Theme.id << themes_done)
+        .order_by(Course.id, Theme.id)
+        .dicts()
+    ):
+        if row["course_id"] not in data:
+            user_course = UserCourse.get_or_none(
+                user=user_id, course=row["course_id"]
+            )
+            data[row["course_id"]] = {
+                "title": row["course_title"],
+                "themes": [],
+                "bloger_count": (
+                    UserCourse.select(fn.COUNT(UserCourse.id))
+                    .join(UserRole, on=UserRole.user == UserCourse.user)
+                    .where(
+                        (UserCourse.course_id == row["course_id"])
+                        & (UserRole.role_id == BLOGER_ROLE_ID)
+                    )
+                    .scalar()
+                ),
+                "callback_data": (
+                    f"{'del' if user_course else 'add'}_user_course_"
+                    f"{row['course_id']}"
+                ),
+            }
+        data[row["course_id"]]["themes"].append(
+            f'<a href="{row["theme_url"]}">{row["theme_title"]}</a>'
+            f'|{row["theme_complexity"]}\n'
+        )
+    course_ids = sorted(
+        data,
+        key=lambda k: -data[k]["bloger_count"] * 10 + len(data[k]["themes"]),
+    )
+    result: Dict[int, Dict] = {}
+    theme_ind = -1
+    run = True
+    while run:
+        run = False
+        theme_ind += 1
+        for course_id in course_ids:
+            course = data[course_id]
+            if course_id not in result:
+                result[course_id] = {**course, "themes": []}
+            if theme_ind < len(course["themes"]):
+                theme_text = course["themes"][theme_ind]
+                if (
+                    len(_legacy_catalogue_text(result) + theme_text)
+                    >= MESSAGE_LIMIT
+                ):
+                    continue
+                run = True
+                result[course_id]["themes"].append(theme_text)
+    return _legacy_catalogue_text(result), [
+        data[course_id]["callback_data"] for course_id in course_ids
+    ]
+
+
+def _get_catalogue(
+    catalogue: CourseCatalogue, user_id: int, page: int = 0
+) -> Tuple[str, List[str]]:
+    """Текст и callback_data кнопок страницы списка курсов. Пользователь
+    не читается из БД, как и в обработчиках, где он уже загружен"""
+    data = catalogue.get_data(User(id=user_id), page)
+    return data["text"], [
+        button.callback_data
+        for row in data["reply_markup"].inline_keyboard
+        for button in row
+    ]
+
+
+def _time_catalogue(
+    title: str, show: Callable[[int], Tuple[str, List[str]]], user_ids
+) -> List[Tuple[str, List[str]]]:
+    """Показывает список курсов пользователям и печатает задержки
+    и число запросов"""
+    results, latencies = [], []
+    with QueryCounter() as counter:
+        for user_id in user_ids:
+            started = time.perf_counter()
+            results.append(show(user_id))
+            latencies.append(time.perf_counter() - started)
+    print_latency(title, latencies)
+    print(f"{'':<12} queries/show={counter.count / len(user_ids):.1f}")
+    return results
+
+
+def _check_pages(catalogue: CourseCatalogue, user_id: int):
+    """Страницы не длиннее лимита, а кнопки подписок всех страниц идут
+    в порядке прежнего списка"""
+    callbacks = []
+    for page in range(catalogue.get_page_count()):
+        text, page_callbacks = _get_catalogue(catalogue, user_id, page)
+        if len(text) > MESSAGE_LIMIT:
+            raise AssertionError(f"Страница {page} длиннее лимита")
+        callbacks += [
+            callback.rsplit("_", 1)[0]
+            for callback in page_callbacks
+            if not callback.startswith("courses_page_")
+        ]
+    if callbacks != _legacy_catalogue(user_id)[1]:
+        raise AssertionError("Кнопки страниц отличаются от прежних")
+
+
+def _toggle_subscriptions(
+    catalogue: CourseCatalogue,
+    user_ids: List[int],
+    courses: int,
+    rnd: random.Random,
+) -> List[float]:
+    """Пользователи переключают подписки на случайной странице, после
+    каждого переключения страница сверяется с загруженной заново.
+    Возвращает задержки переключений"""
+    toggles = []
+    for user_id in user_ids:
+        user = User.get_by_id(user_id)
+        course_id = rnd.randint(1, courses)
+        page = rnd.randrange(catalogue.get_page_count())
+        started = time.perf_counter()
+        user_course = UserCourse.get_or_none(user=user, course=course_id)
+        if user_course:
+            user_course.delete_instance()
+            catalogue.on_subscription_changed(user, course_id, -1)
+        else:
+            UserCourse.create(user=user, course=course_id)
+            catalogue.on_subscription_changed(user, course_id, 1)
+        shown = _get_catalogue(catalogue, user_id, page)
+        toggles.append(time.perf_counter() - started)
+        if shown != _get_catalogue(CourseCatalogue(), user_id, page):
+            raise AssertionError("Страница разошлась с БД")
+    return toggles
+
+
+@with_database
+def bench_catalogue(args):
+    """Список курсов /courses: прежняя сборка всего списка на каждый
+    показ против общего кэша страниц. Переключение подписки
+    перерисовывает только текущую страницу"""
+    rnd = random.Random(0)
+    user_ids = [rnd.randint(1, args.users) for _ in range(args.sample)]
+    catalogue = CourseCatalogue()
+    legacy = _time_catalogue("legacy", _legacy_catalogue, user_ids)
+    started = time.perf_counter()
+    catalogue.load()
+    print(f"{'load':<12} {(time.perf_counter() - started) * 1000:8.2f}ms")
+    _time_catalogue(
+        "page",
+        functools.partial(_get_catalogue, catalogue),
+        user_ids,
+    )
+    _check_pages(catalogue, user_ids[0])
+    # Первый показ: темы, число желающих и подписки, затем только подписки
+    for title, show_catalogue, expected in (
+        ("cold", CourseCatalogue(), 3),
+        ("warm", catalogue, 1),
+    ):
+        with QueryCounter() as counter:
+            _get_catalogue(show_catalogue, user_ids[0])
+        if counter.count != expected:
+            raise AssertionError(
+                f"Показ {title}: {counter.count} запросов вместо {expected}"
+            )
+
+    toggles = _toggle_subscriptions(catalogue, user_ids, args.courses, rnd)
+    print_latency("toggle", toggles)
+    print(
+        f"courses={args.courses} themes={args.themes} "
+        f"pages={catalogue.get_page_count()} legacy text={len(legacy[0][0])} "
+        "pages match legacy order"
+    )
+
+
+class _FakeMessage:
+    """Сообщение со списком курсов, считающее правки. Правка без
+    изменений завершается ошибкой, как в Telegram"""
+
+    def __init__(self, chat_id: int, data: Dict):
+        self.chat = User(id=chat_id)
+        self.message_id = 1
+        self.html_text = data["text"]
+        self.reply_markup = data["reply_markup"]
+        self.calls: Counter = Counter()
+
+    async def edit_text(self, text: str, reply_markup=None, **_):
+        """Правит текст и кнопки"""
+        self.calls["edit_text"] += 1
+        if text == self.html_text and reply_markup == self.reply_markup:
+            raise TelegramBadRequest(
+                method=SendMessage(chat_id=self.chat.id, text=text),
+                message="Bad Request: message is not modified",
+            )
+        self.html_text, self.reply_markup = text, reply_markup
+
+    async def edit_reply_markup(self, reply_markup=None):
+        """Правит только кнопки"""
+        self.calls["edit_reply_markup"] += 1
+        self.reply_markup = reply_markup
+
+
+async def _tap(
+    catalogue: CourseCatalogue,
+    message: _FakeMessage,
+    user: User,
+    data: str,
+    edit: Callable,
+):
+    """Нажатие кнопки списка курсов, как в обработчиках user.py"""
+    if data.startswith("courses_page_"):
+        page = int(data.rsplit("_", 1)[1])
+    else:
+        action, _, _, course_id, page = data.split("_")
+        course_id, page = int(course_id), int(page)
+        if action == "add":
+            _, created = UserCourse.get_or_create(user=user, course=course_id)
+            if created:
+                catalogue.on_subscription_changed(user, course_id, 1)
+        else:
+            user_course = UserCourse.get_or_none(user=user, course=course_id)
+            if user_course:
+                user_course.delete_instance()
+                catalogue.on_subscription_changed(user, course_id, -1)
+    try:
+        await edit(message, **catalogue.get_data(user, page))
+    except TelegramBadRequest:
+        message.calls["not_modified"] += 1
+
+
+def _get_tap_series(data: Dict, rnd: random.Random) -> List[str]:
+    """callback_data серии нажатий на первой странице списка курсов:
+    подписка на случайный курс страницы и её повтор, отписка и её
+    повтор, два перехода. Если на странице нет курсов, только переходы"""
+    buttons = [
+        row[0].callback_data
+        for row in data["reply_markup"].inline_keyboard
+        if "_user_course_" in row[0].callback_data
+    ]
+    series = ["courses_page_1", "courses_page_1"]
+    if not buttons:
+        return series
+    course_id = rnd.choice(buttons).split("_")[3]
+    return [
+        f"add_user_course_{course_id}_0",
+        f"add_user_course_{course_id}_0",
+        f"del_user_course_{course_id}_0",
+        f"del_user_course_{course_id}_0",
+    ] + series
+
+
+async def _run_taps(
+    title: str, user_ids: List[int], edit: Callable, rnd: random.Random
+) -> Counter:
+    """Серии быстрых нажатий: подписка, повторное нажатие той же
+    кнопки, отписка, её повтор и два перехода на следующую страницу"""
+    catalogue = CourseCatalogue().load()
+    calls: Counter = Counter()
+    taps = 0
+    started = time.perf_counter()
+    for user_id in user_ids:
+        user = User.get_by_id(user_id)
+        data = catalogue.get_data(user)
+        message = _FakeMessage(user.tg_id, data)
+        series = _get_tap_series(data, rnd)
+        for data in series:
+            await _tap(catalogue, message, user, data, edit)
+        taps += len(series)
+        calls += message.calls
+    elapsed = time.perf_counter() - started
+    print(
+        f"{title:<8} taps={taps} edit_text={calls['edit_text']} "
+        f"edit_reply_markup={calls['edit_reply_markup']} "
+        f"not_modified={calls['not_modified']} "
+        f"api_calls={calls['edit_text'] + calls['edit_reply_markup']} "
+        f"{elapsed:.3f}s"
+    )
+    return calls
+
+
+async def _legacy_edit(message: _FakeMessage, text: str, **options):
+    """Прежняя правка: всегда edit_text"""
+    await message.edit_text(text=text, **options)
+
+
+@with_database
+def bench_edits(args):
+    """Быстрые переключения подписок: правка каждого нажатия против
+    MessageEditor. У половины пользователей нет роли блогера, их
+    подписки не меняют текст списка, только кнопки"""
+    user_ids = random.Random(0).sample(range(1, args.users + 1), args.sample)
+    query = UserRole.delete().where(  # pylint: disable=no-value-for-parameter
+        (UserRole.role == BLOGER_ROLE_ID) & UserRole.user.in_(user_ids[::2])
+    )
+    query.execute()  # pylint: disable=no-value-for-parameter
+    legacy = asyncio.run(
+        _run_taps("legacy", user_ids, _legacy_edit, random.Random(1))
+    )
+    edited = asyncio.run(
+        _run_taps("editor", user_ids, MessageEditor().edit, random.Random(1))
+    )
+    if edited["not_modified"]:
+        raise AssertionError("Правка без изменений ушла в Telegram")
+    if (
+        edited["edit_text"] + edited["edit_reply_markup"]
+        >= legacy["edit_text"]
+    ):
+        raise AssertionError("Запросов к Telegram не стало меньше")
+
+
+def _write_import_csv(file, args, rnd: random.Random) -> int:
+    """CSV на args.rows строк: существующие темы без изменений,
+    с новым URL или сложностью, новые темы и курсы, у каждой сотой
+    строки — видео. Возвращает число изменённых тем"""
+    existing = {
+        (course, title): (url, complexity)
+        for course, title, url, complexity in Theme.select(
+            Course.title, Theme.title, Theme.url, Theme.complexity
+        )
+        .join(Course)
+        .tuples()
+    }
+    text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    course_count = args.courses * 10
+    changed = 0
+    for i in range(args.rows):
+        course, theme = f"Курс {i % course_count}", i // course_count
+        title = f"Тема {i % course_count}.{theme}"
+        url, complexity = existing.get(
+            (course, title),
+            (f"https://example.com/new/{i}", rnd.uniform(0.2, 2.0)),
+        )
+        if (course, title) in existing and rnd.random() < 0.5:
+            changed += 1
+            if rnd.random() < 0.5:
+                url += "?v=2"
+            else:
+                complexity = round(complexity + 0.1, 3)
+        row = [course, title, url, str(complexity).replace(".", ",")]
+        if i % 100 == 0:
+            row += [f"@user{rnd.randrange(args.users)}", "0,9"]
+        writer.writerow(row)
+    text.flush()
+    text.detach()
+    file.seek(0)
+    return changed
+
+
+def _legacy_import(rows: Iterable[List[str]]) -> List[Tuple]:
+    """Прежний _process_theme_rows: поиск и создание курса и темы
+    отдельными запросами на каждую строку вне транзакции"""
+    videos = []
+    for row in rows:
+        if not row[0]:
+            break
+        course, _ = Course.get_or_create(title=row[0])
+        url, complexity = row[2], float(row[3].replace(",", "."))
+        theme = Theme.get_or_none(course=course, title=row[1])
+        if not theme:
+            theme = Theme.create(
+                course=course, title=row[1], url=url, complexity=complexity
+            )
+        elif theme.url != url or theme.complexity != complexity:
+            theme.url, theme.complexity = url, complexity
+            theme.save()
+        if len(row) > 4 and row[4]:
+            videos.append((theme.id, theme.title, row[4:6]))
+    return videos
+
+
+def _get_import_result() -> Tuple[List[Tuple], List[Tuple]]:
+    """Курсы и темы БД для сравнения загрузок"""
+    return (
+        list(Course.select().order_by(Course.id).tuples()),
+        list(Theme.select().order_by(Theme.id).tuples()),
+    )
+
+
+def _time_import(title: str, file, load: Callable) -> Tuple:
+    """Загружает CSV и печатает время и число запросов"""
+    file.seek(0)
+    with QueryCounter() as counter:
+        started = time.perf_counter()
+        videos = load(read_csv_rows(file))
+        elapsed = time.perf_counter() - started
+    print(f"{title:<10} queries={counter.count:<7} {elapsed:8.3f}s")
+    return videos
+
+
+def _update_scores(title: str, user_ids: Iterable[int]) -> float:
+    """Пересчитывает баллы блогеров и печатает время"""
+    started = time.perf_counter()
+    for user in User.select().where(User.id.in_(list(user_ids))):
+        user.update_bloger_score()
+    elapsed = time.perf_counter() - started
+    print(f"{title:<10} {elapsed:8.3f}s")
+    return elapsed
+
+
+def _check_diff(diff: CourseDiff, importer: CourseImporter):
+    """Отличия, найденные до загрузки, совпадают с её итогом"""
+    expected = (
+        importer.created_courses,
+        importer.created_themes,
+        importer.updated_themes,
+        len(importer.videos),
+    )
+    found = (
+        diff.new_courses,
+        len(diff.entries[NEW]),
+        len(diff.entries[CHANGED]),
+        diff.videos,
+    )
+    if found != expected:
+        raise AssertionError(f"Отличия {found} вместо {expected}")
+
+
+def bench_import(args):
+    """Загрузка курсов и тем из CSV на args.rows строк: прежняя
+    построчная загрузка против CourseImporter. Обе загрузки идут
+    в одинаковые БД и должны дать одинаковые таблицы и видео.
+    Сравнение CourseDiff до загрузки предсказывает её итог"""
+    results = []
+    with tempfile.TemporaryFile() as file:
+        for title in ("legacy", "importer"):
+            with temporary_database(
+                args.users, courses=args.courses, themes=args.themes
+            ):
+                if not results:
+                    changed = _write_import_csv(file, args, random.Random(0))
+                    print(f"rows={args.rows} changed={changed}")
+                if title == "legacy":
+                    videos = _time_import(title, file, _legacy_import)
+                    _update_scores("scores all", range(1, args.users + 1))
+                else:
+                    diff = _time_import("diff", file, CourseDiff().compare)
+                    print(diff.get_report())
+                    importer = CourseImporter()
+                    _time_import(title, file, importer.import_rows)
+                    _check_diff(diff, importer)
+                    videos = importer.videos
+                    _update_scores("scores", importer.user_ids)
+                    print(importer.get_report())
+                    # Повторная загрузка того же файла ничего не меняет
+                    diff = _time_import(
+                        "diff again", file, CourseDiff().compare
+                    )
+                    if diff.entries[NEW] or diff.entries[CHANGED]:
+                        raise AssertionError("После загрузки остались отличия")
+                    _time_import(
+                        "repeat",
+                        file,
+                        CourseImporter().import_rows,
+                    )
+                results.append((_get_import_result(), videos))
+    if results[0] != results[1]:
+        raise AssertionError("Загрузки дали разные курсы, темы или видео")
+
+
+class _RecordingSession(BaseSession):
+    """Сессия бота без сети: запоминает вызовы методов"""
+
+    def __init__(self):
+        super().__init__()
+        self.sent: List = []
+
+    async def make_request(self, bot, method, timeout=None):
+        """Запоминает вызов вместо запроса к Telegram"""
+        self.sent.append(method)
+        return True
+
+    async def stream_content(self, *_, **__):
+        """Пустое содержимое файла"""
+        yield b""
+
+    async def close(self):
+        """Закрывать нечего"""
+
+
+def _get_dispatcher() -> Dispatcher:
+    """Диспетчер с роутерами и промежуточным обработчиком, как в app.py.
+    Модули обработчиков импортируются после создания временной БД:
+    фильтры читают роли при импорте. Роутер канала обрабатывает только
+    опросы и требует TG_CHANEL_ID, он не подключается"""
+    # pylint: disable=import-outside-toplevel
+    import admin
+    import bloger
+    import common
+    import reviewer
+    import user
+    from middlewares import UserContextMiddleware
+
+    dispatcher = Dispatcher()
+    dispatcher.message.outer_middleware(UserContextMiddleware())
+    dispatcher.callback_query.outer_middleware(UserContextMiddleware())
+    dispatcher.include_routers(
+        user.router,
+        bloger.router,
+        reviewer.router,
+        admin.router,
+        common.router,
+    )
+    return dispatcher
+
+
+def _make_update(update_id: int, user: User, data: str) -> Update:
+    """Сообщение или, для data вида "callback:...", нажатие кнопки"""
+    chat = Chat(id=user.tg_id, type="private")
+    from_user = TgUser(
+        id=user.tg_id, is_bot=False, first_name="x", username=user.username
+    )
+    if not data.startswith("callback:"):
+        return Update(
+            update_id=update_id,
+            message=Message(
+                message_id=update_id,
+                date=datetime.now(),
+                chat=chat,
+                from_user=from_user,
+                text=data,
+            ),
+        )
+    return Update(
+        update_id=update_id,
+        callback_query=CallbackQuery(
+            id=str(update_id),
+            from_user=from_user,
+            chat_instance="bench",
+            data=data.split(":", 1)[1],
+            message=Message(
+                message_id=update_id,
+                date=datetime.now(),
+                chat=chat,
+                text="x",
+            ),
+        ),
+    )
+
+
+async def _feed_updates(
+    dispatcher: Dispatcher, bot: Bot, user_ids: List[int]
+) -> Dict[Tuple[str, Tuple[int, ...]], List[int]]:
+    """Прогоняет обновления каждого вида от пользователей user_ids
+    через диспетчер и считает запросы на каждое обновление. Число
+    запросов зависит от ролей отправителя: фильтры ролей пропускают
+    обновление к разным обработчикам"""
+    counts: Dict[Tuple[str, Tuple[int, ...]], List[int]] = {}
+    update_id = 0
+    for data in UPDATE_KINDS:
+        for user_id in user_ids:
+            update_id += 1
+            user = User.get_by_id(user_id)
+            roles = tuple(
+                sorted(
+                    role_id
+                    for role_id, in UserRole.select(UserRole.role)
+                    .where(UserRole.user == user_id)
+                    .tuples()
+                )
+            )
+            update = _make_update(update_id, user, data)
+            with QueryCounter() as counter:
+                await dispatcher.feed_update(bot, update)
+            counts.setdefault((data, roles), []).append(counter.count)
+    return counts
+
+
+# Виды обновлений: команды, кнопки и текст без подходящего обработчика
+UPDATE_KINDS = (
+    "/start",
+    "/courses",
+    "callback:courses_page_0",
+    "/report",
+    "просто текст",
+)
+
+
+@with_database
+def bench_updates(args):
+    """Число запросов на обновление постоянно для вида обновления и ролей
+    отправителя и не зависит от его истории: пользователь и роли
+    загружаются один раз промежуточным обработчиком и общие для всех
+    роутеров и фильтров. Первый проход прогревает кэши"""
+    dispatcher = _get_dispatcher()
+    bot = Bot(token="123456:bench", session=_RecordingSession())
+    user_ids = random.Random(0).sample(range(1, args.users + 1), args.sample)
+    asyncio.run(_feed_updates(dispatcher, bot, user_ids[:1]))
+    counts = asyncio.run(_feed_updates(dispatcher, bot, user_ids))
+    for (data, roles), values in sorted(counts.items()):
+        print(
+            f"{data:<24} roles={','.join(map(str, roles)):<6} "
+            f"updates={len(values):<4} queries={sorted(set(values))}"
+        )
+    # /start читает только пользователя с ролями
+    start = {
+        n
+        for (data, _), values in counts.items()
+        for n in values
+        if data == "/start"
+    }
+    if start != {1}:
+        raise AssertionError(f"/start: {start} запросов вместо 1")
+    varying = [key for key, values in counts.items() if len(set(values)) > 1]
+    if varying:
+        raise AssertionError(
+            f"Число запросов зависит от истории пользователя: {varying}"
+        )
+
+
+SCENARIOS = {
+    "executor": bench_executor,
+    "pragmas": bench_pragmas,
+    "rating": bench_rating,
+    "incremental": bench_incremental,
+    "backends": bench_backends,
+    "reports": bench_reports,
+    "updates": bench_updates,
+    "outbox": bench_outbox,
+    "digest": bench_digest,
+    "scheduler": bench_scheduler,
+    "jobs": bench_jobs,
+    "assignment": bench_assignment,
+    "reviewers": bench_reviewers,
+    "pool": bench_pool,
+    "capacity": bench_capacity,
+    "acceptance": bench_acceptance,
+    "catalogue": bench_catalogue,
+    "edits": bench_edits,
+    "import": bench_import,
+}
+
+
+def main():
+    """Разбор аргументов и запуск сценария"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--heavy-share", type=float, default=0.02)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--sample", type=int, default=50)
+    parser.add_argument("--admins", type=int, default=20)
+    parser.add_argument("--courses", type=int, default=20)
+    parser.add_argument("--themes", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+    SCENARIOS[args.scenario](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,9 @@
 """Взаимодействие с блогером"""
 
-import traceback
 from datetime import datetime, timedelta
-from typing import List
+from typing import List, Union
 
 from aiogram import Bot, F, Router
-from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.types import (
     CallbackQuery,
@@ -14,18 +12,23 @@ from aiogram.types import (
     Message,
 )
 
+from acceptance import acceptance
+from catalogue import catalogue
 from common import (
     error_handler,
-    get_date_time,
     get_id,
     send_message_admins,
     send_new_review_request,
     send_task,
     check_user_role,
 )
+from editor import editor
+from executor import run_db, run_db_heavy
 from filters import IsBloger, WaitVideo
+from middlewares import UserContext
 from models import (
     TASK_STATUS,
+    Course,
     Table,
     Task,
     Theme,
@@ -34,12 +37,55 @@ from models import (
     UserRole,
     Video,
 )
+from outbox import outbox
+from rating_state import rating_state
+from scheduler import scheduler
+from roles import registry
 
 # pylint: disable=no-member
 
 router = Router()
 
 
+def select_tasks():
+    """Задачи вместе с блогером, темой и курсом одним запросом"""
+    return (
+        Task.select(Task, User, Theme, Course)
+        .join_from(Task, User)
+        .join_from(Task, Theme)
+        .join_from(Theme, Course)
+    )
+
+
+def get_task(task_id: int) -> Union[Task, None]:
+    """Задача вместе с блогером, темой и курсом"""
+    return select_tasks().where(Task.id == task_id).first()
+
+
+def get_active_task(user: User) -> Union[Task, None]:
+    """Выданная блогеру задача вместе с темой и курсом"""
+    return (
+        select_tasks()
+        .where((Task.implementer == user) & (Task.status == 0))
+        .first()
+    )
+
+
+def close_task(task: Task, status: int):
+    """Меняет статус задачи и учитывает его в рейтингах и кэшах"""
+    task.status = status
+    task.save()
+    rating_state.on_task_changed(task)
+    acceptance.on_task_changed(task)
+    catalogue.on_task_changed(task)
+
+
+def remove_bloger_role(user: User):
+    """Снимает роль блогера и убирает блогера из каталога"""
+    registry.remove_user_role(user, IsBloger.role)
+    catalogue.on_role_changed(user)
+
+
 @error_handler()
 @router.message(F.document, IsBloger(), WaitVideo())
 async def upload_file(message: Message):
@@ -68,18 +114,15 @@ async def get_bloger_user_role(bot: Bot, user: User):
 @error_handler()
 async def drop_bloger(bot: Bot, user: User):
     """Снимает роль блогера с пользователя, если она была выдана."""
-    user_role = await get_bloger_user_role(bot, user)
-    if user_role is None:
+    role = await get_bloger_user_role(bot, user)
+    if role is None:
         await bot.send_message(
             chat_id=user.tg_id, text="✔️👆🛠🔑🕴Вам не выдавалась роль блогера."
         )
         return
 
     # Наличие выданной темы
-    task = Task.get_or_none(
-        implementer=user,
-        status=0,
-    )
+    task = await run_db(get_active_task, user)
 
     if task:
         await bot.send_message(
@@ -99,13 +142,14 @@ async def drop_bloger(bot: Bot, user: User):
         )
         return
 
-    if user_role:
-        user_role.delete_instance(recursive=True)
+    await run_db(remove_bloger_role, user)
 
     await bot.send_message(chat_id=user.tg_id, text="Роль блогера с Вас снята")
 
     await send_message_admins(
-        bot=bot, text=f"Блогер {user.link} отказался от роли."
+        bot=bot,
+        text=f"Блогер {user.link} отказался от роли.",
+        category="roles",
     )
 
     await send_task(bot)
@@ -113,20 +157,19 @@ async def drop_bloger(bot: Bot, user: User):
 
 @router.message(Command("bloger_off"), IsBloger())
 @error_handler()
-async def bloger_off(message: Message):
+async def bloger_off(message: Message, user_context: UserContext):
     """Отключает пользователя из режима блогера."""
-    user = User.get(tg_id=message.from_user.id)
-    await drop_bloger(message.bot, user)
+    await drop_bloger(message.bot, user_context.user)
 
 
 @router.callback_query(F.data.startswith("del_task_yes_"), IsBloger())
 @error_handler()
-async def del_task_yes(query: CallbackQuery):
+async def del_task_yes(query: CallbackQuery, user_context: UserContext):
     """Подтверждение в отказе делать задачу"""
 
     await query.message.delete()
 
-    task = Task.get_or_none(id=get_id(query.data))
+    task = await run_db(get_task, get_id(query.data))
 
     if task is None:
         await query.message.answer(text="Задача не найдена")
@@ -139,14 +182,14 @@ async def del_task_yes(query: CallbackQuery):
         )
         return
 
-    task.status = -1
-    task.save()
+    await run_db_heavy(close_task, task, -1)
 
-    user: User = User.get(tg_id=query.from_user.id)
-    user.update_bloger_rating()
+    user: User = user_context.user
+    _, *ratings = await run_db_heavy(rating_state.update_bloger_rating, user)
+    report = await run_db_heavy(user.get_bloger_report, ratings)
 
     await query.message.answer(
-        text=f"Задача cнята\n\n{user.get_bloger_report()}",
+        text=f"Задача cнята\n\n{report}",
         parse_mode="HTML",
         disable_web_page_preview=True,
     )
@@ -154,30 +197,34 @@ async def del_task_yes(query: CallbackQuery):
     await drop_bloger(query.bot, user)
 
 
+def save_video(user: User, file_id: str, duration: int) -> Union[Task, None]:
+    """Записывает видео по выданной блогеру задаче и отправляет задачу
+    на проверку. Возвращает задачу или None, если задачи нет"""
+    task = get_active_task(user)
+    if task is None:
+        return None
+    video = Video.create(task=task, file_id=file_id, duration=duration)
+    task.status = 1
+    task.save()
+    rating_state.on_video_uploaded(video)
+    return task
+
+
 @router.message(F.video, IsBloger(), WaitVideo())
 @error_handler()
-async def upload_video(message: Message):
+async def upload_video(message: Message, user_context: UserContext):
     """Загружает видео пользователя и обновляет статус задачи"""
-    user = User.get(tg_id=message.from_user.id)
-    tasks = Task.select().where(
-        (Task.status == 0) & (Task.implementer == user)
+    user = user_context.user
+    task = await run_db_heavy(
+        save_video, user, message.video.file_id, message.video.duration
     )
 
-    if tasks.count() == 0:
+    if task is None:
         await message.answer(
             text="У вас нет выданной темы, я не могу принять это видео"
         )
         return
 
-    task = tasks.first()
-    Video.create(
-        task=task,
-        file_id=message.video.file_id,
-        duration=message.video.duration,
-    )
-    task.status = 1
-    task.save()
-
     await message.answer(
         text=(
             "Видео принято на проверку. "
@@ -190,6 +237,7 @@ async def upload_video(message: Message):
         bot=message.bot,
         text=f"""🕴📨📹<b>Блогер {user.link} прислал видео</b>
 Тема: {task.theme.course.title}|{task.theme.link}""",
+        category="videos",
     )
 
     await send_new_review_request(message.bot)
@@ -200,25 +248,24 @@ async def upload_video(message: Message):
 async def to_extend(callback_query: CallbackQuery):
     """Обрабатывает запрос на продление срока задачи"""
     task_id = get_id(callback_query.data)
-    task: Task = Task.get_by_id(task_id)
+    task: Task = await run_db(get_task, task_id)
 
     if task.status != 0:
-        await callback_query.message.edit_text(
+        await editor.edit(
+            callback_query.message,
             text="Срок не может быть продлён. "
             f"Видео по теме {task.theme.link} уже получено.",
             parse_mode="HTML",
             reply_markup=None,
         )
         return
-    theme: Theme = task.theme
-    hours = int(theme.complexity * 72 / 2)
-    hours = max(hours, 24)
-
-    task.due_date += timedelta(hours=hours)
+    task.due_date += task.get_reserve_time()
     task.extension = 0
-    task.save()
+    await run_db(task.save)
+    scheduler.schedule_task(task)
 
-    await callback_query.message.edit_text(
+    await editor.edit(
+        callback_query.message,
         text=f"Срок Вашей задачи продлен до {task.due_date}",
         reply_markup=None,
     )
@@ -228,113 +275,103 @@ async def to_extend(callback_query: CallbackQuery):
         text=f"""<b>Блогер {task.implementer.link} продлил срок</b>
 Тема: {task.theme.course.title}|{task.theme.link}
 Срок: {task.due_date}""",
+        category="extensions",
     )
 
 
-@error_handler()
-async def check_expired_task(bot: Bot):
-    """Помечает просроченные задачи"""
-    dd = get_date_time()
-    old_tasks: List[Task] = list(
-        Task.select(Task).where((Task.status == 0) & (Task.due_date == dd))
+def get_expired_tasks(now: datetime) -> List[Task]:
+    """Выданные задачи, срок которых прошёл"""
+    return list(
+        select_tasks().where((Task.status == 0) & (Task.due_date <= now))
     )
-    for task in old_tasks:
-        try:
-            task.status = -2
-            task.save()
-
-            user_role: UserRole = UserRole.get_or_none(
-                user=task.implementer, role=IsBloger.role
-            )
-            if user_role:
-                user_role.delete_instance(recursive=True)
-
-            try:
-                await bot.send_message(
-                    chat_id=task.implementer.tg_id,
-                    text="Вы просрочили срок записи видео. "
-                    "Тема и Роль блогера с Вас снята. "
-                    "Если Вы хотите снова получить темы для видео, "
-                    "пошлите команду /bloger_on",
-                )
-            except TelegramBadRequest:
-                await send_message_admins(bot=bot, text=traceback.format_exc())
-
-            await send_message_admins(
-                bot=bot,
-                text=f"Тему {task.theme.link} "
-                f"просрочил {task.implementer.link}",
-            )
 
-            await send_task(bot)
 
-            new_task = Task.get_or_none(
-                theme=task.theme,
-                status=0,
+def get_free_bloger_tg_ids(task: Task) -> List[int]:
+    """Telegram ID свободных блогеров, не подписанных на курс темы,
+    если тему задачи никто не выполняет"""
+    if Task.get_or_none(theme=task.theme, status=0):
+        return []
+    return [
+        tg_id
+        for tg_id, in UserRole.select(User.tg_id)
+        .join(User)
+        .where(
+            (UserRole.role_id == IsBloger.role.id)
+            & (
+                ~UserRole.user_id
+                << (
+                    User.select(User.id)
+                    .join(UserCourse)
+                    .where(UserCourse.course_id == task.theme.course_id)
+                )
             )
-            if new_task:
-                continue
-
-            query: List[UserRole] = list(
-                UserRole.select().where(
-                    (UserRole.role_id == IsBloger.role.id)
-                    & (
-                        ~UserRole.user_id
-                        << (
-                            User.select(User.id)
-                            .join(UserCourse)
-                            .where(
-                                UserCourse.course_id == task.theme.course_id
-                            )
-                        )
-                    )
-                    & (
-                        ~UserRole.user_id
-                        << (
-                            Task.select(Task.implementer_id).where(
-                                Task.status.between(0, 1)
-                            )
-                        )
+            & (
+                ~UserRole.user_id
+                << (
+                    Task.select(Task.implementer_id).where(
+                        Task.status.between(0, 1)
                     )
                 )
             )
-            for user_role in query:
-                try:
-                    await bot.send_message(
-                        chat_id=user_role.user.tg_id,
-                        text=f"Для курса {task.theme.course.title} нет "
-                        "исполнителя, подпишитесь на него и получите "
-                        "задачу на разработку видео",
-                    )
-                except TelegramBadRequest:
-                    await send_message_admins(
-                        bot=bot, text=traceback.format_exc()
-                    )
-
-        except TelegramBadRequest as ex:
-            print(ex, task.implementer.comment)
+        )
+        .tuples()
+    ]
 
 
 @error_handler()
-async def check_old_task(bot: Bot):
-    """Асинхронная функция проверяет старые невыполненные задачи"""
-    now = get_date_time()
+async def check_expired_task(bot: Bot, _since: datetime, now: datetime):
+    """Помечает просроченные задачи"""
+    old_tasks: List[Task] = await run_db(get_expired_tasks, now)
+    for task in old_tasks:
+        await run_db_heavy(close_task, task, -2)
+        await run_db(remove_bloger_role, task.implementer)
+
+        await outbox.send(
+            "send_message",
+            chat_id=task.implementer.tg_id,
+            text="Вы просрочили срок записи видео. "
+            "Тема и Роль блогера с Вас снята. "
+            "Если Вы хотите снова получить темы для видео, "
+            "пошлите команду /bloger_on",
+        )
+
+        await send_message_admins(
+            bot=bot,
+            text=f"Тему {task.theme.link} "
+            f"просрочил {task.implementer.link}",
+            category="deadlines",
+        )
+
+        await send_task(bot)
+
+        tg_ids = await run_db(get_free_bloger_tg_ids, task)
+        if not tg_ids:
+            continue
+        await outbox.send_many(
+            "send_message",
+            tg_ids,
+            text=f"Для курса {task.theme.course.title} нет "
+            "исполнителя, подпишитесь на него и получите "
+            "задачу на разработку видео",
+        )
 
+
+def get_tasks_to_extend(now: datetime) -> List[Task]:
+    """Задачи, срок которых пора предложить продлить: запас времени
+    истекает, а среди свободных блогеров курса нет блогера с рейтингом
+    выше, чем у исполнителя"""
     old_tasks: List[Task] = list(
-        Task.select(Task).where((Task.status == 0) & (Task.extension == 0))
+        select_tasks().where((Task.status == 0) & (Task.extension == 0))
     )
+    tasks = []
     for task in old_tasks:
 
-        theme: Theme = task.theme
-        hours = int(theme.complexity * 72 / 2)
-        hours = max(hours, 24)
-        reserve_time: timedelta = timedelta(hours=hours)
+        reserve_time: timedelta = task.get_reserve_time()
         left_time: datetime = task.due_date - now
         if left_time > reserve_time:
             continue
 
-        try:
-            sql_query = f"""
+        sql_query = f"""
 select u.user_id
 from (
     select ur.user_id
@@ -346,53 +383,57 @@ from (
 left join task on task.implementer_id=u.user_id and task.status in (0, 1)
 where task.id is NULL;
 """
-            users: List[int] = [
-                r["user_id"] for r in Table.raw(sql_query).dicts()
-            ]
-            cont = False
-
-            for user_id in users:
-                u: User = User.get_by_id(user_id)
-                if u.bloger_rating > task.implementer.bloger_rating:
-                    cont = True
-                    break
-
-            if cont:
-                continue
-
-            await bot.send_message(
-                chat_id=task.implementer.tg_id,
-                text="Воспользуйтесь этой кнопкой, чтобы продлить срок Вашей "
-                f"задачи до {task.due_date + reserve_time} ",
-                reply_markup=InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [
-                            InlineKeyboardButton(
-                                text="Продлить до "
-                                f"{task.due_date + reserve_time}",
-                                callback_data=f"task_to_extend_{task.id}",
-                            )
-                        ]
+        users: List[int] = [r["user_id"] for r in Table.raw(sql_query).dicts()]
+        cont = False
+
+        for user_id in users:
+            u: User = User.get_by_id(user_id)
+            if u.bloger_rating > task.implementer.bloger_rating:
+                cont = True
+                break
+
+        if cont:
+            continue
+        tasks.append(task)
+    return tasks
+
+
+@error_handler()
+async def check_old_task(_bot: Bot, _since: datetime, now: datetime):
+    """Асинхронная функция проверяет старые невыполненные задачи"""
+    for task in await run_db(get_tasks_to_extend, now):
+        reserve_time: timedelta = task.get_reserve_time()
+        await outbox.send(
+            "send_message",
+            chat_id=task.implementer.tg_id,
+            text="Воспользуйтесь этой кнопкой, чтобы продлить срок Вашей "
+            f"задачи до {task.due_date + reserve_time} ",
+            reply_markup=InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [
+                        InlineKeyboardButton(
+                            text="Продлить до "
+                            f"{task.due_date + reserve_time}",
+                            callback_data=f"task_to_extend_{task.id}",
+                        )
                     ]
-                ),
-            )
-            task.extension = 1
-            task.save()
-        except TelegramBadRequest as ex:
-            print(ex, task.implementer.comment)
+                ]
+            ),
+        )
+        task.extension = 1
+        await run_db(task.save)
 
 
 def update_rating_all_blogers():
     """Обновляет рейтинг всех блогеров с невыполненными задачами"""
-    blogers: List[User] = User.select(User).join(Task).where(Task.status == 0)
+    blogers: List[User] = (
+        User.select(User.id).join(Task).where(Task.status == 0)
+    )
 
-    for bloger in blogers:
-        bloger.update_bloger_rating()
+    rating_state.update_bloger_ratings([bloger.id for bloger in blogers])
 
 
 @error_handler()
-async def loop(bot: Bot):
-    """Цикл обновляет рейтинги блогеров"""
-    update_rating_all_blogers()
-    await check_old_task(bot)
-    await check_expired_task(bot)
+async def update_ratings(_bot: Bot, _since: datetime, _now: datetime):
+    """Обновляет рейтинги блогеров, раз в час"""
+    await run_db_heavy(update_rating_all_blogers)
@@ -0,0 +1,220 @@
+"""Пропускная способность проверки видео.
+
+Ограничения задаются переменными .env:
+- REVIEW_CONCURRENCY — открытых запросов на проверку одновременно,
+  0 — без общего ограничения;
+- REVIEWER_PARALLEL — открытых запросов у одного проверяющего: число
+  или ступени по рейтингу вида "0:1,0.6:2,0.8:3" (с рейтинга 0.6 —
+  два запроса, с 0.8 — три);
+- REVIEWS_PER_VIDEO — отзывов, после которых по видео выносится оценка;
+- REVIEW_HOURS — часов на проверку видео.
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import List, Tuple, Union
+
+from dotenv import load_dotenv
+from peewee import JOIN, fn
+
+from models import Review, ReviewRequest, Task, Video
+
+# pylint: disable=no-member
+
+# Загрузка переменных из .env
+load_dotenv()
+REVIEW_CONCURRENCY = int(os.getenv("REVIEW_CONCURRENCY", "5"))
+REVIEWER_PARALLEL = os.getenv("REVIEWER_PARALLEL", "1")
+REVIEWS_PER_VIDEO = int(os.getenv("REVIEWS_PER_VIDEO", "5"))
+REVIEW_HOURS = int(os.getenv("REVIEW_HOURS", "25"))
+# За сколько дней берутся длительность проверки и доля просрочек
+QUEUE_STATS_DAYS = 30
+
+
+def parse_tiers(value: str) -> List[Tuple[float, int]]:
+    """Ступени "рейтинг:запросов" по возрастанию рейтинга.
+    Просто число — одна ступень для всех рейтингов"""
+    tiers = []
+    for part in value.split(","):
+        if not part.strip():
+            continue
+        if ":" in part:
+            rating, count = part.split(":", 1)
+        else:
+            rating, count = "0", part
+        tiers.append((float(rating), int(count)))
+    if not tiers:
+        raise ValueError(f"Не заданы ступени REVIEWER_PARALLEL: {value!r}")
+    return sorted(tiers)
+
+
+class ReviewCapacity:
+    """Ограничения проверки видео"""
+
+    def __init__(
+        self,
+        concurrency: int = REVIEW_CONCURRENCY,
+        parallel: str = REVIEWER_PARALLEL,
+        per_video: int = REVIEWS_PER_VIDEO,
+        hours: int = REVIEW_HOURS,
+    ):
+        self.concurrency = concurrency
+        self.tiers = parse_tiers(parallel)
+        self.per_video = per_video
+        self.hours = hours
+
+    def get_parallel(self, rating: float) -> int:
+        """Открытых запросов, доступных проверяющему с рейтингом.
+        Рейтинг ниже первой ступени получает её число запросов"""
+        count = self.tiers[0][1]
+        for threshold, tier_count in self.tiers:
+            if rating >= threshold:
+                count = tier_count
+        return count
+
+    def get_limit(self, reviewer_slots: int) -> int:
+        """Сколько запросов может быть открыто одновременно при
+        reviewer_slots местах у проверяющих"""
+        if self.concurrency <= 0:
+            return reviewer_slots
+        return min(self.concurrency, reviewer_slots)
+
+
+review_capacity = ReviewCapacity()
+
+
+class ReviewQueue:
+    """Очередь проверки: невыданные отзывы, загрузка проверяющих и
+    ожидаемое время до оценки нового видео"""
+
+    def __init__(self, capacity: ReviewCapacity = review_capacity):
+        self.capacity = capacity
+        # (отзывов получено, запросов открыто) по видео на проверке
+        self.videos: List[Tuple[int, int]] = []
+        # Средняя длительность проверки и доля запросов, закрытых отзывом
+        self.hours = float(capacity.hours)
+        self.success = 1.0
+
+    def load(self, now: datetime = None) -> "ReviewQueue":
+        """Загружает видео на проверке и статистику проверок
+        за QUEUE_STATS_DAYS дней"""
+        since = (now or datetime.now()) - timedelta(days=QUEUE_STATS_DAYS)
+        done = fn.SUM(ReviewRequest.status == 1)
+        opened = fn.SUM(ReviewRequest.status == 0)
+        self.videos = [
+            (done or 0, opened or 0)
+            for _, done, opened in Video.select(Video.id, done, opened)
+            .join(Task)
+            .join_from(Video, ReviewRequest, JOIN.LEFT_OUTER)
+            .where(Task.status == 1)
+            .group_by(Video.id)
+            .tuples()
+        ]
+
+        hours = (
+            ReviewRequest.select(
+                fn.AVG(
+                    (
+                        fn.julianday(Review.at_created)
+                        - fn.julianday(ReviewRequest.at_created)
+                    )
+                    * 24
+                )
+            )
+            .join(Review)
+            .where(
+                (ReviewRequest.status == 1)
+                & (ReviewRequest.at_created >= since)
+            )
+            .scalar()
+        )
+        self.hours = hours or float(self.capacity.hours)
+        closed = dict(
+            ReviewRequest.select(
+                ReviewRequest.status, fn.COUNT(ReviewRequest.id)
+            )
+            .where(
+                (ReviewRequest.status != 0)
+                & (ReviewRequest.at_created >= since)
+            )
+            .group_by(ReviewRequest.status)
+            .tuples()
+        )
+        total = sum(closed.values())
+        self.success = closed.get(1, 0) / total if total else 1.0
+        return self
+
+    @property
+    def missing(self) -> int:
+        """Отзывов, которых не хватает видео на проверке"""
+        per_video = self.capacity.per_video
+        return sum(max(0, per_video - done) for done, _ in self.videos)
+
+    @property
+    def unassigned(self) -> int:
+        """Недостающих отзывов, по которым запросы ещё не выданы"""
+        per_video = self.capacity.per_video
+        return sum(
+            max(0, per_video - done - opened) for done, opened in self.videos
+        )
+
+    @property
+    def waiting(self) -> int:
+        """Видео без открытых запросов"""
+        return sum(1 for _, opened in self.videos if not opened)
+
+    @property
+    def open_count(self) -> int:
+        """Открытых запросов по видео на проверке"""
+        return sum(opened for _, opened in self.videos)
+
+    def get_verdict_hours(self, limit: int) -> Union[float, None]:
+        """Ожидаемые часы до оценки нового видео при limit одновременных
+        запросов: очередь перед ним разбирается со скоростью
+        limit * success / hours отзывов в час, но не быстрее одной
+        проверки. None, если мест нет"""
+        throughput = limit * self.success / self.hours
+        if throughput <= 0:
+            return None
+        return max(
+            self.hours,
+            (self.missing + self.capacity.per_video) / throughput,
+        )
+
+    def get_report(self, reviewer_slots: int, vacant: int) -> str:
+        """Отчёт для администратора. reviewer_slots и vacant — места
+        у проверяющих и число свободных проверяющих по пулу"""
+        capacity = self.capacity
+        limit = capacity.get_limit(reviewer_slots)
+        verdict = self.get_verdict_hours(limit)
+        tiers = ", ".join(
+            f"с {threshold:.2f}: {count}"
+            for threshold, count in capacity.tiers
+        )
+        return "\n".join(
+            [
+                "📊<b>Очередь проверки</b>",
+                f"Видео на проверке: {len(self.videos)}, "
+                f"без проверяющих: {self.waiting}",
+                f"Недостающих отзывов: {self.missing}, "
+                f"из них не выдано: {self.unassigned}",
+                f"Открыто запросов: {self.open_count} из {limit} "
+                f"(загрузка {self.open_count / limit if limit else 0:.0%})",
+                f"Свободных проверяющих: {vacant}, "
+                f"мест у проверяющих: {reviewer_slots}",
+                f"Проверка длится в среднем {self.hours:.1f} ч, "
+                f"отзывом закрыто {self.success:.0%} запросов",
+                "Ожидаемое время до оценки нового видео: "
+                + (
+                    "не оценить, нет мест"
+                    if verdict is None
+                    else f"{verdict:.1f} ч"
+                ),
+                "",
+                "Ограничения: всего "
+                f"{capacity.concurrency if capacity.concurrency > 0 else '∞'}"
+                f", на проверяющего {tiers}, "
+                f"отзывов на видео {capacity.per_video}, "
+                f"срок {capacity.hours} ч",
+            ]
+        )
@@ -0,0 +1,324 @@
+"""Список курсов для команды /courses.
+
+Прежде список собирался заново на каждый показ и переключение
+подписки: по каждому курсу отдельно считались желающие и искалась
+подписка пользователя, а весь текст перерисовывался при добавлении
+каждой темы. Здесь курсы, темы и готовый текст общие для всех
+пользователей, загружаются двумя запросами и хранятся в памяти до
+изменения тем, задач, подписок или ролей блогеров, а длина текста
+считается по ходу добавления тем. На запрос пользователя одним
+запросом вычисляются только кнопки его подписок.
+
+Список выводится страницами по COURSES_PAGE_SIZE курсов (.env),
+кнопки подписок и перехода по страницам несут номер страницы
+в callback_data, поэтому переключение подписки перерисовывает только
+текущую страницу.
+"""
+
+import bisect
+import os
+import threading
+from typing import Dict, List, Set, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from dotenv import load_dotenv
+from peewee import JOIN, fn
+
+from digest import MESSAGE_LIMIT
+from models import Course, Task, Theme, User, UserCourse, UserRole
+from roles import registry
+
+# pylint: disable=no-member
+
+# Загрузка переменных из .env
+load_dotenv()
+BLOGER_ROLE = "Блогер"
+# Курсов на странице списка
+COURSES_PAGE_SIZE = int(os.getenv("COURSES_PAGE_SIZE", "10"))
+CATALOGUE_TITLE = "<b>Список курсов</b> {page}/{pages}\n"
+
+
+class _CourseRecord:  # pylint: disable=too-few-public-methods
+    """Курс в списке"""
+
+    def __init__(self, title: str):
+        self.title = title
+        self.bloger_count = 0
+        # Строки невыполненных тем по возрастанию ID темы
+        self.themes: List[str] = []
+
+    @property
+    def header(self) -> str:
+        """Заголовок курса в тексте"""
+        return f"\n<b>{self.title}</b>|{self.bloger_count} желающих\n"
+
+
+class CatalogueProvider:
+    """Данные списка курсов: по одному сгруппированному запросу на темы,
+    число желающих и подписки пользователя"""
+
+    @staticmethod
+    def get_themes() -> List[Tuple[int, str, int, str, str, float]]:
+        """Невыполненные темы с курсами по возрастанию ID курса и темы:
+        (ID курса, курс, ID темы, тема, URL, сложность). Выполненные
+        темы отсекаются соединением с их задачами, а не подзапросом"""
+        done = Task.alias()
+        return list(
+            Course.select(
+                Course.id,
+                Course.title,
+                Theme.id,
+                Theme.title,
+                Theme.url,
+                Theme.complexity,
+            )
+            .join(Theme, on=Theme.course == Course.id)
+            .join(
+                done,
+                JOIN.LEFT_OUTER,
+                on=(done.theme == Theme.id) & (done.status >= 2),
+            )
+            .where(done.id.is_null())
+            .order_by(Course.id, Theme.id)
+            .tuples()
+        )
+
+    @staticmethod
+    def get_bloger_counts() -> Dict[int, int]:
+        """ID курса -> число подписанных на него блогеров"""
+        return dict(
+            UserCourse.select(UserCourse.course, fn.COUNT(UserCourse.id))
+            .join(UserRole, on=UserRole.user == UserCourse.user)
+            .where(UserRole.role == registry.get_role(BLOGER_ROLE).id)
+            .group_by(UserCourse.course)
+            .tuples()
+        )
+
+    @staticmethod
+    def get_subscriptions(user_id: int) -> Set[int]:
+        """ID курсов, на которые подписан пользователь"""
+        return {
+            course_id
+            for course_id, in UserCourse.select(UserCourse.course)
+            .where(UserCourse.user == user_id)
+            .tuples()
+        }
+
+
+# pylint: disable-next=too-many-instance-attributes
+class CourseCatalogue:
+    """Курсы с невыполненными темами и страницы списка курсов.
+
+    Курсы выводятся по убыванию числа желающих страницами по page_size
+    курсов. Страница отрисовывается при первом показе и хранится до
+    изменения порядка курсов. Загружается при первом показе, затем
+    обновляется вызовами on_*. Изменения тем, статусов задач, подписок
+    и ролей блогеров должны сопровождаться вызовом on_*, иначе нужен
+    invalidate.
+    """
+
+    def __init__(
+        self,
+        provider: CatalogueProvider = CatalogueProvider(),
+        page_size: int = COURSES_PAGE_SIZE,
+        limit: int = MESSAGE_LIMIT,
+    ):
+        self.provider = provider
+        self.page_size = page_size
+        self.limit = limit
+        self._lock = threading.RLock()
+        self._loaded = False
+        # ID курса -> курс
+        self._courses: Dict[int, _CourseRecord] = {}
+        # ID тем в списке
+        self._theme_ids = set()
+        # Курсы в порядке вывода: (ключ сортировки, ID курса)
+        self._order: List[Tuple[int, int]] = []
+        # Номер страницы -> текст
+        self._pages: Dict[int, str] = {}
+
+    def invalidate(self):
+        """Сбрасывает список, следующий показ перечитает БД"""
+        with self._lock:
+            self._loaded = False
+
+    def load(self) -> "CourseCatalogue":
+        """Загружает курсы, невыполненные темы и число желающих"""
+        with self._lock:
+            self._courses = {}
+            self._theme_ids = set()
+            for (
+                course_id,
+                course_title,
+                theme_id,
+                title,
+                url,
+                complexity,
+            ) in self.provider.get_themes():
+                course = self._courses.get(course_id)
+                if course is None:
+                    course = self._courses[course_id] = _CourseRecord(
+                        course_title
+                    )
+                course.themes.append(
+                    f'<a href="{url}">{title}</a>|{complexity}\n'
+                )
+                self._theme_ids.add(theme_id)
+            for course_id, count in self.provider.get_bloger_counts().items():
+                if course_id in self._courses:
+                    self._courses[course_id].bloger_count = count
+            self._order = sorted(
+                (self._get_key(course_id), course_id)
+                for course_id in self._courses
+            )
+            self._pages = {}
+            self._loaded = True
+        return self
+
+    def _get_key(self, course_id: int) -> int:
+        """Ключ сортировки: сначала курсы с большим числом желающих,
+        при равенстве — с меньшим числом тем"""
+        course = self._courses[course_id]
+        return -course.bloger_count * 10 + len(course.themes)
+
+    def get_page_count(self) -> int:
+        """Число страниц, не меньше одной"""
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            return max(1, -(-len(self._order) // self.page_size))
+
+    def _get_page_ids(self, page: int) -> List[int]:
+        """ID курсов страницы"""
+        start = page * self.page_size
+        return [
+            course_id
+            for _, course_id in self._order[start : start + self.page_size]
+        ]
+
+    def _render_page(self, page: int) -> str:
+        """Выводит курсы страницы, темы — по кругу: первые темы всех
+        курсов, затем вторые и так далее, пока текст короче limit.
+        Заголовки курсов выводятся всегда"""
+        courses = self._courses
+        title = CATALOGUE_TITLE.format(
+            page=page + 1, pages=self.get_page_count()
+        )
+        shown: Dict[int, List[str]] = {
+            course_id: [] for course_id in self._get_page_ids(page)
+        }
+        length = len(title) + sum(
+            len(courses[course_id].header) for course_id in shown
+        )
+        theme_ind = 0
+        run = True
+        while run:
+            run = False
+            for course_id, themes in shown.items():
+                course = courses[course_id]
+                if theme_ind >= len(course.themes):
+                    continue
+                theme_text = course.themes[theme_ind]
+                if length + len(theme_text) >= self.limit:
+                    continue
+                run = True
+                themes.append(theme_text)
+                length += len(theme_text)
+            theme_ind += 1
+        return title + "".join(
+            courses[course_id].header + "".join(themes)
+            for course_id, themes in shown.items()
+        )
+
+    def _get_keyboard(
+        self, page: int, subscribed: Set[int]
+    ) -> InlineKeyboardMarkup:
+        """Кнопки подписок на курсы страницы и переход по страницам.
+        В callback_data кнопок подписок передаётся номер страницы"""
+        inline_keyboard = [
+            [
+                InlineKeyboardButton(
+                    text=(
+                        f'{"✅" if course_id in subscribed else "❌"}'
+                        f"{self._courses[course_id].title}"
+                    ),
+                    callback_data=(
+                        f"{'del' if course_id in subscribed else 'add'}"
+                        f"_user_course_{course_id}_{page}"
+                    ),
+                )
+            ]
+            for course_id in self._get_page_ids(page)
+        ]
+        navigation = []
+        if page > 0:
+            navigation.append(
+                InlineKeyboardButton(
+                    text="⬅️", callback_data=f"courses_page_{page - 1}"
+                )
+            )
+        if page < self.get_page_count() - 1:
+            navigation.append(
+                InlineKeyboardButton(
+                    text="➡️", callback_data=f"courses_page_{page + 1}"
+                )
+            )
+        if navigation:
+            inline_keyboard.append(navigation)
+        return InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
+
+    def get_data(self, user: User, page: int = 0) -> Dict:
+        """Страница списка курсов и кнопки подписок пользователя
+        в виде аргументов answer и edit_text. Номер страницы
+        приводится к существующим"""
+        subscribed = self.provider.get_subscriptions(user.id)
+        with self._lock:
+            page = min(max(page, 0), self.get_page_count() - 1)
+            if page not in self._pages:
+                self._pages[page] = self._render_page(page)
+            return {
+                "text": self._pages[page],
+                "reply_markup": self._get_keyboard(page, subscribed),
+                "parse_mode": "HTML",
+                "disable_web_page_preview": True,
+            }
+
+    def on_subscription_changed(self, user: User, course_id: int, delta: int):
+        """Пользователь подписался на курс (delta=1) или отписался
+        от него (delta=-1). Курс переставляется в порядке вывода,
+        страницы отрисовываются заново при показе"""
+        with self._lock:
+            if not self._loaded or course_id not in self._courses:
+                return
+            if not registry.has_role(user.id, registry.get_role(BLOGER_ROLE)):
+                return
+            old_key = (self._get_key(course_id), course_id)
+            del self._order[bisect.bisect_left(self._order, old_key)]
+            self._courses[course_id].bloger_count += delta
+            bisect.insort(self._order, (self._get_key(course_id), course_id))
+            self._pages = {}
+
+    def on_role_changed(self, user: User):
+        """Пользователю выдана или с него снята роль блогера. Число
+        желающих меняется, только если он подписан на курсы"""
+        with self._lock:
+            if not self._loaded:
+                return
+            if UserCourse.select().where(UserCourse.user == user.id).exists():
+                self.invalidate()
+
+    def on_task_changed(self, task: Task):
+        """Изменился статус задачи: тема могла стать выполненной
+        или снова невыполненной"""
+        with self._lock:
+            if not self._loaded:
+                return
+            if (task.status >= 2) == (task.theme_id in self._theme_ids):
+                self.invalidate()
+
+    def on_themes_changed(self):
+        """Добавлены или изменены курсы и темы"""
+        self.invalidate()
+
+
+catalogue = CourseCatalogue()
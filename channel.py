@@ -10,9 +10,12 @@ from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, Poll
 
 
+from acceptance import acceptance
 from admin import error_handler
+from catalogue import catalogue
 from models import Course, Task, Theme, Video, CourseTag
 from models import Poll as MPoll
+from rating_state import rating_state
 
 # pylint: disable=no-member
 # pylint: disable=eval-used
@@ -67,6 +70,9 @@ async def send_video(bot: Bot, video_obj: Video = None):
         video_obj.save()
     task.status = 3
     task.save()
+    rating_state.on_task_changed(task)
+    acceptance.on_task_changed(task)
+    catalogue.on_task_changed(task)
 
 
 @error_handler()
@@ -131,38 +137,41 @@ def get_active_polls():
 
 
 @error_handler()
-async def loop(bot: Bot):
-    """Одна итерация вызываемая из бесконечного цикла"""
-
-    now = datetime.now()
-    if now.hour == 18 and now.minute == 0:
-        poll_video = get_poll_theme()
-        if poll_video:
-            poll, video_obj = poll_video
-            poll.is_stop = True
-            poll.save()
-
-            try:
-                await bot.stop_poll(
-                    chat_id=TG_CHANEL_ID, message_id=poll.message_id
-                )
-            except TelegramBadRequest as e:
-                print(e)
-
-            await send_video(bot, video_obj)
-        else:
-            await send_video(bot)
-    if now.hour == 8 and now.minute == 0:
-        await send_poll(bot)
-        for poll in get_active_polls():
-            try:
-                await bot.delete_message(
-                    chat_id=TG_CHANEL_ID, message_id=poll.message_id
-                )
-            except TelegramBadRequest as e:
-                print(e)
-            poll.is_delete = True
-            poll.save()
+async def publish_video(bot: Bot, _since: datetime, _now: datetime):
+    """Публикует видео, победившее в опросе, или первое одобренное.
+    Вызывается планировщиком в 18:00"""
+    poll_video = get_poll_theme()
+    if poll_video:
+        poll, video_obj = poll_video
+        poll.is_stop = True
+        poll.save()
+
+        try:
+            await bot.stop_poll(
+                chat_id=TG_CHANEL_ID, message_id=poll.message_id
+            )
+        except TelegramBadRequest as e:
+            print(e)
+
+        await send_video(bot, video_obj)
+    else:
+        await send_video(bot)
+
+
+@error_handler()
+async def publish_poll(bot: Bot, _since: datetime, _now: datetime):
+    """Публикует новый опрос и удаляет завершённые.
+    Вызывается планировщиком в 08:00"""
+    await send_poll(bot)
+    for poll in get_active_polls():
+        try:
+            await bot.delete_message(
+                chat_id=TG_CHANEL_ID, message_id=poll.message_id
+            )
+        except TelegramBadRequest as e:
+            print(e)
+        poll.is_delete = True
+        poll.save()
 
 
 @router.poll()
@@ -1,9 +1,11 @@
 """Модуль для общих функции"""
 
+import asyncio
 import functools
+import re
 import traceback
 from datetime import datetime, timedelta
-from typing import List, Union, Set
+from typing import List, Tuple, Union
 
 from aiogram import Bot, Router
 from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
@@ -13,52 +15,65 @@ from aiogram.types import (
     InlineKeyboardMarkup as IKM,
     InlineKeyboardButton as IKB,
 )
-from peewee import JOIN, fn
 
+from acceptance import acceptance
+from assignment import AUTO_ASSIGN_TASKS, ReviewAssigner, TaskAssigner
+from catalogue import catalogue
+from digest import admin_digest
+from executor import run_db, run_db_heavy
 from filters import IsBloger
+from middlewares import UserContext
 from models import (
-    Course,
     Review,
     ReviewRequest,
     Role,
     Task,
     Theme,
     User,
-    UserCourse,
-    UserRole,
     Video,
 )
+from outbox import outbox
+from rating_state import rating_state
+from reviewer_pool import reviewer_pool
+from roles import registry
+from scheduler import scheduler
 
 # pylint: disable=no-member
 
 router = Router()
 
+# Номер запроса на проверку в подписи к видео для проверяющего
+REVIEW_REQUEST_MARK = "Запрос №"
+
 
 @router.callback_query()
-async def other_callback(callback: CallbackQuery):
+async def other_callback(callback: CallbackQuery, user_context: UserContext):
     """Обрабатывает неожиданный callback-запрос от пользователя."""
     await callback.message.answer(
         text="Вы совершили незарегистрированное действие, обратитесь к "
         "администратору"
     )
-    user = User.get_or_none(tg_id=callback.from_user.id)
+    user = user_context.user
     await send_message_admins(
         bot=callback.bot,
         text=f"other_callback {user.comment}\n{callback.message.text}"
         f"\n{callback.data}",
+        category="other",
     )
 
 
 @router.message()
-async def other_message(message: Message):
+async def other_message(message: Message, user_context: UserContext):
     """Обрабатывает неожиданные сообщения от пользователя"""
     await message.answer(
         text="Вы совершили незарегистрированное действие, "
         "обратитесь к администратору"
     )
-    user = User.get_or_none(tg_id=message.from_user.id)
+    user = user_context.user
     await send_message_admins(
-        bot=message.bot, text=f"other_message {user.comment}\n{message.text}"
+        bot=message.bot,
+        text=f"other_message {user.comment}\n{message.text}",
+        category="other",
     )
 
 
@@ -68,23 +83,24 @@ async def check_user_role(
     role_name: str,
     error_message: str,
     notify_if_no_role: bool = True,
-) -> Union[UserRole, None]:
-    """Проверяет наличие роли у пользователя."""
-    role = Role.get_or_none(name=role_name)
+) -> Union[Role, None]:
+    """Проверяет наличие роли у пользователя.
+    Возвращает роль, если она выдана пользователю."""
+    role = registry.get_role(role_name)
     if role is None:
         await bot.send_message(
             chat_id=user.tg_id,
             text=error_message,
         )
         return None
-    user_role = UserRole.get_or_none(user=user, role=role)
-    if notify_if_no_role and user_role is None:
+    has_role = registry.has_role(user.id, role)
+    if notify_if_no_role and not has_role:
         rn = role_name.lower()
         await bot.send_message(
             chat_id=user.tg_id,
             text=f"Вы не являетесь {rn}!",
         )
-    return user_role
+    return role if has_role else None
 
 
 def get_id(text):
@@ -156,231 +172,114 @@ def error_handler():
     return decorator
 
 
-@error_handler()
-async def send_task(bot: Bot):
-    """Выдать задачу блогеру"""
+def _assign_tasks() -> List[Task]:
+    """Выдаёт темы свободным блогерам и учитывает новые задачи
+    в рейтингах"""
+    tasks = TaskAssigner(IsBloger.role.id).assign()
+    for task in tasks:
+        rating_state.on_task_changed(task)
+    return tasks
 
-    return
 
-    # Список пользователей у которых есть роль блогера
-    blogers: Set[User] = {
-        user_role.user
-        for user_role in list(
-            UserRole.select(UserRole.user).where(
-                UserRole.role == IsBloger.role.id
-            )
-        )
-    }
-    # Список задач, по которым ведутся работы
-    tasks: Set[Task] = set(Task.select(Task).where(Task.status.in_([0, 1])))
-
-    # убрать блогеров у которых идет работа над задачей
-    blogers -= {
-        task.implementer
-        for task in list(
-            Task.select(Task.implementer).where(Task.status.in_([0, 1]))
-        )
-    }
+@error_handler()
+async def send_task(bot: Bot):
+    """Выдать задачу блогеру. Выполняется, только если в .env
+    включена AUTO_ASSIGN_TASKS=1"""
 
-    # Список курсов
-    courses: Set[Course] = set(Course.select())
+    if not AUTO_ASSIGN_TASKS:
+        return
 
-    # Свободные курсы: убираем курсы по которым ведутся работы
-    courses -= {task.theme.course for task in tasks}
-    course_ids = [course.id for course in courses]
+    for task in await run_db_heavy(_assign_tasks):
+        scheduler.schedule_task(task)
+        bloger: User = task.implementer
+        theme: Theme = task.theme
 
-    # получаем список блогеров в порядке их рейтинга
-    blogers: List[User] = sorted(
-        blogers, key=lambda user: user.bloger_rating, reverse=True
-    )
-
-    # Отбираем для каждого блогера подходящий курс
-    for bloger in blogers:
-
-        # Список курсов на которые подписан блогер
-        courses_by_bloger: Set[UserCourse] = {
-            user_course.course
-            for user_course in list(
-                UserCourse.select().where(
-                    (UserCourse.user == bloger.id)
-                    & (UserCourse.course.in_(course_ids))
-                )
-            )
-        }
-
-        # Если у блогера нет подписок, то фиг ему, а не задачу
-        if len(courses_by_bloger) == 0:
-            continue
-
-        # Пересечение свободных курсов и списка курсов блогера
-        courses_by_bloger &= courses
-
-        # Нет свободных курсов для блогера, не фартануло
-        if len(courses_by_bloger) == 0:
-            continue
-
-        # Сортируем курсы в порядке убывания средней оценки
-        courses_by_bloger = sorted(
-            courses_by_bloger,
-            key=lambda course, blogger=bloger: (
-                Task.select(fn.AVG(Task.score))
-                .join(Theme)
-                .where(
-                    (Theme.course == course.id)
-                    & (Task.implementer == blogger.id)
-                )
-                .scalar()
-                or 0.8
+        await outbox.send(
+            "send_message",
+            chat_id=bloger.tg_id,
+            text=(
+                f"Вам выдана тема {theme.link}.\n"
+                f"Срок: {task.due_date}\n"
+                '<a href="https://docs.google.com/document/d/'
+                "1KVv9BAqtZ1FZzqUTWO9REbTWJoT3LQrZfVHHtoAQWQ0/"
+                'edit?usp=sharing">Требования к видео</a>'
             ),
-            reverse=True,
+            parse_mode="HTML",
         )
 
-        for course_by_bloger in courses_by_bloger:
-            # Список тем этого курса
-            themes: Set[Theme] = set(
-                Theme.select().where(Theme.course == course_by_bloger.id)
-            )
-
-            # Убираем из списка темы, по которым ведутся или
-            # удачно закончены работы
-            themes -= set(
-                Theme.select()
-                .join(Task)
-                .where(
-                    (Task.status >= 0) & (Theme.course == course_by_bloger.id)
-                )
-            )
-
-            if len(themes) == 0:
-                continue
-
-            # Сортируем тыме по ID
-            themes: List[Theme] = sorted(themes, key=lambda theme: theme.id)
-
-            # Тема для блогера
-            theme_by_bloger: Theme = themes[0]
-
-            hours = int(theme_by_bloger.complexity * 72 + 1)
-            hours = max(hours, 72)
-
-            task_by_bloger: Task = Task.create(
-                implementer=bloger,
-                theme=theme_by_bloger,
-                due_date=get_date_time(hours=hours),
-            )
-
-            try:
-                await bot.send_message(
-                    chat_id=bloger.tg_id,
-                    text=(
-                        f"Вам выдана тема {theme_by_bloger.link}.\n"
-                        f"Срок: {task_by_bloger.due_date}\n"
-                        '<a href="https://docs.google.com/document/d/'
-                        "1KVv9BAqtZ1FZzqUTWO9REbTWJoT3LQrZfVHHtoAQWQ0/"
-                        'edit?usp=sharing">Требования к видео</a>'
-                    ),
-                    parse_mode="HTML",
-                )
-            except TelegramBadRequest as ex:
-                await send_message_admins(bot=bot, text=str(ex))
-
-            await send_message_admins(
-                bot=bot,
-                text=(
-                    f"Блогеру {bloger.link} "
-                    f"выдана тема {theme_by_bloger.link}"
-                ),
-            )
-            break
+        await send_message_admins(
+            bot=bot,
+            text=f"Блогеру {bloger.link} выдана тема {theme.link}",
+            category="tasks",
+        )
 
 
 @error_handler()
-async def send_message_admins(bot: Bot, text: str, reply_markup=None):
-    """Отправляет сообщение Администратору"""
-    for admin in get_admins():
-        try:
-            await bot.send_message(
-                chat_id=admin.tg_id,
-                text=text,
-                parse_mode="HTML",
-                disable_web_page_preview=True,
-                reply_markup=reply_markup,
-            )
-        except (TelegramAPIError, TelegramBadRequest) as ex:
-            print(ex)
-            await bot.send_message(
-                chat_id=admin.tg_id,
-                text=text,
-                reply_markup=reply_markup,
-            )
-
-
-def get_admins() -> List[User]:
-    """Возвращает список пользователей с ролью 'Админ'."""
-    return (
-        User.select(User)
-        .join(UserRole)
-        .where(UserRole.role == Role.get(name="Админ").id)
+async def send_message_admins(
+    # pylint: disable-next=unused-argument
+    bot: Bot,
+    text: str,
+    reply_markup=None,
+    category: str = None,
+):
+    """Отправляет сообщение Администраторам. Сообщения ставятся
+    в очередь outbox, обработчик не ждёт отправки.
+    Уведомление с категорией (см. digest.CATEGORIES) и без кнопок
+    откладывается в сводку, остальные, например ошибки, уходят сразу"""
+    if category and reply_markup is None and admin_digest.is_running:
+        admin_digest.add(category, text)
+        return
+    await outbox.send_many(
+        "send_message",
+        await run_db(get_admin_tg_ids),
+        text=text,
+        parse_mode="HTML",
+        disable_web_page_preview=True,
+        reply_markup=reply_markup,
     )
 
 
-@error_handler()
-async def send_new_review_request(bot: Bot):
-    """Выдать новый запрос на проверку"""
-
-    reviewer_ids = [
-        u.id
-        for u in User.select(User)
-        .join(ReviewRequest, on=ReviewRequest.reviewer_id == User.id)
-        .where(ReviewRequest.status == 0)
-    ]
-
-    if len(reviewer_ids) >= 5:
-        return
-
-    # видео у которых не хватает проверяющих
-    video_ids = [
-        v.id
-        for v in Video.select(Video)
-        .join(
-            ReviewRequest,
-            JOIN.LEFT_OUTER,
-            on=(ReviewRequest.video == Video.id),
-        )
-        .join(Task, on=Task.id == Video.task)
-        .join(User, on=User.id == Task.implementer)
-        .where(
-            (Task.status == 1)
-            & ((ReviewRequest.status >= 0) | (ReviewRequest.status.is_null()))
+async def flush_admin_digest():
+    """Отправляет Администраторам накопленную сводку"""
+    for text in admin_digest.pop_messages():
+        await outbox.send_many(
+            "send_message",
+            await run_db(get_admin_tg_ids),
+            text=text,
+            parse_mode="HTML",
+            disable_web_page_preview=True,
         )
-        .group_by(Video.id)
-        .order_by(User.bloger_rating.desc())
-        .having(fn.COUNT(Video.id) < 5)
-    ]
 
-    if len(video_ids) == 0:
-        return
 
-    video_id = video_ids[0]
-    if await add_reviewer(bot, Video.get_by_id(video_id)):
-        await send_new_review_request(bot)
+def get_admin_tg_ids() -> List[int]:
+    """Возвращает Telegram ID пользователей с ролью 'Админ'."""
+    return registry.get_member_tg_ids(registry.get_role("Админ"))
 
 
-@error_handler()
-async def add_reviewer(bot: Bot, video_id: int):
-    """Назначить проверяющего на видео"""
+def _assign_reviewers(
+    video_id: int = None,
+) -> Tuple[ReviewAssigner, List[ReviewRequest]]:
+    """Назначает проверяющих и учитывает новые запросы в рейтингах"""
+    assigner = ReviewAssigner()
+    requests = assigner.assign(video_id)
+    for review_request in requests:
+        rating_state.on_request_changed(review_request)
+        reviewer_pool.on_request_changed(review_request)
+    return assigner, requests
 
-    # Свободные проверяющие
-    vacant_reviewer_ids: List[int] = get_vacant_reviewer_ids()
 
-    video: Video = Video.get_by_id(video_id)
-    task: Task = video.task
-    theme: Theme = task.theme
-
-    if task.implementer_id in vacant_reviewer_ids:
-        vacant_reviewer_ids.remove(task.implementer_id)
+async def _send_review_requests(bot: Bot, video_id: int = None):
+    """Назначает проверяющих, отправляет им видео и сообщает
+    Администраторам о видео, оставшихся без проверяющих"""
+    assigner, requests = await run_db_heavy(_assign_reviewers, video_id)
+    for review_request in requests:
+        scheduler.schedule_review_request(review_request)
+    await asyncio.gather(
+        *(send_video(bot, review_request) for review_request in requests)
+    )
 
-    if len(vacant_reviewer_ids) == 0:
+    if assigner.exhausted is not None:
+        theme: Theme = assigner.exhausted.task.theme
         await send_message_admins(
             bot=bot,
             text=(
@@ -388,51 +287,51 @@ async def add_reviewer(bot: Bot, video_id: int):
                 f"{theme.course.title}|{theme.link}"
             ),
         )
-        return False
-
-    # те, кто уже проверяли эту тему
-    reviewer_ids = [
-        rr.reviewer_id
-        for rr in ReviewRequest.select(ReviewRequest.reviewer)
-        .join(Video, on=Video.id == ReviewRequest.video)
-        .join(Task, on=Task.id == Video.task)
-        .where(Task.theme == video.task.theme_id)
-        .group_by(ReviewRequest.reviewer)
-    ]
-
-    candidat_reviewer_ids = [
-        i for i in vacant_reviewer_ids if i not in reviewer_ids
-    ]
-    if len(candidat_reviewer_ids) == 0:
-
-        theme = Video.get_by_id(video_id).task.theme
+    if assigner.skipped:
         await send_message_admins(
             bot=bot,
-            text=(
-                f"<b>Нет кандидатов среди свободных проверяющих</b>"
-                f"{theme.course.title}|{theme.link}"
+            text="<b>Нет кандидатов среди свободных проверяющих</b>\n"
+            + "\n".join(
+                f"{video.task.theme.course.title}|{video.task.theme.link}"
+                for video in assigner.skipped
             ),
         )
-        return False
 
-    due_date = get_date_time(hours=25)
-    review_request = ReviewRequest.create(
-        reviewer_id=candidat_reviewer_ids[0],
-        video_id=video_id,
-        due_date=due_date,
+
+@error_handler()
+async def send_new_review_request(bot: Bot):
+    """Выдать новые запросы на проверку"""
+    await _send_review_requests(bot)
+
+
+@error_handler()
+async def add_reviewer(bot: Bot, video_id: int):
+    """Назначить проверяющего на видео"""
+    await _send_review_requests(bot, video_id)
+
+
+def get_reply_request_id(message: Message) -> Union[int, None]:
+    """ID запроса на проверку из подписи к видео, на которое ответил
+    проверяющий"""
+    reply = message.reply_to_message
+    if reply is None:
+        return None
+    found = re.search(
+        rf"{REVIEW_REQUEST_MARK}(\d+)", reply.caption or reply.text or ""
     )
-    await send_video(bot, review_request)
-    return True
+    return int(found.group(1)) if found else None
 
 
 @error_handler()
 async def send_video(bot: Bot, review_request: ReviewRequest):
     """Отправляет видео"""
     caption = (
+        f"{REVIEW_REQUEST_MARK}{review_request.id}. "
         f"Это видео нужно проверить до {review_request.due_date}.\n"
         f'Тема: "{review_request.video.task.theme.course.title}|'
         f'{review_request.video.task.theme.link}"\n'
-        "Для оценки видео напишите одно сообщение в начале которого "
+        "Для оценки видео ответьте на это сообщение одним сообщением, "
+        "в начале которого "
         "будет оценка в интервале [0.0; 5.0], а через пробел отзыв о видео"
         """
 0 - Мелкий текст (качество видео) и плохой звук. Такое лучше никому
@@ -446,25 +345,23 @@ async def send_video(bot: Bot, review_request: ReviewRequest):
 4 - Звук и видео в порядке. Материал подавался неуверенно, но всё было понято.
 5 - Это точно делал не студент, а какой-то профессионал. Образцовое видео."""
     )
-    try:
-        await bot.send_video(
-            chat_id=review_request.reviewer.tg_id,
-            video=review_request.video.file_id,
-            caption=caption,
-            parse_mode="HTML",
-            reply_markup=IKM(
-                inline_keyboard=[
-                    [
-                        IKB(
-                            text="Отказаться",
-                            callback_data=f"remove_reviewer_role_{review_request.reviewer.id}",
-                        )
-                    ]
+    await outbox.send(
+        "send_video",
+        chat_id=review_request.reviewer.tg_id,
+        video=review_request.video.file_id,
+        caption=caption,
+        parse_mode="HTML",
+        reply_markup=IKM(
+            inline_keyboard=[
+                [
+                    IKB(
+                        text="Отказаться",
+                        callback_data=f"remove_reviewer_role_{review_request.reviewer.id}",
+                    )
                 ]
-            ),
-        )
-    except TelegramBadRequest as ex:
-        print(ex, caption, sep="\n")
+            ]
+        ),
+    )
 
     await send_message_admins(
         bot=bot,
@@ -473,20 +370,13 @@ async def send_video(bot: Bot, review_request: ReviewRequest):
 Блогер: {review_request.video.task.implementer.comment}
 Курс: {review_request.video.task.theme.course.title}
 Тема: {review_request.video.task.theme.title}""",
+        category="reviews",
     )
 
 
-def get_limit_score():
-    """Вычисляет средний пороговый балл"""
-    score_data = [
-        t.score
-        for t in Task.select(Task.score)
-        .where(Task.status.not_in([0, 1, -1]))
-        .order_by(Task.id.desc())
-    ][:100]
-    score_data.sort()
-    print(score_data)
-    return score_data[len(score_data) // 4]
+def get_limit_score() -> float:
+    """Пороговый балл приёма работы"""
+    return acceptance.get_threshold()
 
 
 def update_task_score(task: Task) -> Task:
@@ -508,37 +398,12 @@ def update_task_score(task: Task) -> Task:
     task.score = task_score
     task.status = 2 if task_score >= get_limit_score() else -2
     task.save()
+    acceptance.on_task_changed(task)
+    catalogue.on_task_changed(task)
 
     return task
 
 
-def get_vacant_reviewer_ids() -> List[User]:
-    """Возвращает список ID проверяющих без активных задач для ревью"""
-    reviewer_ids = get_reviewer_ids()
-    # проверяющие у которых есть что проверить
-    jobs_ids = [
-        u.id
-        for u in User.select(User)
-        .join(ReviewRequest)
-        .where(ReviewRequest.status == 0)
-        .group_by(ReviewRequest.reviewer)
-        .order_by(User.reviewer_rating.desc())
-    ]
-    return [i for i in reviewer_ids if i not in jobs_ids]
-
-
-def get_reviewer_ids() -> List[User]:
-    """Пользователи с ролью проверяющий"""
-    return [
-        u.id
-        for u in User.select(User)
-        .join(UserRole)
-        .join(Role)
-        .where(Role.name == "Проверяющий")
-        .order_by(User.reviewer_rating.desc())
-    ]
-
-
 if __name__ == "__main__":
     data = get_limit_score()
     print(data)
@@ -0,0 +1,348 @@
+"""Загрузка курсов и тем из CSV.
+
+Строка файла: курс, тема, URL, сложность и, если по теме уже есть
+видео, реализатор и оценка. Пустой курс завершает загрузку.
+
+Загрузка выполняется после подтверждения: сначала CourseDiff сравнивает
+файл с курсами и темами БД в памяти, не изменяя её, и перечисляет
+новые, изменённые, неизменные и отсутствующие в файле темы.
+
+Прежде файл целиком декодировался в память, а каждая строка искала
+и создавала курс и тему отдельными запросами вне транзакции. Здесь
+файл читается и декодируется по частям, существующие курсы и темы
+загружаются в словари двумя запросами, новые курсы и темы вставляются,
+а изменённые темы обновляются пакетами по IMPORT_BATCH строк в одной
+транзакции: ошибка в файле откатывает всю загрузку.
+"""
+
+import csv
+import io
+import os
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Set, Tuple
+
+from dotenv import load_dotenv
+from peewee import chunked, fn
+
+from models import Course, Task, Theme, db
+
+# pylint: disable=no-member
+
+# Загрузка переменных из .env
+load_dotenv()
+# Сколько строк файла записывается в БД за раз
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "500"))
+
+
+def read_csv_rows(file: BinaryIO) -> Iterator[List[str]]:
+    """Строки CSV из двоичного файла. Файл декодируется из UTF-8
+    по частям по мере чтения строк и после чтения остаётся открытым"""
+    text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    try:
+        yield from csv.reader(text)
+    finally:
+        if not text.closed:
+            text.detach()
+
+
+def parse_number(value: str) -> float:
+    """Число из CSV, допускается десятичная запятая"""
+    return float(value.replace(",", "."))
+
+
+def check_row(row: List[str]):
+    """Проверяет числа строки: сложность темы и оценку видео"""
+    parse_number(row[3])
+    if len(row) > 5 and row[5]:
+        parse_number(row[5])
+
+
+def _get_last_id(model) -> int:
+    """Последний ID в таблице, новые записи получат ID больше него"""
+    query = model.select(fn.MAX(model.id))
+    return query.scalar() or 0  # pylint: disable=no-value-for-parameter
+
+
+# pylint: disable-next=too-many-instance-attributes
+class CourseImporter:
+    """Создаёт и обновляет курсы и темы по строкам CSV"""
+
+    def __init__(self, batch_size: int = IMPORT_BATCH):
+        self.batch_size = batch_size
+        # Название курса -> ID
+        self.courses: Dict[str, int] = {}
+        # (ID курса, тема) -> (ID темы, URL, сложность)
+        self.themes: Dict[Tuple[int, str], Tuple[int, str, float]] = {}
+        # Видео к загрузке: (ID темы, тема, [реализатор, оценка])
+        self.videos: List[Tuple[int, str, List[str]]] = []
+        # Темы, у которых изменилась сложность
+        self.changed_complexity: Set[int] = set()
+        # Блогеры, чьи баллы нужно пересчитать
+        self.user_ids: Set[int] = set()
+        self.rows = 0
+        self.created_courses = 0
+        self.created_themes = 0
+        self.updated_themes = 0
+        self._batch: List[List[str]] = []
+
+    def load(self) -> "CourseImporter":
+        """Загружает существующие курсы и темы. Из курсов и тем
+        с одинаковыми названиями берётся первый, как get_or_create"""
+        self.courses = {}
+        for course_id, title in (
+            Course.select(Course.id, Course.title).order_by(Course.id).tuples()
+        ):
+            self.courses.setdefault(title, course_id)
+        self.themes = {}
+        for theme_id, course_id, title, url, complexity in (
+            Theme.select(
+                Theme.id,
+                Theme.course,
+                Theme.title,
+                Theme.url,
+                Theme.complexity,
+            )
+            .order_by(Theme.id)
+            .tuples()
+        ):
+            self.themes.setdefault(
+                (course_id, title), (theme_id, url, complexity)
+            )
+        return self
+
+    def import_rows(self, rows: Iterable[List[str]]) -> "CourseImporter":
+        """Загружает строки одной транзакцией"""
+        with db.atomic():
+            self.load()
+            for row in rows:
+                if not row[0]:  # Пустая строка курса → конец загрузки
+                    break
+                # Ошибки в строке обнаруживаются до записи пакета
+                check_row(row)
+                self.rows += 1
+                self._batch.append(row)
+                if len(self._batch) >= self.batch_size:
+                    self._flush()
+            self._flush()
+            self.user_ids = self.get_affected_user_ids()
+        return self
+
+    def _create_courses(self, titles: Iterable[str]):
+        """Создаёт курсы, которых ещё нет"""
+        new = list(dict.fromkeys(t for t in titles if t not in self.courses))
+        if not new:
+            return
+        last_id = _get_last_id(Course)
+        for batch in chunked(new, 100):
+            query = Course.insert_many([{"title": title} for title in batch])
+            query.execute()  # pylint: disable=no-value-for-parameter
+        for course_id, title in (
+            Course.select(Course.id, Course.title)
+            .where(Course.id > last_id)
+            .order_by(Course.id)
+            .tuples()
+        ):
+            self.courses.setdefault(title, course_id)
+        self.created_courses += len(new)
+
+    def _create_themes(self, new: Dict[Tuple[int, str], Tuple[str, float]]):
+        """Создаёт темы и запоминает их ID"""
+        if not new:
+            return
+        rows = [
+            {
+                "course": course_id,
+                "title": title,
+                "url": url,
+                "complexity": complexity,
+            }
+            for (course_id, title), (url, complexity) in new.items()
+        ]
+        last_id = _get_last_id(Theme)
+        for batch in chunked(rows, 100):
+            query = Theme.insert_many(batch)
+            query.execute()  # pylint: disable=no-value-for-parameter
+        # Новые ID выбираются после последнего ID до вставки
+        for theme_id, course_id, title in (
+            Theme.select(Theme.id, Theme.course, Theme.title)
+            .where(Theme.id > last_id)
+            .order_by(Theme.id)
+            .tuples()
+        ):
+            self.themes[(course_id, title)] = (
+                theme_id,
+                *new[(course_id, title)],
+            )
+        self.created_themes += len(new)
+
+    def _update_themes(self, changed: Dict[int, Tuple[int, str, str, float]]):
+        """Обновляет URL и сложность тем вставкой с заменой по ID"""
+        rows = [
+            {
+                "id": theme_id,
+                "course": course_id,
+                "title": title,
+                "url": url,
+                "complexity": complexity,
+            }
+            for theme_id, (
+                course_id,
+                title,
+                url,
+                complexity,
+            ) in changed.items()
+        ]
+        for batch in chunked(rows, 100):
+            query = Theme.insert_many(batch).on_conflict(
+                conflict_target=[Theme.id],
+                preserve=[Theme.url, Theme.complexity],
+            )
+            query.execute()  # pylint: disable=no-value-for-parameter
+        self.updated_themes += len(changed)
+
+    def _flush(self):
+        """Записывает накопленные строки"""
+        batch, self._batch = self._batch, []
+        self._create_courses(row[0] for row in batch)
+        # Повтор темы в файле перезаписывает её, как и прежде
+        new: Dict[Tuple[int, str], Tuple[str, float]] = {}
+        changed: Dict[int, Tuple[int, str, str, float]] = {}
+        for row in batch:
+            key = (self.courses[row[0]], row[1])
+            url, complexity = row[2], parse_number(row[3])
+            if key not in self.themes:
+                new[key] = (url, complexity)
+                continue
+            theme_id, old_url, old_complexity = self.themes[key]
+            if (old_url, old_complexity) == (url, complexity):
+                continue
+            if old_complexity != complexity:
+                self.changed_complexity.add(theme_id)
+            changed[theme_id] = (*key, url, complexity)
+            self.themes[key] = (theme_id, url, complexity)
+        self._create_themes(new)
+        self._update_themes(changed)
+        for row in batch:
+            if len(row) > 4 and row[4]:  # Есть реализатор → видео
+                key = (self.courses[row[0]], row[1])
+                self.videos.append((self.themes[key][0], row[1], row[4:6]))
+
+    def get_affected_user_ids(self) -> Set[int]:
+        """Блогеры с принятыми работами по темам, у которых изменилась
+        сложность: только их баллы нужно пересчитать"""
+        user_ids = set()
+        for batch in chunked(self.changed_complexity, 500):
+            user_ids.update(
+                user_id
+                for user_id, in Task.select(Task.implementer)
+                .where(Task.theme.in_(batch) & Task.status.in_([2, 3]))
+                .distinct()
+                .tuples()
+            )
+        return user_ids
+
+    def get_report(self) -> str:
+        """Итог загрузки для администратора"""
+        return (
+            f"Строк: {self.rows}, новых курсов: {self.created_courses}, "
+            f"новых тем: {self.created_themes}, "
+            f"изменено тем: {self.updated_themes}"
+        )
+
+
+# Виды отличий файла от БД
+NEW, CHANGED, MISSING = "+", "~", "-"
+DIFF_HEADER = [
+    "",
+    "Курс",
+    "Тема",
+    "URL",
+    "Сложность",
+    "Прежний URL",
+    "Прежняя сложность",
+]
+
+
+class CourseDiff:
+    """Отличия CSV от курсов и тем БД без изменения БД.
+
+    Темы файла и БД сопоставляются по ключу (курс, тема) в словарях,
+    поэтому сравнение линейно по размеру файла и числу тем. Темы,
+    отсутствующие в файле, ищутся только в курсах из файла: загрузка
+    не удаляет темы и не трогает другие курсы.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.videos = 0
+        # (курс, тема) -> (URL, сложность) по файлу, повтор перезаписывает
+        self._file: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        # Строки файла отличий по видам
+        self.entries: Dict[str, List[List]] = {
+            NEW: [],
+            CHANGED: [],
+            MISSING: [],
+        }
+        self.unchanged = 0
+        self.new_courses = 0
+
+    def compare(self, rows: Iterable[List[str]]) -> "CourseDiff":
+        """Сравнивает строки файла с БД"""
+        for row in rows:
+            if not row[0]:  # Пустая строка курса → конец загрузки
+                break
+            check_row(row)
+            self.rows += 1
+            self._file[(row[0], row[1])] = (row[2], parse_number(row[3]))
+            if len(row) > 4 and row[4]:
+                self.videos += 1
+        importer = CourseImporter().load()
+        # ID курса из файла -> название
+        course_titles = {
+            importer.courses[course]: course
+            for course, _ in self._file
+            if course in importer.courses
+        }
+        self.new_courses = len(
+            {course for course, _ in self._file} - set(importer.courses)
+        )
+        for (course, title), (url, complexity) in self._file.items():
+            theme = importer.themes.get((importer.courses.get(course), title))
+            if theme is None:
+                self.entries[NEW].append([course, title, url, complexity])
+            elif theme[1:] == (url, complexity):
+                self.unchanged += 1
+            else:
+                self.entries[CHANGED].append(
+                    [course, title, url, complexity, *theme[1:]]
+                )
+        for (course_id, title), theme in importer.themes.items():
+            course = course_titles.get(course_id)
+            if course is not None and (course, title) not in self._file:
+                self.entries[MISSING].append([course, title, *theme[1:]])
+        return self
+
+    def has_changes(self) -> bool:
+        """Загрузка изменит темы или потребует видео"""
+        return bool(self.entries[NEW] or self.entries[CHANGED] or self.videos)
+
+    def get_report(self) -> str:
+        """Число отличий для администратора"""
+        return (
+            f"Строк: {self.rows}, новых курсов: {self.new_courses}\n"
+            f"Тем новых: {len(self.entries[NEW])}, "
+            f"изменённых: {len(self.entries[CHANGED])}, "
+            f"без изменений: {self.unchanged}, "
+            f"нет в файле: {len(self.entries[MISSING])}\n"
+            f"Видео к загрузке: {self.videos}"
+        )
+
+    def get_diff_file(self) -> bytes:
+        """Файл отличий в CSV: вид, курс, тема, URL и сложность,
+        у изменённых тем — и прежние значения. Неизменные темы
+        не выводятся"""
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow(DIFF_HEADER)
+        for kind, entries in self.entries.items():
+            writer.writerows([kind, *entry] for entry in entries)
+        return text.getvalue().encode("utf-8")
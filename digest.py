@@ -0,0 +1,134 @@
+"""Сводки уведомлений администраторам.
+
+Несрочные уведомления копятся по категориям и раз в
+ADMIN_DIGEST_INTERVAL секунд уходят общими сообщениями.
+"""
+
+import asyncio
+import os
+import traceback
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+# Загрузка переменных из .env
+load_dotenv()
+# Период отправки сводок, секунд. 0 — уведомления уходят сразу
+ADMIN_DIGEST_INTERVAL = float(os.getenv("ADMIN_DIGEST_INTERVAL", "300"))
+# Предел длины сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+# Категории уведомлений в порядке вывода в сводке
+CATEGORIES = {
+    "videos": "Присланные видео",
+    "reviews": "Проверка видео",
+    "tasks": "Выдача тем",
+    "extensions": "Продление сроков",
+    "deadlines": "Просрочки",
+    "roles": "Роли",
+    "users": "Пользователи",
+    "other": "Прочее",
+}
+
+
+def split_part(part: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Делит часть длиннее limit по строкам. Режется на куски только
+    строка длиннее limit"""
+    pieces = []
+    for line in part.split("\n"):
+        while len(line) > limit:
+            pieces.append(line[:limit])
+            line = line[limit:]
+        pieces.append(line)
+    return pieces
+
+
+def split_text(parts: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Собирает части в сообщения не длиннее limit, разделяя их пустой
+    строкой. Сообщения делятся между частями, а часть длиннее limit —
+    между строками, чтобы разрыв не попал внутрь HTML-тега или сущности"""
+    messages = []
+    current = None
+    for part in parts:
+        pieces = [part] if len(part) <= limit else split_part(part, limit)
+        for number, piece in enumerate(pieces):
+            separator = "\n" if number else "\n\n"
+            if current is None:
+                current = piece
+            elif len(current) + len(separator) + len(piece) <= limit:
+                current += separator + piece
+            else:
+                messages.append(current)
+                current = piece
+    if current is not None:
+        messages.append(current)
+    return messages
+
+
+class Digest:
+    """Буфер уведомлений по категориям"""
+
+    def __init__(
+        self,
+        interval: float = ADMIN_DIGEST_INTERVAL,
+        limit: int = MESSAGE_LIMIT,
+    ):
+        self.interval = interval
+        self.limit = limit
+        self._items: Dict[str, List[Tuple[datetime, str]]] = {}
+        self._flush: Callable[[], Awaitable] = None
+        self._task: asyncio.Task = None
+
+    @property
+    def is_running(self) -> bool:
+        """Сводки включены и отправляются"""
+        return self._task is not None
+
+    def add(self, category: str, text: str):
+        """Добавляет уведомление в сводку"""
+        if category not in CATEGORIES:
+            raise ValueError(f"Неизвестная категория уведомлений: {category}")
+        self._items.setdefault(category, []).append((datetime.now(), text))
+
+    def pop_messages(self) -> List[str]:
+        """Забирает накопленные уведомления и собирает из них сообщения.
+        Каждая категория начинается с нового сообщения"""
+        items, self._items = self._items, {}
+        messages = []
+        for category, title in CATEGORIES.items():
+            if category not in items:
+                continue
+            parts = [f"<b>📋 {title}: {len(items[category])}</b>"]
+            parts += [f"{at:%H:%M} {text}" for at, text in items[category]]
+            messages += split_text(parts, self.limit)
+        return messages
+
+    def start(self, flush: Callable[[], Awaitable]):
+        """Запускает периодическую отправку. flush забирает сообщения
+        через pop_messages и отправляет их"""
+        if self.interval <= 0:
+            return
+        self._flush = flush
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает периодическую отправку и отправляет остаток"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self._flush()
+
+    async def _run(self):
+        """Отправляет сводки раз в interval секунд"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._flush()
+            except Exception:  # pylint: disable=broad-exception-caught
+                traceback.print_exc()
+
+
+admin_digest = Digest()
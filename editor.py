@@ -0,0 +1,124 @@
+"""Редактирование сообщений без лишних запросов к Telegram.
+
+Обработчики кнопок перерисовывали сообщение целиком, даже если текст
+и кнопки не изменились: Telegram отвечал ошибкой "message is not
+modified", а запрос тратился впустую. MessageEditor хранит отпечатки
+последних текста и кнопок каждого сообщения и пропускает правку без
+изменений, а если изменились только кнопки, правит только их.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Tuple, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, Message
+from dotenv import load_dotenv
+
+# Загрузка переменных из .env
+load_dotenv()
+# Для скольких последних сообщений хранятся отпечатки
+EDIT_CACHE_SIZE = int(os.getenv("EDIT_CACHE_SIZE", "10000"))
+
+# Результаты edit
+SKIPPED, MARKUP, TEXT = "skipped", "markup", "text"
+
+
+def get_markup_fingerprint(
+    reply_markup: Union[InlineKeyboardMarkup, None],
+) -> int:
+    """Отпечаток кнопок сообщения"""
+    if reply_markup is None:
+        return hash(None)
+    return hash(reply_markup.model_dump_json(exclude_none=True))
+
+
+def get_text_fingerprint(text: str, options: dict) -> int:
+    """Отпечаток текста с параметрами его вывода"""
+    return hash((text, tuple(sorted(options.items()))))
+
+
+class MessageEditor:
+    """Отпечатки текста и кнопок по (ID чата, ID сообщения)"""
+
+    def __init__(self, size: int = EDIT_CACHE_SIZE):
+        self.size = size
+        # (ID чата, ID сообщения) -> (отпечаток текста, отпечаток кнопок)
+        self._fingerprints: OrderedDict[Tuple[int, int], Tuple[int, int]] = (
+            OrderedDict()
+        )
+
+    def _get_fingerprints(
+        self, message: Message, options: dict
+    ) -> Union[Tuple[int, int], None]:
+        """Последние отпечатки сообщения. Если сообщение ещё не
+        правилось, они берутся из самого сообщения, когда его текст
+        можно сравнить: HTML или простой текст без разметки"""
+        key = (message.chat.id, message.message_id)
+        if key in self._fingerprints:
+            self._fingerprints.move_to_end(key)
+            return self._fingerprints[key]
+        # У недоступного сообщения нет текста и кнопок
+        parse_mode = options.get("parse_mode")
+        if parse_mode == "HTML":
+            text = getattr(message, "html_text", None)
+        elif parse_mode is None and not getattr(message, "entities", None):
+            text = getattr(message, "text", None)
+        else:
+            return None
+        if text is None:
+            return None
+        return (
+            get_text_fingerprint(text, options),
+            get_markup_fingerprint(message.reply_markup),
+        )
+
+    def _remember(self, message: Message, fingerprints: Tuple[int, int]):
+        """Запоминает отпечатки, вытесняя самые старые сообщения"""
+        key = (message.chat.id, message.message_id)
+        self._fingerprints[key] = fingerprints
+        self._fingerprints.move_to_end(key)
+        while len(self._fingerprints) > self.size:
+            self._fingerprints.popitem(last=False)
+
+    def forget(self, message: Message):
+        """Забывает сообщение, изменённое или удалённое в обход edit"""
+        self._fingerprints.pop((message.chat.id, message.message_id), None)
+
+    async def edit(
+        self,
+        message: Message,
+        text: str,
+        reply_markup: InlineKeyboardMarkup = None,
+        **options,
+    ) -> str:
+        """Правит текст и кнопки сообщения, как edit_text. Возвращает
+        SKIPPED, если ничего не изменилось, MARKUP, если изменены
+        только кнопки, и TEXT, если изменён текст"""
+        fingerprints = (
+            get_text_fingerprint(text, options),
+            get_markup_fingerprint(reply_markup),
+        )
+        last = self._get_fingerprints(message, options)
+        result = TEXT
+        if last == fingerprints:
+            result = SKIPPED
+        elif last is not None and last[0] == fingerprints[0]:
+            result = MARKUP
+        try:
+            if result == MARKUP:
+                await message.edit_reply_markup(reply_markup=reply_markup)
+            elif result == TEXT:
+                await message.edit_text(
+                    text=text, reply_markup=reply_markup, **options
+                )
+        except TelegramBadRequest as ex:
+            if "message is not modified" not in ex.message:
+                self.forget(message)
+                raise
+            result = SKIPPED
+        self._remember(message, fingerprints)
+        return result
+
+
+editor = MessageEditor()
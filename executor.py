@@ -0,0 +1,49 @@
+"""Модуль выполнения запросов к БД вне цикла событий"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from dotenv import load_dotenv
+
+# Загрузка переменных из .env
+load_dotenv()
+# Потоки для коротких запросов: поиск пользователя, роли, записи
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+# Потоки для тяжёлых агрегатов: рейтинги, отчёты, импорт
+DB_HEAVY_WORKERS = int(os.getenv("DB_HEAVY_WORKERS", "1"))
+
+_executor = ThreadPoolExecutor(
+    max_workers=DB_WORKERS,
+    thread_name_prefix="db",
+)
+_heavy_executor = ThreadPoolExecutor(
+    max_workers=DB_HEAVY_WORKERS,
+    thread_name_prefix="db_heavy",
+)
+
+
+async def run_db(func: Callable, *args, **kwargs) -> Any:
+    """Выполняет короткий запрос к БД в пуле потоков,
+    не блокируя цикл событий"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+async def run_db_heavy(func: Callable, *args, **kwargs) -> Any:
+    """Выполняет тяжёлый запрос к БД в отдельном пуле потоков,
+    чтобы он не задерживал короткие запросы"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _heavy_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+def shutdown():
+    """Дожидается завершения запросов и останавливает пулы потоков"""
+    _executor.shutdown(wait=True)
+    _heavy_executor.shutdown(wait=True)
@@ -5,21 +5,41 @@ from typing import Union
 from aiogram.filters import BaseFilter
 from aiogram.types import CallbackQuery, Message
 
-from models import ReviewRequest, Role, Task, User, UserRole
+from executor import run_db
+from middlewares import UserContext
+from models import User
+from roles import registry
 
 
-class IsUser(BaseFilter):
-    """Базовый фильтр для проверки зарегистрированного пользователя."""
+class RoleByName:
+    """Роль фильтра. Берётся из registry при каждом обращении, а не при
+    импорте: импорт идёт до migrate, после которой кэш ролей сбрасывается"""
 
-    async def __call__(self, subject: Union[Message, CallbackQuery]):
+    def __init__(self, name: str):
+        self.name = name
 
-        user: User = User.get_or_none(tg_id=subject.from_user.id)
+    def __get__(self, instance, owner):
+        return registry.get_role(self.name)
 
-        if user is None:
-            user = User.create(
+
+class IsUser(BaseFilter):
+    """Базовый фильтр для проверки зарегистрированного пользователя."""
+
+    async def __call__(
+        self,
+        subject: Union[Message, CallbackQuery],
+        user_context: UserContext,
+    ):
+
+        if user_context.user is None:
+            # Первые обновления пользователя могут прийти одновременно,
+            # get_or_create при совпадении tg_id вернёт созданную запись
+            user_context.user, _ = await run_db(
+                User.get_or_create,
                 tg_id=subject.from_user.id,
-                username=subject.from_user.username,
+                defaults={"username": subject.from_user.username},
             )
+        user: User = user_context.user
 
         if subject.from_user.username is None:
             await subject.answer(
@@ -30,7 +50,7 @@ class IsUser(BaseFilter):
 
         if subject.from_user.username != user.username:
             user.username = subject.from_user.username
-            user.save()
+            await run_db(user.save)
 
         if user.comment is None:
             await subject.answer(
@@ -49,77 +69,70 @@ class IsUser(BaseFilter):
 class IsAdmin(IsUser):
     """Фильтр для проверки прав администратора."""
 
-    role = Role.get(name="Админ")
+    role = RoleByName("Админ")
 
-    async def __call__(self, message: Message) -> bool:
-        is_user = await super().__call__(message)
+    async def __call__(
+        self, message: Message, user_context: UserContext
+    ) -> bool:
+        is_user = await super().__call__(message, user_context)
         if not is_user:
             return False
 
-        user_role = UserRole.get_or_none(
-            user=User.get(tg_id=message.from_user.id), role=self.role
-        )
-        return user_role is not None
+        return user_context.has_role(self.role)
 
 
 class IsBloger(IsUser):
     """Фильтр для проверки статуса блогера."""
 
-    role = Role.get(name="Блогер")
+    role = RoleByName("Блогер")
 
-    async def __call__(self, message: Message) -> bool:
-        is_user = await super().__call__(message)
+    async def __call__(
+        self, message: Message, user_context: UserContext
+    ) -> bool:
+        is_user = await super().__call__(message, user_context)
         if not is_user:
             return False
 
-        user_role = UserRole.get_or_none(
-            user=User.get(tg_id=message.from_user.id), role=self.role
-        )
-        return user_role is not None
+        return user_context.has_role(self.role)
 
 
 class WaitVideo(BaseFilter):
     """Ожидает получение видео по задаче"""
 
-    async def __call__(self, message: Message) -> bool:
-        user = User.get(tg_id=message.from_user.id)
-        task = Task.get_or_none(implementer=user, status=0)
+    async def __call__(
+        self, message: Message, user_context: UserContext
+    ) -> bool:
+        task = await run_db(user_context.get_active_task)
         return task is not None
 
 
 class IsReviewer(IsUser):
     """Проверяет что польователь проверяющий"""
 
-    role = Role.get(name="Проверяющий")
+    role = RoleByName("Проверяющий")
 
-    async def __call__(self, message: Message) -> bool:
-        is_user = await super().__call__(message)
+    async def __call__(
+        self, message: Message, user_context: UserContext
+    ) -> bool:
+        is_user = await super().__call__(message, user_context)
         if not is_user:
             return False
 
-        user_role = UserRole.get_or_none(
-            user=User.get(tg_id=message.from_user.id), role=self.role
-        )
-        return user_role is not None
+        return user_context.has_role(self.role)
 
 
 class IsReview(IsReviewer):
     """Проверяет что у проверяющего есть задача"""
 
-    async def __call__(self, message: Message) -> bool:
-        check = await super().__call__(message)
+    async def __call__(
+        self, message: Message, user_context: UserContext
+    ) -> bool:
+        check = await super().__call__(message, user_context)
         if not check:
             return False
 
         if not isinstance(message, (Message, CallbackQuery)):
             return False
 
-        user = User.get(tg_id=message.from_user.id)
-        rr = (
-            ReviewRequest.select(ReviewRequest)
-            .where(
-                (ReviewRequest.reviewer == user) & (ReviewRequest.status == 0)
-            )
-            .first()
-        )
+        rr = await run_db(user_context.get_review_request)
         return rr is not None
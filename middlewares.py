@@ -0,0 +1,86 @@
+"""Промежуточные обработчики обновлений"""
+
+from typing import Any, Awaitable, Callable, Dict, List, Union
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from executor import run_db
+from models import ReviewRequest, Role, Task, User
+from roles import registry
+
+# pylint: disable=no-member
+
+# Значение ещё не запрашивалось из БД
+NOT_LOADED = object()
+
+
+class UserContext:
+    """Пользователь, загруженный один раз на обновление.
+    Общий для всех роутеров и фильтров, через которые проходит обновление"""
+
+    def __init__(self, tg_id: int, user: Union[User, None]):
+        self.tg_id = tg_id
+        self.user = user
+        self._active_task = NOT_LOADED
+        self._review_requests = NOT_LOADED
+
+    def has_role(self, role: Role) -> bool:
+        """Проверяет наличие роли у пользователя по кэшу ролей"""
+        return self.user is not None and registry.has_role(self.user.id, role)
+
+    def get_active_task(self) -> Union[Task, None]:
+        """Выданная пользователю задача, запрашивается один раз"""
+        if self._active_task is NOT_LOADED:
+            self._active_task = (
+                None
+                if self.user is None
+                else Task.get_or_none(implementer=self.user, status=0)
+            )
+        return self._active_task
+
+    def get_review_requests(self) -> List[ReviewRequest]:
+        """Открытые запросы на проверку у пользователя по возрастанию ID,
+        запрашиваются один раз вместе с видео, задачей и темой.
+        При REVIEWER_PARALLEL больше 1 их может быть несколько"""
+        if self._review_requests is NOT_LOADED:
+            self._review_requests = (
+                []
+                if self.user is None
+                else list(
+                    ReviewRequest.select_with_task()
+                    .where(
+                        (ReviewRequest.reviewer == self.user)
+                        & (ReviewRequest.status == 0)
+                    )
+                    .order_by(ReviewRequest.id)
+                )
+            )
+        return self._review_requests
+
+    def get_review_request(self) -> Union[ReviewRequest, None]:
+        """Самый ранний открытый запрос на проверку у пользователя"""
+        requests = self.get_review_requests()
+        return requests[0] if requests else None
+
+
+def load_user_context(tg_id: int) -> UserContext:
+    """Загружает пользователя, роли берутся из кэша ролей"""
+    return UserContext(tg_id=tg_id, user=User.get_or_none(tg_id=tg_id))
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Добавляет в данные обработчиков user_context отправителя"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is not None:
+            data["user_context"] = await run_db(
+                load_user_context, from_user.id
+            )
+        return await handler(event, data)
@@ -0,0 +1,250 @@
+"""Версионные миграции схемы БД.
+
+Запуск: python migrations.py [--check]
+"""
+
+import argparse
+from datetime import datetime
+from typing import List, Tuple
+
+from models import (
+    MODELS,
+    OutboxMessage,
+    Poll,
+    ReviewRequest,
+    Role,
+    SchemaVersion,
+    Task,
+    User,
+    UserRole,
+    db,
+)
+
+# pylint: disable=no-member
+
+
+def get_dedup_statements(
+    table: str, column: str, references: List[Tuple[str, str]] = ()
+) -> List[str]:
+    """SQL удаления повторов table по column перед созданием уникального
+    индекса: остаётся запись с наименьшим ID, ссылки references
+    (таблица, столбец) на удаляемые записи переводятся на неё"""
+    duplicates = (
+        f'SELECT "id" FROM "{table}" WHERE "id" NOT IN ('
+        f'SELECT MIN("id") FROM "{table}" GROUP BY "{column}")'
+    )
+    statements = [
+        f'UPDATE "{ref_table}" SET "{ref_column}" = ('
+        f'SELECT MIN(t2."id") FROM "{table}" t1 JOIN "{table}" t2 '
+        f'ON t2."{column}" = t1."{column}" '
+        f'WHERE t1."id" = "{ref_table}"."{ref_column}") '
+        f'WHERE "{ref_column}" IN ({duplicates})'
+        for ref_table, ref_column in references
+    ]
+    statements.append(f'DELETE FROM "{table}" WHERE "id" IN ({duplicates})')
+    return statements
+
+
+# Миграции: версия, название, SQL-выражения.
+# Имена индексов совпадают с теми, что создаёт peewee по описанию моделей,
+# поэтому новая БД из create_tables и старая БД после миграций одинаковы.
+# Уникальные индексы создаются только здесь, после удаления повторов:
+# create_tables строит индексы лишь для новых, пустых таблиц.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (
+        1,
+        "Уникальный индекс пользователя по Telegram ID",
+        [
+            # Повторно созданные пользователи сливаются с первым
+            *get_dedup_statements(
+                "user",
+                "tg_id",
+                [
+                    ("userrole", "user_id"),
+                    ("usercourse", "user_id"),
+                    ("task", "implementer_id"),
+                    ("reviewrequest", "reviewer_id"),
+                ],
+            ),
+            'CREATE UNIQUE INDEX IF NOT EXISTS "user_tg_id" '
+            'ON "user" ("tg_id")',
+        ],
+    ),
+    (
+        2,
+        "Индекс задач по статусу и исполнителю",
+        [
+            'CREATE INDEX IF NOT EXISTS "task_status_implementer_id" '
+            'ON "task" ("status", "implementer_id")',
+        ],
+    ),
+    (
+        3,
+        "Индексы запросов на проверку по проверяющему и сроку",
+        [
+            'CREATE INDEX IF NOT EXISTS "reviewrequest_reviewer_id_status" '
+            'ON "reviewrequest" ("reviewer_id", "status")',
+            'CREATE INDEX IF NOT EXISTS "reviewrequest_status_due_date" '
+            'ON "reviewrequest" ("status", "due_date")',
+        ],
+    ),
+    (
+        4,
+        "Уникальный индекс ролей пользователя",
+        [
+            # Удаляем повторно выданные роли, оставляя первую
+            'DELETE FROM "userrole" WHERE "id" NOT IN ('
+            'SELECT MIN("id") FROM "userrole" '
+            'GROUP BY "user_id", "role_id")',
+            'CREATE UNIQUE INDEX IF NOT EXISTS "userrole_user_id_role_id" '
+            'ON "userrole" ("user_id", "role_id")',
+        ],
+    ),
+    (
+        5,
+        "Уникальный индекс опроса по ID опроса Telegram",
+        [
+            # Повторно сохранённые опросы удаляются, остаётся первый
+            *get_dedup_statements("poll", "poll_id"),
+            'CREATE UNIQUE INDEX IF NOT EXISTS "poll_poll_id" '
+            'ON "poll" ("poll_id")',
+        ],
+    ),
+    (
+        6,
+        "Индекс очереди исходящих сообщений по статусу",
+        [
+            'CREATE INDEX IF NOT EXISTS "outboxmessage_status" '
+            'ON "outboxmessage" ("status")',
+        ],
+    ),
+]
+
+
+def get_applied_versions() -> List[int]:
+    """Возвращает версии уже применённых миграций"""
+    return [sv.version for sv in SchemaVersion.select(SchemaVersion.version)]
+
+
+def migrate() -> List[int]:
+    """Создаёт недостающие таблицы и применяет новые миграции по порядку.
+    Возвращает версии применённых миграций"""
+    # Существующие таблицы не трогаются: их индексы создают миграции
+    db.create_tables([model for model in MODELS if not model.table_exists()])
+    applied = set(get_applied_versions())
+    new_versions = []
+    for version, name, statements in sorted(MIGRATIONS):
+        if version in applied:
+            continue
+        with db.atomic():
+            for sql in statements:
+                db.execute_sql(sql)
+            SchemaVersion.create(
+                version=version, name=name, at_applied=datetime.now()
+            )
+        print(f"Применена миграция {version}: {name}")
+        new_versions.append(version)
+    return new_versions
+
+
+def get_query_plan(query) -> str:
+    """Возвращает план выполнения запроса peewee"""
+    sql, params = query.sql()
+    rows = db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+
+def get_hot_queries():
+    """Запросы, выполняемые на каждое обновление, и индексы,
+    которые они должны использовать"""
+    user = User(id=1, tg_id=1)
+    role = Role(id=1)
+    return [
+        ("IsUser", User.select().where(User.tg_id == 1), "user_tg_id"),
+        (
+            "IsAdmin/IsBloger/IsReviewer",
+            UserRole.select().where(
+                (UserRole.user == user) & (UserRole.role == role)
+            ),
+            "userrole_user_id_role_id",
+        ),
+        (
+            "WaitVideo",
+            Task.select().where(
+                (Task.implementer == user) & (Task.status == 0)
+            ),
+            "task_status_implementer_id",
+        ),
+        (
+            "IsReview",
+            ReviewRequest.select().where(
+                (ReviewRequest.reviewer == user) & (ReviewRequest.status == 0)
+            ),
+            "reviewrequest_reviewer_id_status",
+        ),
+        (
+            "send_task",
+            Task.select(Task.implementer).where(Task.status.in_([0, 1])),
+            "task_status_implementer_id",
+        ),
+        (
+            "ReviewAssigner",
+            ReviewRequest.select(ReviewRequest.reviewer).where(
+                ReviewRequest.status == 0
+            ),
+            "reviewrequest_status_due_date",
+        ),
+        (
+            "get_old_reviewe_requests",
+            ReviewRequest.select().where(
+                (ReviewRequest.due_date <= datetime.now())
+                & (ReviewRequest.status == 0)
+            ),
+            "reviewrequest_status_due_date",
+        ),
+        (
+            "poll_answer",
+            Poll.select().where(Poll.poll_id == "1"),
+            "poll_poll_id",
+        ),
+        (
+            "outbox",
+            OutboxMessage.select()
+            .where(OutboxMessage.status == 0)
+            .order_by(OutboxMessage.id),
+            "outboxmessage_status",
+        ),
+    ]
+
+
+def check_query_plans():
+    """Проверяет, что горячие запросы используют индексы"""
+    failed = []
+    for name, query, index in get_hot_queries():
+        plan = get_query_plan(query)
+        status = "OK" if index in plan else "FAIL"
+        print(f"{status:<4} {name}: {plan}")
+        if index not in plan:
+            failed.append(name)
+    if failed:
+        raise AssertionError(
+            f"Запросы не используют индексы: {', '.join(failed)}"
+        )
+
+
+def main():
+    """Применяет миграции и при необходимости проверяет планы запросов"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="проверить планы горячих запросов",
+    )
+    args = parser.parse_args()
+    migrate()
+    if args.check:
+        check_query_plans()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 """Модуль модели БД"""
 
+import os
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Union
 
+from dotenv import load_dotenv
 from peewee import (
     JOIN,
     BooleanField,
@@ -14,13 +16,68 @@ from peewee import (
     IntegerField,
     Model,
     SqliteDatabase,
+    TextField,
     fn,
 )
 
 # pylint: disable=no-member
 # pylint: disable=too-few-public-methods
 
-db = SqliteDatabase("sqlite.db")
+# Загрузка переменных из .env
+load_dotenv()
+
+# Профили настроек SQLite
+SQLITE_PROFILES = {
+    # Настройки SQLite по умолчанию
+    "default": {},
+    # WAL журнал без fsync на каждую транзакцию, 64 МБ кэша страниц,
+    # 256 МБ отображения файла в память
+    "tuned": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "busy_timeout": 5000,
+        "foreign_keys": 1,
+    },
+}
+
+# Переменные .env, переопределяющие отдельные настройки профиля
+SQLITE_PRAGMA_VARS = {
+    "journal_mode": "SQLITE_JOURNAL_MODE",
+    "synchronous": "SQLITE_SYNCHRONOUS",
+    "cache_size": "SQLITE_CACHE_SIZE",
+    "mmap_size": "SQLITE_MMAP_SIZE",
+    "busy_timeout": "SQLITE_BUSY_TIMEOUT",
+    "foreign_keys": "SQLITE_FOREIGN_KEYS",
+}
+
+
+def get_pragmas(profile: str = None) -> Dict[str, Union[int, str]]:
+    """Собирает настройки SQLite из профиля и переменных .env"""
+    profile = profile or os.getenv("SQLITE_PROFILE", "tuned")
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Неизвестный профиль SQLite {profile}")
+
+    pragmas = dict(SQLITE_PROFILES[profile])
+    for pragma, var in SQLITE_PRAGMA_VARS.items():
+        value = os.getenv(var)
+        if value:
+            pragmas[pragma] = (
+                int(value) if value.lstrip("-").isdigit() else value
+            )
+    return pragmas
+
+
+def create_database(path: str = None, profile: str = None) -> SqliteDatabase:
+    """Создаёт подключение к SQLite с настройками из .env"""
+    return SqliteDatabase(
+        path or os.getenv("SQLITE_PATH", "sqlite.db"),
+        pragmas=get_pragmas(profile),
+    )
+
+
+db = create_database()
 
 
 CASCADE = {
@@ -66,7 +123,7 @@ class Table(Model):
 class User(Table):
     """Модель пользователя с данными Telegram"""
 
-    tg_id = IntegerField()
+    tg_id = IntegerField(unique=True)
     username = CharField(null=True)
     # рейтинг блогера/проверющего
     bloger_rating = FloatField(default=0.8)
@@ -106,9 +163,9 @@ class User(Table):
         """Обновление количеста баллов (очков)"""
 
         tasks: List[Task] = list(
-            Task.select(Task).where(
-                (Task.implementer == self.id) & (Task.status.in_([2, 3]))
-            )
+            Task.select(Task)
+            .where((Task.implementer == self.id) & (Task.status.in_([2, 3])))
+            .order_by(Task.id)
         )
 
         bloger_score = 0
@@ -188,17 +245,9 @@ class User(Table):
 
         data = [
             (max_dur - ((row["r_h"] - row["rr_h"]) * 24)) / delta
-            for row in ReviewRequest.select(
-                fn.julianday(Review.at_created).alias("r_h"),
-                fn.julianday(ReviewRequest.at_created).alias("rr_h"),
+            for row in ReviewRequest.select_review_times(limit_dt).where(
+                ReviewRequest.reviewer == self.id
             )
-            .join(Review)
-            .where(
-                (ReviewRequest.status == 1)
-                & (ReviewRequest.reviewer == self.id)
-                & (ReviewRequest.at_created > limit_dt)
-            )
-            .dicts()
         ]
 
         while len(data) < 3:
@@ -246,27 +295,7 @@ class User(Table):
         delta = max_duration - min_duration
         duration = (
             Task.select(
-                fn.AVG(
-                    Case(
-                        None,
-                        [
-                            (
-                                Task.status == 0,
-                                (
-                                    fn.julianday(datetime.now())
-                                    - fn.julianday(Task.at_created)
-                                )
-                                * 24,
-                            )
-                        ],
-                        (
-                            fn.julianday(Video.at_created)
-                            - fn.julianday(Task.at_created)
-                        )
-                        * 24,
-                    )
-                    / Theme.complexity
-                ).alias("avg_hours"),
+                fn.AVG(Task.select_duration()).alias("avg_hours"),
             )
             .join(Theme)
             .join(Video, JOIN.LEFT_OUTER, on=Video.task == Task.id)
@@ -307,11 +336,21 @@ class User(Table):
 
         return self.bloger_rating, *ratings
 
-    def get_bloger_report(self):
-        """Получить отчет по блогеру"""
+    def get_bloger_report(self, ratings: Tuple[float, float, float] = None):
+        """Получить отчет по блогеру. ratings - уже посчитанные рейтинги
+        по оценкам, просрочкам и продолжительности"""
+
+        if ratings is None:
+            ratings = (
+                self.get_bloger_rating_from_scores(),
+                self.get_bloger_rating_from_over(),
+                self.get_bloger_rating_from_duration(),
+            )
+        from_scores, from_over, from_duration = ratings
 
         tasks: List[Task] = (
-            Task.select()
+            Task.select(Task, Theme)
+            .join(Theme)
             .where((Task.implementer == self.id) & (Task.status.in_([2, 3])))
             .order_by(Task.at_created)
         )
@@ -330,21 +369,31 @@ class User(Table):
             )
         return (
             f"<b>Рейтинг блогера</b>: {(self.bloger_rating * 100):.2f}%\n"
-            f"- скорость исполнения: "
-            f"{(self.get_bloger_rating_from_duration() * 100):.2f}%\n"
-            f"- соблюдение срока: "
-            f"{(self.get_bloger_rating_from_over() * 100):.2f}%\n"
-            f"- качество видео: "
-            f"{(self.get_bloger_rating_from_scores() * 100):.2f}%\n"
+            f"- скорость исполнения: {(from_duration * 100):.2f}%\n"
+            f"- соблюдение срока: {(from_over * 100):.2f}%\n"
+            f"- качество видео: {(from_scores * 100):.2f}%\n"
             f"\n<b>Баллы блогера</b>: {self.bloger_score:.2f}\n"
             f"{report}\n"
         )
 
-    def get_reviewer_report(self):
-        """Получить отчет проверяющего"""
+    def get_reviewer_report(self, ratings: Tuple[float, float, float] = None):
+        """Получить отчет проверяющего. ratings - уже посчитанные рейтинги
+        по оценкам, просрочкам и продолжительности"""
+
+        if ratings is None:
+            ratings = (
+                self.get_reviewer_rating_from_score(),
+                self.get_reviewer_rating_from_over(),
+                self.get_reviewer_rating_from_duration(),
+            )
+        from_score, from_over, from_duration = ratings
 
         rrs: List[ReviewRequest] = list(
-            ReviewRequest.select().where(
+            ReviewRequest.select(ReviewRequest, Video, Task, Theme)
+            .join(Video)
+            .join(Task)
+            .join(Theme)
+            .where(
                 (ReviewRequest.reviewer == self.id)
                 & (ReviewRequest.status == 1)
             )
@@ -364,20 +413,24 @@ class User(Table):
         return (
             f"<b>Рейтинг проверяющего</b>: "
             f"{(self.reviewer_rating * 100):5.2f}%\n"
-            f"- качество проверки: "
-            f"{(self.get_reviewer_rating_from_score() * 100):5.2f}%\n"
-            f"- скорость проверки: "
-            f"{(self.get_reviewer_rating_from_duration() * 100):5.2f}%\n"
-            f"- соблюдение срока: "
-            f"{(self.get_reviewer_rating_from_over() * 100):5.2f}%\n"
+            f"- качество проверки: {(from_score * 100):5.2f}%\n"
+            f"- скорость проверки: {(from_duration * 100):5.2f}%\n"
+            f"- соблюдение срока: {(from_over * 100):5.2f}%\n"
             f"\n<b>Баллы проверяющего</b>: {self.reviewer_score:.2f}\n"
             f"{report}\n"
         )
 
-    def get_report(self):
+    def get_report(
+        self,
+        bloger_ratings: Tuple[float, float, float] = None,
+        reviewer_ratings: Tuple[float, float, float] = None,
+    ):
         """Получить отчет по пользователю"""
 
-        return f"{self.get_bloger_report()}\n{self.get_reviewer_report()}"
+        return (
+            f"{self.get_bloger_report(bloger_ratings)}\n"
+            f"{self.get_reviewer_report(reviewer_ratings)}"
+        )
 
 
 class Role(Table):
@@ -392,6 +445,11 @@ class UserRole(Table):
     user = ForeignKeyField(User, backref="user_roles", **CASCADE)
     role = ForeignKeyField(Role, **CASCADE)
 
+    class Meta:
+        """Индексы таблицы"""
+
+        indexes = ((("user", "role"), True),)
+
 
 class Tag(Table):
     """Теги"""
@@ -446,6 +504,16 @@ class Task(Table):
     # 1 - кнопка о продлении отправлена
     extension = IntegerField(default=0)
 
+    class Meta:
+        """Индексы таблицы"""
+
+        indexes = ((("status", "implementer"), False),)
+
+    def get_reserve_time(self) -> timedelta:
+        """Запас времени до срока: за него блогеру предлагается продлить
+        задачу, на него же срок и продлевается"""
+        return timedelta(hours=max(int(self.theme.complexity * 72 / 2), 24))
+
     @staticmethod
     def get_count_overs():
         """Получить количество просрочек для блогеров"""
@@ -475,40 +543,54 @@ class Task(Table):
         return Table.get_minmax(Task.get_count_overs())
 
     @staticmethod
-    def get_avg_duration():
-        """Получить среднюю относительную (сложности темы) продолжительность
-        выполнения задачи для каждого блогера"""
-        return {
-            row["bloger"]: (row["avg_hours"] if row["avg_hours"] else 0)
-            for row in Task.select(
-                fn.AVG(
-                    Case(
-                        None,
-                        [
-                            (
-                                Task.status == 0,
-                                (
-                                    fn.julianday(datetime.now())
-                                    - fn.julianday(Task.at_created)
-                                )
-                                * 24,
-                            )
-                        ],
+    def select_duration():
+        """Выражение относительной (сложности темы) продолжительности
+        выполнения задачи в часах для строки задачи с видео.
+        Для выданной задачи считается до текущего момента"""
+        return (
+            Case(
+                None,
+                [
+                    (
+                        Task.status == 0,
                         (
-                            fn.julianday(Video.at_created)
+                            fn.julianday(datetime.now())
                             - fn.julianday(Task.at_created)
                         )
                         * 24,
                     )
-                    / Theme.complexity
-                ).alias("avg_hours"),
+                ],
+                (
+                    fn.julianday(Video.at_created)
+                    - fn.julianday(Task.at_created)
+                )
+                * 24,
+            )
+            / Theme.complexity
+        )
+
+    @staticmethod
+    def select_avg_duration():
+        """Запрос средней относительной (сложности темы) продолжительности
+        выполнения задачи для каждого блогера"""
+        return (
+            Task.select(
+                fn.AVG(Task.select_duration()).alias("avg_hours"),
                 Task.implementer.alias("bloger"),
             )
             .join(Theme)
             .join(Video, JOIN.LEFT_OUTER, on=Video.task == Task.id)
             .where(Task.status != -1)
             .group_by(Task.implementer)
-            .dicts()
+        )
+
+    @staticmethod
+    def get_avg_duration():
+        """Получить среднюю относительную (сложности темы) продолжительность
+        выполнения задачи для каждого блогера"""
+        return {
+            row["bloger"]: (row["avg_hours"] if row["avg_hours"] else 0)
+            for row in Task.select_avg_duration().dicts()
         }
 
     @staticmethod
@@ -557,6 +639,14 @@ class ReviewRequest(Table):
     at_created = DateTimeField(default=datetime.now)
     due_date = DateTimeField()
 
+    class Meta:
+        """Индексы таблицы"""
+
+        indexes = (
+            (("reviewer", "status"), False),
+            (("status", "due_date"), False),
+        )
+
     @staticmethod
     def get_count_overs():
         """Получить список просрочек каждого проверяющего"""
@@ -590,6 +680,41 @@ class ReviewRequest(Table):
         просроченных запросов"""
         return Table.get_minmax(data=ReviewRequest.get_count_overs())
 
+    @staticmethod
+    def select_review_times(limit_dt: datetime):
+        """Проверенные запросы, созданные после limit_dt: проверяющий,
+        время отзыва (r_h) и запроса (rr_h) в юлианских днях"""
+        return (
+            ReviewRequest.select(
+                ReviewRequest.reviewer.alias("reviewer"),
+                fn.julianday(Review.at_created).alias("r_h"),
+                fn.julianday(ReviewRequest.at_created).alias("rr_h"),
+            )
+            .join(Review)
+            .where(
+                (ReviewRequest.status == 1)
+                & (ReviewRequest.at_created > limit_dt)
+            )
+            .dicts()
+        )
+
+    @staticmethod
+    def select_with_task():
+        """Запросы на проверку вместе с проверяющим, видео, задачей,
+        темой, курсом и блогером одним запросом"""
+        implementer = User.alias()
+        return (
+            ReviewRequest.select(
+                ReviewRequest, User, Video, Task, Theme, Course, implementer
+            )
+            .join_from(ReviewRequest, User, on=ReviewRequest.reviewer)
+            .join_from(ReviewRequest, Video)
+            .join_from(Video, Task)
+            .join_from(Task, Theme)
+            .join_from(Theme, Course)
+            .join_from(Task, implementer, on=Task.implementer)
+        )
+
     @staticmethod
     def get_minmax_review_duration():
         """Получить минимальное и максимальное время проверки видео в часах"""
@@ -687,7 +812,7 @@ class Poll(Table):
     """Хранит данные опроса"""
 
     message_id = IntegerField()
-    poll_id = CharField()
+    poll_id = CharField(unique=True)
     result = CharField()
     is_stop = BooleanField(default=False)
     at_created = DateTimeField(default=datetime.now)
@@ -701,29 +826,55 @@ class Var(Table):
     value = CharField(null=True)
 
 
-if __name__ == "__main__":
-    db.create_tables(
-        [
-            User,
-            Role,
-            UserRole,
-            Course,
-            Theme,
-            Task,
-            Video,
-            ReviewRequest,
-            Review,
-            UserCourse,
-            Poll,
-            Var,
-            Tag,
-            CourseTag,
-        ]
-    )
+class OutboxMessage(Table):
+    """Исходящее сообщение в очереди отправки, см. outbox.py.
+    Отправленные сообщения удаляются, у неотправленных status=-1"""
+
+    chat_id = IntegerField()
+    # Метод бота: send_message, send_video или send_poll
+    method = CharField()
+    # Параметры метода в JSON
+    payload = TextField()
+    status = IntegerField(default=0)
+    attempts = IntegerField(default=0)
+    next_attempt_at = DateTimeField(default=datetime.now)
+    error = TextField(null=True)
+    at_created = DateTimeField(default=datetime.now)
+
+    class Meta:
+        """Индексы таблицы"""
+
+        indexes = ((("status",), False),)
 
-    users: List[User] = list(User.select())
-    for user in users:
-        user.update_bloger_score()
-        user.update_bloger_rating()
-        user.update_reviewer_score()
-        user.update_reviewer_rating()
+
+class SchemaVersion(Table):
+    """Применённые миграции схемы БД"""
+
+    version = IntegerField(unique=True)
+    name = CharField()
+    at_applied = DateTimeField(default=datetime.now)
+
+
+MODELS = [
+    User,
+    Role,
+    UserRole,
+    Course,
+    Theme,
+    Task,
+    Video,
+    ReviewRequest,
+    Review,
+    UserCourse,
+    Poll,
+    Var,
+    Tag,
+    CourseTag,
+    OutboxMessage,
+    SchemaVersion,
+]
+
+
+if __name__ == "__main__":
+    # Пересчёт баллов и рейтингов: python rating.py
+    db.create_tables(MODELS)
@@ -0,0 +1,107 @@
+"""Ограничение частоты отправки сообщений"""
+
+import asyncio
+import os
+import time
+from typing import Callable, Dict
+
+from dotenv import load_dotenv
+
+# Загрузка переменных из .env
+load_dotenv()
+# Сообщений в секунду на бота и на один чат, ограничения Telegram
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "30"))
+NOTIFY_CHAT_RATE = float(os.getenv("NOTIFY_CHAT_RATE", "1"))
+
+
+# pylint: disable-next=too-many-instance-attributes
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, запас capacity.
+    Ожидающие получают токены по очереди, в порядке вызова acquire"""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._paused_until = 0.0
+        # Создаётся в работающем цикле событий: на Python 3.8 Lock
+        # привязывается к циклу при создании, а Notifier создаётся
+        # при импорте, до asyncio.run
+        self._lock: asyncio.Lock = None
+        self._lock_loop: asyncio.AbstractEventLoop = None
+
+    def _refill(self, now: float):
+        """Начисляет токены за прошедшее время"""
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def pause(self, seconds: float):
+        """Не выдаёт токены ближайшие seconds секунд"""
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def _get_lock(self) -> asyncio.Lock:
+        """Блокировка очереди ожидающих в текущем цикле событий"""
+        loop = asyncio.get_running_loop()
+        if self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    async def acquire(self):
+        """Ждёт и забирает один токен"""
+        async with self._get_lock():
+            while True:
+                now = self._clock()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Notifier:
+    """Ограничители частоты отправки: общий для бота и по одному
+    на каждый чат. RetryAfter от Telegram приостанавливает все отправки
+    на указанное время, см. pause"""
+
+    def __init__(
+        self,
+        global_rate: float = NOTIFY_GLOBAL_RATE,
+        chat_rate: float = NOTIFY_CHAT_RATE,
+    ):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        """Ограничитель чата"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(
+                self.chat_rate, capacity=1
+            )
+        return bucket
+
+    async def acquire(self, chat_id: int):
+        """Ждёт, пока можно отправить сообщение в чат"""
+        await self._get_chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    def pause(self, seconds: float):
+        """Приостанавливает все отправки, ответ RetryAfter"""
+        self.global_bucket.pause(seconds)
+
+
+notifier = Notifier()
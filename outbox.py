@@ -0,0 +1,325 @@
+"""Очередь исходящих сообщений в БД.
+
+Обработчики ставят сообщения в таблицу OutboxMessage и сразу
+возвращают управление, а пул асинхронных обработчиков отправляет их
+с учётом ограничений notifier:
+- сообщения одного чата уходят строго по порядку постановки;
+- на RetryAfter отправки приостанавливаются на указанное время;
+- временные ошибки повторяются с экспоненциальной задержкой;
+- строка удаляется только после отправки, поэтому после перезапуска
+  неотправленные сообщения отправляются снова.
+"""
+
+import asyncio
+import json
+import os
+import traceback
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Iterable, List, Set
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import InlineKeyboardMarkup
+from dotenv import load_dotenv
+
+from executor import run_db
+from models import OutboxMessage, db
+from notifier import Notifier, notifier
+
+# pylint: disable=no-member
+
+# Загрузка переменных из .env
+load_dotenv()
+# Число одновременно обслуживаемых чатов
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+# Попыток отправки при временных ошибках, затем сообщение отбрасывается
+OUTBOX_ATTEMPTS = int(os.getenv("OUTBOX_ATTEMPTS", "8"))
+# Задержка первого повтора и предел задержки, секунд
+OUTBOX_BACKOFF = float(os.getenv("OUTBOX_BACKOFF", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+# Период проверки очереди, секунд: повторы после задержки
+OUTBOX_POLL = float(os.getenv("OUTBOX_POLL", "5"))
+
+METHODS = ("send_message", "send_video", "send_poll")
+# Ошибки, после которых отправку стоит повторить позже
+TRANSIENT_ERRORS = (
+    TelegramNetworkError,
+    TelegramServerError,
+    asyncio.TimeoutError,
+)
+
+
+def encode_payload(kwargs: Dict) -> str:
+    """Параметры метода бота в JSON. Из клавиатур поддерживается
+    только InlineKeyboardMarkup"""
+    data = {key: value for key, value in kwargs.items() if value is not None}
+    if "reply_markup" in data:
+        data["reply_markup"] = data["reply_markup"].model_dump(
+            exclude_none=True
+        )
+    return json.dumps(data, ensure_ascii=False)
+
+
+def decode_payload(payload: str) -> Dict:
+    """Параметры метода бота из JSON"""
+    data = json.loads(payload)
+    if "reply_markup" in data:
+        data["reply_markup"] = InlineKeyboardMarkup.model_validate(
+            data["reply_markup"]
+        )
+    return data
+
+
+def get_backoff(attempts: int) -> float:
+    """Задержка перед повтором после attempts неудачных попыток"""
+    return min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF * 2 ** (attempts - 1))
+
+
+# pylint: disable-next=too-many-instance-attributes
+class Outbox:
+    """Очередь исходящих сообщений и её обработчики.
+
+    Диспетчер выбирает из БД ожидающие сообщения и раскладывает их
+    по очередям чатов. Очередь чата обслуживает один обработчик за раз,
+    поэтому порядок сообщений в чате сохраняется, а разные чаты
+    отправляются параллельно"""
+
+    def __init__(
+        self,
+        workers: int = OUTBOX_WORKERS,
+        attempts: int = OUTBOX_ATTEMPTS,
+        poll_interval: float = OUTBOX_POLL,
+        limiter: Notifier = notifier,
+    ):
+        self.workers = workers
+        self.attempts = attempts
+        self.poll_interval = poll_interval
+        self.limiter = limiter
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        # Сообщения, выбранные из БД, по чатам
+        self._chats: Dict[int, Deque[OutboxMessage]] = {}
+        self._claimed: Set[int] = set()
+        # Сообщения, отправленные или отброшенные с начала выборки:
+        # в выборке они могут ещё числиться ожидающими
+        self._finished: Set[int] = set()
+        # Чаты, ожидающие повтора после временной ошибки
+        self._blocked: Dict[int, datetime] = {}
+        self._ready: asyncio.Queue = None
+        self._wakeup: asyncio.Event = None
+        self._loop: asyncio.AbstractEventLoop = None
+        self._tasks: List[asyncio.Task] = []
+
+    def put(self, method: str, chat_ids: Iterable[int], **kwargs) -> int:
+        """Ставит сообщение в очередь каждому чату одной транзакцией.
+        Может вызываться из любого потока. Возвращает число сообщений"""
+        if method not in METHODS:
+            raise ValueError(f"Неизвестный метод отправки: {method}")
+        payload = encode_payload(kwargs)
+        now = datetime.now()
+        rows = [
+            {
+                "chat_id": chat_id,
+                "method": method,
+                "payload": payload,
+                "next_attempt_at": now,
+                "at_created": now,
+            }
+            for chat_id in chat_ids
+        ]
+        if rows:
+            with db.atomic():
+                query = OutboxMessage.insert_many(rows)
+                query.execute()  # pylint: disable=no-value-for-parameter
+            self._wake()
+        return len(rows)
+
+    async def send(self, method: str, chat_id: int, **kwargs):
+        """Ставит вызов метода бота в очередь. Параметры как у метода"""
+        await run_db(self.put, method, [chat_id], **kwargs)
+
+    async def send_many(self, method: str, chat_ids: Iterable[int], **kwargs):
+        """Ставит один вызов метода бота в очередь нескольким чатам"""
+        await run_db(self.put, method, list(chat_ids), **kwargs)
+
+    def _wake(self):
+        """Будит диспетчер после постановки сообщений"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def start(self, bot: Bot):
+        """Запускает диспетчер и обработчики в текущем цикле событий.
+        Первая выборка забирает сообщения, оставшиеся с прошлого запуска"""
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._tasks = [asyncio.create_task(self._dispatch())]
+        self._tasks += [
+            asyncio.create_task(self._work(bot)) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Останавливает обработчики. Неотправленные сообщения остаются
+        в БД и будут отправлены при следующем запуске"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        self._chats.clear()
+        self._claimed.clear()
+        self._finished.clear()
+        self._blocked.clear()
+
+    def get_pending_count(self) -> int:
+        """Число сообщений, ожидающих отправки"""
+        return OutboxMessage.select().where(OutboxMessage.status == 0).count()
+
+    @staticmethod
+    def _load_pending() -> List[OutboxMessage]:
+        """Ожидающие сообщения в порядке постановки"""
+        return list(
+            OutboxMessage.select()
+            .where(OutboxMessage.status == 0)
+            .order_by(OutboxMessage.id)
+        )
+
+    async def _dispatch(self):
+        """Раскладывает ожидающие сообщения по очередям чатов"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._finished.clear()
+            try:
+                self._schedule(await run_db(self._load_pending))
+            except Exception:  # pylint: disable=broad-exception-caught
+                traceback.print_exc()
+
+    def _schedule(self, rows: List[OutboxMessage]):
+        """Добавляет новые сообщения в очереди чатов. Чат, первое
+        сообщение которого ждёт повтора, пропускается целиком.
+        Сообщения, завершённые во время выборки, пропускаются"""
+        now = datetime.now()
+        for chat_id, until in list(self._blocked.items()):
+            if until <= now:
+                del self._blocked[chat_id]
+        blocked = set(self._blocked)
+        for row in rows:
+            if row.chat_id in blocked or row.id in self._claimed:
+                continue
+            if row.id in self._finished:
+                continue
+            if row.next_attempt_at > now:
+                blocked.add(row.chat_id)
+                continue
+            self._claimed.add(row.id)
+            if row.chat_id not in self._chats:
+                self._chats[row.chat_id] = deque()
+                self._ready.put_nowait(row.chat_id)
+            self._chats[row.chat_id].append(row)
+
+    async def _work(self, bot: Bot):
+        """Отправляет по одному сообщению из очередей чатов. Чат с
+        оставшимися сообщениями встаёт в конец, чтобы обработчик не ждал,
+        пока ограничитель этого чата накопит токен"""
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._chats[chat_id]
+            row = queue[0]
+            try:
+                done = await self._deliver(bot, row)
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                done = await self._retry_on_error(row, ex)
+            if done:
+                queue.popleft()
+                self._claimed.discard(row.id)
+                self._finished.add(row.id)
+            if done and queue:
+                self._ready.put_nowait(chat_id)
+                continue
+            # Оставшиеся сообщения диспетчер выберет снова
+            for row in queue:
+                self._claimed.discard(row.id)
+            del self._chats[chat_id]
+
+    async def _deliver(self, bot: Bot, row: OutboxMessage) -> bool:
+        """Отправляет сообщение. Возвращает False, если отправка
+        отложена и остальные сообщения чата должны подождать"""
+        kwargs = decode_payload(row.payload)
+        method = getattr(bot, row.method)
+        while True:
+            await self.limiter.acquire(row.chat_id)
+            try:
+                await method(chat_id=row.chat_id, **kwargs)
+            except TelegramRetryAfter as ex:
+                self.limiter.pause(ex.retry_after)
+                continue
+            except TRANSIENT_ERRORS as ex:
+                return await self._retry_later(row, ex)
+            except TelegramBadRequest as ex:
+                if "parse_mode" not in kwargs:
+                    await self._fail(row, ex)
+                    return True
+                # Telegram не принял HTML, отправляем без разметки
+                print(row.chat_id, ex)
+                kwargs.pop("parse_mode")
+                kwargs.pop("disable_web_page_preview", None)
+                continue
+            except TelegramAPIError as ex:
+                await self._fail(row, ex)
+                return True
+            await run_db(row.delete_instance)
+            self.sent += 1
+            return True
+
+    async def _retry_on_error(self, row: OutboxMessage, ex: Exception) -> bool:
+        """Непредвиденная ошибка считается неудачной попыткой, как
+        временная ошибка Telegram"""
+        traceback.print_exc()
+        try:
+            return await self._retry_later(row, ex)
+        except Exception:  # pylint: disable=broad-exception-caught
+            traceback.print_exc()
+        # Попытку не удалось сохранить: чат ждёт следующей проверки
+        self._blocked[row.chat_id] = datetime.now() + timedelta(
+            seconds=self.poll_interval
+        )
+        return False
+
+    async def _retry_later(self, row: OutboxMessage, ex: Exception) -> bool:
+        """Откладывает сообщение с экспоненциальной задержкой"""
+        row.attempts += 1
+        if row.attempts >= self.attempts:
+            await self._fail(row, ex)
+            return True
+        row.next_attempt_at = datetime.now() + timedelta(
+            seconds=get_backoff(row.attempts)
+        )
+        row.error = repr(ex)
+        self._blocked[row.chat_id] = row.next_attempt_at
+        await run_db(row.save)
+        self.retried += 1
+        return False
+
+    async def _fail(self, row: OutboxMessage, ex: Exception):
+        """Помечает сообщение неотправляемым"""
+        print(row.chat_id, row.method, ex)
+        row.status = -1
+        row.error = repr(ex)
+        await run_db(row.save)
+        self.failed += 1
+
+
+outbox = Outbox()
@@ -0,0 +1,541 @@
+"""Пакетный расчёт рейтингов и баллов блогеров и проверяющих.
+
+Запуск: python rating.py — пересчитать баллы и рейтинги всех пользователей
+Вид расчёта задаётся переменной .env RATING_BACKEND: python или numpy
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from peewee import JOIN, fn
+
+from models import (
+    Review,
+    ReviewRequest,
+    Table,
+    Task,
+    Theme,
+    User,
+    Video,
+    db,
+)
+
+try:
+    import numpy as np
+except ImportError:  # NumPy нужен только для RATING_BACKEND=numpy
+    np = None
+
+# pylint: disable=no-member
+
+RATING_BACKEND = os.getenv("RATING_BACKEND", "python")
+
+
+def average_padded(data: List[float]) -> float:
+    """Среднее, где недостающие до трёх значения считаются единицами,
+    как в User.get_reviewer_rating_from_*"""
+    return average_padded_sum(sum(data), len(data))
+
+
+def average_padded_sum(total: float, count: int) -> float:
+    """average_padded по готовым сумме и количеству значений"""
+    return (total + max(0, 3 - count)) / max(3, count)
+
+
+class RatingEngine:  # pylint: disable=too-many-instance-attributes
+    """Считает рейтинги всех пользователей по одному снимку агрегатов.
+
+    Методы User.get_*_rating_from_* на каждого пользователя заново
+    пересчитывают общие минимумы и максимумы. Здесь они загружаются
+    один раз, значения пользователей берутся из сгруппированных запросов,
+    а результат записывается одним пакетным обновлением.
+    """
+
+    def __init__(self):
+        self.limit_dt = datetime.today() - timedelta(days=30)
+
+        # Блогеры: значения по пользователям и минимакс по всем
+        self.task_scores: Dict[int, float] = {}
+        self.task_overs: Dict[int, int] = {}
+        self.task_durations: Dict[int, float] = {}
+        self.minmax_task_score = (0, 0)
+        self.minmax_task_over = (0, 0)
+        self.minmax_task_duration = (0, 0)
+
+        # Проверяющие
+        self.review_deviations: Dict[int, List[float]] = {}
+        self.review_overs: Dict[int, int] = {}
+        self.review_durations: Dict[int, List[float]] = {}
+        self.minmax_review_score = (0, 0)
+        self.minmax_review_over = (0, 0)
+        self.minmax_review_duration = (0, 0)
+
+        # Баллы
+        self.bloger_scores: Dict[int, float] = {}
+        self.reviewer_scores: Dict[int, float] = {}
+
+    def load(self) -> "RatingEngine":
+        """Загружает все агрегаты"""
+        return self.load_bloger().load_reviewer().load_scores()
+
+    def load_bloger(self) -> "RatingEngine":
+        """Загружает агрегаты для рейтинга блогеров"""
+        self.task_scores = Task.get_avg_scores()
+        self.minmax_task_score = Table.get_minmax(self.task_scores)
+
+        self.task_overs = Task.get_count_overs()
+        self.minmax_task_over = Table.get_minmax(self.task_overs)
+
+        self.task_durations = {
+            row["bloger"]: row["avg_hours"]
+            for row in Task.select_avg_duration().dicts()
+        }
+        self.minmax_task_duration = Table.get_minmax(
+            {k: v if v else 0 for k, v in self.task_durations.items()}
+        )
+        return self
+
+    def load_reviewer(self) -> "RatingEngine":
+        """Загружает агрегаты для рейтинга проверяющих"""
+        self.minmax_review_score = Review.get_minmax_score()
+        best_scores = Review.get_best_scores()
+        self.review_deviations = {}
+        for row in (
+            Review.select(
+                ReviewRequest.reviewer.alias("reviewer"),
+                ReviewRequest.video.alias("video"),
+                Review.score,
+            )
+            .join(ReviewRequest)
+            .where(ReviewRequest.at_created > self.limit_dt)
+            .dicts()
+        ):
+            best_score = best_scores.get(row["video"], row["score"])
+            self.review_deviations.setdefault(row["reviewer"], []).append(
+                abs(best_score - row["score"])
+            )
+
+        self.minmax_review_over = ReviewRequest.get_minmax_over()
+        self.review_overs = {
+            row["reviewer"]: row["count"]
+            for row in ReviewRequest.select(
+                ReviewRequest.reviewer.alias("reviewer"),
+                fn.COUNT(ReviewRequest.id).alias("count"),
+            )
+            .where(
+                (ReviewRequest.status == -1)
+                & (ReviewRequest.at_created > self.limit_dt)
+            )
+            .group_by(ReviewRequest.reviewer)
+            .dicts()
+        }
+
+        self.minmax_review_duration = (
+            ReviewRequest.get_minmax_review_duration()
+        )
+        self.review_durations = {}
+        for row in ReviewRequest.select_review_times(self.limit_dt):
+            self.review_durations.setdefault(row["reviewer"], []).append(
+                (row["r_h"] - row["rr_h"]) * 24
+            )
+        return self
+
+    def load_scores(self) -> "RatingEngine":
+        """Загружает данные для баллов блогеров и проверяющих"""
+        return self.load_bloger_scores().load_reviewer_scores()
+
+    def load_bloger_scores(self) -> "RatingEngine":
+        """Загружает данные для баллов блогеров"""
+        self.bloger_scores = {}
+        ranks: Dict[int, int] = {}
+        for row in (
+            Task.select(
+                Task.implementer.alias("bloger"),
+                Task.score,
+                Theme.complexity,
+            )
+            .join(Theme)
+            .where(Task.status.in_([2, 3]))
+            .order_by(Task.id)
+            .dicts()
+        ):
+            i = ranks.get(row["bloger"], 0)
+            ranks[row["bloger"]] = i + 1
+            self.bloger_scores[row["bloger"]] = (
+                self.bloger_scores.get(row["bloger"], 0)
+                + row["score"] * 1.05**i * row["complexity"]
+            )
+        return self
+
+    def load_reviewer_scores(self) -> "RatingEngine":
+        """Загружает данные для баллов проверяющих"""
+
+        self.reviewer_scores = {
+            row["reviewer"]: (row["duration"] or 0) / 1200
+            for row in ReviewRequest.select(
+                ReviewRequest.reviewer.alias("reviewer"),
+                fn.SUM(Video.duration).alias("duration"),
+            )
+            .join(Video)
+            .where(ReviewRequest.status == 1)
+            .group_by(ReviewRequest.reviewer)
+            .dicts()
+        }
+        return self
+
+    def get_bloger_ratings(self, user_id: int) -> Tuple[float, float, float]:
+        """Рейтинги блогера по оценкам, просрочкам и продолжительности"""
+        min_score, max_score = self.minmax_task_score
+        delta = max_score - min_score
+        score = self.task_scores.get(user_id)
+        from_scores = (
+            0.7
+            if score is None or delta == 0
+            else ((score - min_score) / delta)
+        )
+
+        min_over, max_over = self.minmax_task_over
+        delta = max_over - min_over
+        over = self.task_overs.get(user_id, 0)
+        from_over = (
+            1 if over == 0 or delta == 0 else ((max_over - over) / delta)
+        )
+
+        min_duration, max_duration = self.minmax_task_duration
+        delta = max_duration - min_duration
+        duration = self.task_durations.get(user_id)
+        from_duration = (
+            0.7
+            if duration is None or delta == 0
+            else ((max_duration - duration) / delta)
+        )
+
+        return from_scores, from_over, from_duration
+
+    def get_reviewer_ratings(self, user_id: int) -> Tuple[float, float, float]:
+        """Рейтинги проверяющего по оценкам, просрочкам и продолжительности.
+        При нулевом разбросе отклонений или длительностей каждое значение
+        считается единицей, вместо деления на ноль"""
+        min_score, max_score = self.minmax_review_score
+        delta = max_score - min_score
+        from_score = average_padded(
+            [
+                1 if delta == 0 else (max_score - deviation) / delta
+                for deviation in self.review_deviations.get(user_id, [])
+            ]
+        )
+
+        min_over, max_over = self.minmax_review_over
+        delta = max_over - min_over
+        over = self.review_overs.get(user_id, 0)
+        from_over = 1 if delta == 0 else (max_over - over) / delta
+
+        min_dur, max_dur = self.minmax_review_duration
+        delta = max_dur - min_dur
+        from_duration = average_padded(
+            [
+                1 if delta == 0 else (max_dur - hours) / delta
+                for hours in self.review_durations.get(user_id, [])
+            ]
+        )
+
+        return from_score, from_over, from_duration
+
+    @staticmethod
+    def select_users(user_ids: Iterable[int] = None) -> List[User]:
+        """Пользователи для обновления"""
+        query = User.select()
+        if user_ids is not None:
+            query = query.where(User.id.in_(list(user_ids)))
+        return list(query)
+
+    @staticmethod
+    def save(users: List[User], fields: list):
+        """Записывает поля пользователей пакетным обновлением"""
+        with db.atomic():
+            User.bulk_update(users, fields=fields, batch_size=500)
+
+    def update_bloger_ratings(self, user_ids: Iterable[int] = None):
+        """Обновляет рейтинг блогеров, по умолчанию всех пользователей"""
+        users = self.select_users(user_ids)
+        for user in users:
+            ratings = self.get_bloger_ratings(user.id)
+            user.bloger_rating = sum(ratings) / len(ratings)
+        self.save(users, [User.bloger_rating])
+        return users
+
+    def update_reviewer_ratings(self, user_ids: Iterable[int] = None):
+        """Обновляет рейтинг проверяющих, по умолчанию всех пользователей"""
+        users = self.select_users(user_ids)
+        for user in users:
+            ratings = self.get_reviewer_ratings(user.id)
+            user.reviewer_rating = sum(ratings) / len(ratings)
+        self.save(users, [User.reviewer_rating])
+        return users
+
+    def update_all(self, user_ids: Iterable[int] = None):
+        """Обновляет баллы и рейтинги, по умолчанию всех пользователей.
+        Баллы блогера, как и в User.update_bloger_score, не уменьшаются"""
+        users = self.select_users(user_ids)
+        for user in users:
+            user.bloger_score = max(
+                user.bloger_score, self.bloger_scores.get(user.id, 0)
+            )
+            user.reviewer_score = self.reviewer_scores.get(user.id, 0)
+            ratings = self.get_bloger_ratings(user.id)
+            user.bloger_rating = sum(ratings) / len(ratings)
+            ratings = self.get_reviewer_ratings(user.id)
+            user.reviewer_rating = sum(ratings) / len(ratings)
+        self.save(
+            users,
+            [
+                User.bloger_score,
+                User.reviewer_score,
+                User.bloger_rating,
+                User.reviewer_rating,
+            ],
+        )
+        return users
+
+
+def _to_array(query, columns: int) -> "np.ndarray":
+    """Строки запроса в массив float, NULL становится NaN"""
+    return np.array(
+        [
+            [np.nan if value is None else value for value in row]
+            for row in query.tuples()
+        ],
+        dtype=float,
+    ).reshape(-1, columns)
+
+
+def _minmax(values: "np.ndarray") -> Tuple[float, float]:
+    """Минимум и максимум массива, (0, 0) для пустого"""
+    if len(values) == 0:
+        return 0, 0
+    return values.min(), values.max()
+
+
+# pylint: disable-next=too-many-instance-attributes
+class NumpyRatingEngine(RatingEngine):
+    """RatingEngine, считающий рейтинги и баллы всех пользователей
+    векторно: столбцы загружаются массивами, суммы и количества по
+    пользователям и видео считаются группировкой через bincount.
+
+    Рейтинги хранятся матрицами, где строка — ID пользователя.
+    Последняя строка не принадлежит ни одному пользователю на момент
+    загрузки и даёт рейтинги пользователя без истории.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise ImportError("Для RATING_BACKEND=numpy нужен пакет numpy")
+        super().__init__()
+        max_id = User.select(  # pylint: disable=no-value-for-parameter
+            fn.MAX(User.id)
+        ).scalar()
+        self.size = (max_id or 0) + 2
+        self.bloger_matrix = np.zeros((self.size, 3))
+        self.reviewer_matrix = np.zeros((self.size, 3))
+
+    def _count(self, index: "np.ndarray", weights=None) -> "np.ndarray":
+        """Количество или сумма весов по ID пользователей"""
+        return np.bincount(index, weights=weights, minlength=self.size)
+
+    def _padded(self, index, values, low, high) -> "np.ndarray":
+        """average_padded значений (high - value) / (high - low)
+        по пользователям, при нулевом разбросе каждое значение равно 1"""
+        count = self._count(index)
+        total = (
+            count
+            if high == low
+            else self._count(index, (high - values) / (high - low))
+        )
+        return (total + np.maximum(0, 3 - count)) / np.maximum(3, count)
+
+    def load_bloger(self) -> "NumpyRatingEngine":
+        tasks = _to_array(
+            Task.select(Task.implementer, Task.status, Task.score), 3
+        )
+        self.bloger_matrix = np.column_stack(
+            (
+                self._get_task_score_ratings(tasks),
+                self._get_task_over_ratings(tasks),
+                self._get_task_duration_ratings(),
+            )
+        )
+        return self
+
+    def _get_task_score_ratings(self, tasks) -> "np.ndarray":
+        """Рейтинги по средней оценке задач не в статусах 0 и 1"""
+        bloger = tasks[:, 0].astype(int)
+        done = (tasks[:, 1] != 0) & (tasks[:, 1] != 1)
+        count = self._count(bloger[done])
+        has = count > 0
+        avg = np.divide(
+            self._count(bloger[done], tasks[done, 2]),
+            count,
+            out=np.zeros(self.size),
+            where=has,
+        )
+        low, high = self.minmax_task_score = _minmax(avg[has])
+        ratings = np.full(self.size, 0.7)
+        if high != low:
+            ratings[has] = (avg[has] - low) / (high - low)
+        return ratings
+
+    def _get_task_over_ratings(self, tasks) -> "np.ndarray":
+        """Рейтинги по отказам среди всех пользователей с задачами"""
+        bloger = tasks[:, 0].astype(int)
+        overs = self._count(bloger[tasks[:, 1] == -1])
+        low, high = self.minmax_task_over = _minmax(
+            overs[self._count(bloger) > 0]
+        )
+        if high == low:
+            return np.ones(self.size)
+        return np.where(overs == 0, 1, (high - overs) / (high - low))
+
+    def _get_task_duration_ratings(self) -> "np.ndarray":
+        """Рейтинги по продолжительности, строки без видео (NULL)
+        не входят в среднее"""
+        rows = _to_array(
+            Task.select(Task.implementer, Task.select_duration())
+            .join(Theme)
+            .join(Video, JOIN.LEFT_OUTER, on=Video.task == Task.id)
+            .where(Task.status != -1),
+            2,
+        )
+        bloger = rows[:, 0].astype(int)
+        valid = ~np.isnan(rows[:, 1])
+        count = self._count(bloger[valid])
+        has = count > 0
+        avg = np.divide(
+            self._count(bloger[valid], rows[valid, 1]),
+            count,
+            out=np.zeros(self.size),
+            where=has,
+        )
+        low, high = self.minmax_task_duration = _minmax(
+            avg[self._count(bloger) > 0]
+        )
+        ratings = np.full(self.size, 0.7)
+        if high != low:
+            ratings[has] = (high - avg[has]) / (high - low)
+        return ratings
+
+    def load_reviewer(self) -> "NumpyRatingEngine":
+        reviews = _to_array(
+            Review.select(
+                ReviewRequest.reviewer,
+                ReviewRequest.video,
+                Review.score,
+                ReviewRequest.status,
+                (
+                    fn.julianday(Review.at_created)
+                    - fn.julianday(ReviewRequest.at_created)
+                )
+                * 24,
+            )
+            .join(ReviewRequest)
+            .where(ReviewRequest.at_created > self.limit_dt),
+            5,
+        )
+        self.reviewer_matrix = np.column_stack(
+            (
+                self._get_review_score_ratings(reviews),
+                self._get_review_over_ratings(),
+                self._get_review_duration_ratings(reviews),
+            )
+        )
+        return self
+
+    def _get_review_score_ratings(self, reviews) -> "np.ndarray":
+        """Рейтинги по отклонению оценок от лучшей оценки видео"""
+        reviewer = reviews[:, 0].astype(int)
+        score = reviews[:, 2]
+        # Лучшая (минимальная), худшая и средняя оценки каждого видео
+        videos, video = np.unique(reviews[:, 1], return_inverse=True)
+        best = np.full(len(videos), np.inf)
+        np.minimum.at(best, video, score)
+        worst = np.full(len(videos), -np.inf)
+        np.maximum.at(worst, video, score)
+        avg = np.bincount(video, weights=score) / np.bincount(video)
+        spread = np.abs(avg - best), np.abs(avg - worst)
+        low, high = self.minmax_review_score = (
+            (np.minimum(*spread).min(), np.maximum(*spread).max())
+            if len(videos)
+            else (0, 0)
+        )
+        return self._padded(reviewer, np.abs(best[video] - score), low, high)
+
+    def _get_review_over_ratings(self) -> "np.ndarray":
+        """Рейтинги по просроченным за 30 дней запросам"""
+        low, high = self.minmax_review_over = ReviewRequest.get_minmax_over()
+        if high == low:
+            return np.ones(self.size)
+        overs = self._count(
+            _to_array(
+                ReviewRequest.select(ReviewRequest.reviewer).where(
+                    (ReviewRequest.status == -1)
+                    & (ReviewRequest.at_created > self.limit_dt)
+                ),
+                1,
+            )[:, 0].astype(int)
+        )
+        return (high - overs) / (high - low)
+
+    def _get_review_duration_ratings(self, reviews) -> "np.ndarray":
+        """Рейтинги по времени от запроса до отзыва"""
+        checked = reviews[:, 3] == 1
+        low, high = self.minmax_review_duration = tuple(
+            int(value) for value in _minmax(reviews[checked, 4])
+        )
+        return self._padded(
+            reviews[checked, 0].astype(int), reviews[checked, 4], low, high
+        )
+
+    def load_bloger_scores(self) -> "NumpyRatingEngine":
+        tasks = _to_array(
+            Task.select(Task.implementer, Task.score, Theme.complexity)
+            .join(Theme)
+            .where(Task.status.in_([2, 3]))
+            .order_by(Task.id),
+            3,
+        )
+        bloger = tasks[:, 0].astype(int)
+        # Номер задачи среди задач блогера по возрастанию ID:
+        # устойчивая сортировка сохраняет порядок ID внутри блогера
+        order = np.argsort(bloger, kind="stable")
+        ordered = bloger[order]
+        rank = np.empty(len(bloger))
+        rank[order] = np.arange(len(bloger)) - np.searchsorted(
+            ordered, ordered
+        )
+        totals = self._count(bloger, tasks[:, 1] * 1.05**rank * tasks[:, 2])
+        self.bloger_scores = {
+            int(user_id): float(totals[user_id])
+            for user_id in np.unique(bloger)
+        }
+        return self
+
+    def get_bloger_ratings(self, user_id: int) -> Tuple[float, float, float]:
+        row = self.bloger_matrix[min(user_id, self.size - 1)]
+        return tuple(float(value) for value in row)
+
+    def get_reviewer_ratings(self, user_id: int) -> Tuple[float, float, float]:
+        row = self.reviewer_matrix[min(user_id, self.size - 1)]
+        return tuple(float(value) for value in row)
+
+
+def create_rating_engine(backend: str = None) -> RatingEngine:
+    """Создаёт движок рейтингов, по умолчанию из RATING_BACKEND"""
+    backend = backend or RATING_BACKEND
+    if backend == "python":
+        return RatingEngine()
+    if backend == "numpy":
+        return NumpyRatingEngine()
+    raise ValueError(f"Неизвестный RATING_BACKEND {backend}")
+
+
+if __name__ == "__main__":
+    create_rating_engine().load().update_all()
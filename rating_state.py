@@ -0,0 +1,744 @@
+"""Инкрементальные агрегаты рейтингов блогеров и проверяющих.
+
+Запуск: python rating_state.py — сравнить агрегаты, загруженные из БД,
+с полным пересчётом RatingEngine
+"""
+
+import heapq
+import threading
+from datetime import datetime, time, timedelta
+from typing import Dict, Hashable, Iterable, List, Tuple, Union
+
+from peewee import fn
+
+from models import Review, ReviewRequest, Task, Theme, User, Video
+from rating import RatingEngine, average_padded_sum, create_rating_engine
+
+# pylint: disable=no-member
+
+
+def julianday(value: datetime) -> float:
+    """Юлианская дата, как julianday() в SQLite: с округлением до
+    миллисекунд, чтобы часы совпадали и при отбрасывании дробной части"""
+    delta = value - datetime(1970, 1, 1)
+    ms = (
+        delta.days * 86400000
+        + delta.seconds * 1000
+        + (delta.microseconds + 500) // 1000
+    )
+    # 2440587.5 суток до 1970-01-01 в миллисекундах
+    return (210866760000000 + ms) / 86400000.0
+
+
+def _sum_from_max(count: int, total: float, low: float, high: float):
+    """Сумма (high - value) / (high - low) по значениям с количеством
+    count и суммой total. При нулевом разбросе каждое значение равно 1"""
+    delta = high - low
+    return count if delta == 0 else (count * high - total) / delta
+
+
+class MinMaxTracker:
+    """Минимум и максимум значений по ключам.
+
+    Две кучи с ленивым удалением: изменение значения стоит O(log n),
+    устаревшие записи отбрасываются при чтении вершины.
+    """
+
+    def __init__(self):
+        self.values: Dict[Hashable, float] = {}
+        self._low: List[Tuple[float, Hashable]] = []
+        self._high: List[Tuple[float, Hashable]] = []
+
+    def set(self, key: Hashable, value: float):
+        """Задаёт значение ключа"""
+        if key in self.values and self.values[key] == value:
+            return
+        self.values[key] = value
+        heapq.heappush(self._low, (value, key))
+        heapq.heappush(self._high, (-value, key))
+        if len(self._low) > 2 * len(self.values) + 64:
+            self._rebuild()
+
+    def discard(self, key: Hashable):
+        """Убирает ключ"""
+        self.values.pop(key, None)
+
+    def _rebuild(self):
+        """Избавляется от устаревших записей куч"""
+        self._low = [(value, key) for key, value in self.values.items()]
+        self._high = [(-value, key) for key, value in self.values.items()]
+        heapq.heapify(self._low)
+        heapq.heapify(self._high)
+
+    def _top(self, heap: list, sign: int) -> Union[float, None]:
+        """Вершина кучи без устаревших записей"""
+        while heap:
+            value, key = heap[0]
+            if key in self.values and self.values[key] == sign * value:
+                return self.values[key]
+            heapq.heappop(heap)
+        return None
+
+    def minmax(self) -> Tuple[float, float]:
+        """Минимум и максимум, (0, 0) без значений, как Table.get_minmax"""
+        if not self.values:
+            return 0, 0
+        return self._top(self._low, 1), self._top(self._high, -1)
+
+
+class _TaskRecord:  # pylint: disable=too-few-public-methods
+    """Задача в инкрементальном состоянии"""
+
+    def __init__(self, implementer, status, score, at_created, complexity):
+        self.implementer: int = implementer
+        self.status: int = status
+        self.score: float = score
+        self.at_jd = julianday(at_created)
+        self.complexity: float = complexity
+        # юлианские даты загрузки видео
+        self.videos: List[float] = []
+
+
+# pylint: disable-next=too-few-public-methods,too-many-instance-attributes
+class _BlogerAgg:
+    """Суммы и количества по задачам блогера"""
+
+    def __init__(self):
+        # все задачи и отказы, для Task.get_count_overs
+        self.tasks = 0
+        self.overs = 0
+        # оценки задач не в статусах 0 и 1
+        self.score_sum = 0.0
+        self.score_count = 0
+        # задачи не в статусе -1, для Task.select_avg_duration
+        self.present = 0
+        self.fixed_sum = 0.0
+        self.fixed_count = 0
+        # строки выданных задач, их длительность растёт со временем:
+        # сумма весов 1/сложность и сумма юлианских дат выдачи с весами
+        self.open_count = 0
+        self.open_weight = 0.0
+        self.open_at = 0.0
+
+    def get_duration(self, now_jd: float) -> Union[float, None]:
+        """Средняя относительная продолжительность, None без строк"""
+        count = self.fixed_count + self.open_count
+        if count == 0:
+            return None
+        open_sum = (now_jd * self.open_weight - self.open_at) * 24
+        return (self.fixed_sum + open_sum) / count
+
+
+class _RequestRecord:  # pylint: disable=too-few-public-methods
+    """Запрос на проверку внутри 30-дневного окна"""
+
+    def __init__(self, rr_id, reviewer, video, status, at_created):
+        self.id: int = rr_id
+        self.reviewer: int = reviewer
+        self.video: int = video
+        self.status: int = status
+        self.at_created: datetime = at_created
+        # учитывается ли в ReviewRequest.get_count_overs
+        self.active = False
+        # ID отзыва, оценка, часы от запроса до отзыва
+        self.reviews: List[Tuple[int, float, float]] = []
+
+
+class _ReviewerAgg:  # pylint: disable=too-few-public-methods
+    """Суммы и количества по запросам проверяющего"""
+
+    def __init__(self):
+        # все просроченные запросы и запросы в окне get_count_overs
+        self.all_overs = 0
+        self.active = 0
+        # просроченные запросы в 30-дневном окне
+        self.overs = 0
+        # отклонения оценок от лучшей оценки видео
+        self.reviews = 0
+        self.deviation_sum = 0.0
+        # часы до отзыва по проверенным запросам
+        self.durations = 0
+        self.hours_sum = 0.0
+
+
+class RatingState:  # pylint: disable=too-many-instance-attributes
+    """Инкрементальные агрегаты рейтингов.
+
+    Загружается один раз, затем каждое событие (выдача и изменение
+    задачи, загрузка видео, запрос на проверку, отзыв, просрочка)
+    меняет только суммы и количества своего пользователя и минимаксы.
+    Рейтинг пользователя считается из них за O(1), кроме минимакса
+    продолжительности блогеров: он зависит от текущего времени и
+    пересчитывается по блогерам с выданными задачами.
+    Запросы старше 30 дней выходят из окна по кучам дат создания.
+
+    Все изменения задач, видео, запросов и отзывов должны сопровождаться
+    вызовом on_*, иначе нужен invalidate.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset(datetime.now())
+
+    def _reset(self, now: datetime):
+        """Очищает агрегаты"""
+        self.limit_dt = now - timedelta(days=30)
+        self._tasks: Dict[int, _TaskRecord] = {}
+        self._blogers: Dict[int, _BlogerAgg] = {}
+        self._task_scores = MinMaxTracker()
+        self._task_overs = MinMaxTracker()
+        # продолжительность блогеров без выданных задач
+        self._task_durations = MinMaxTracker()
+        self._open_blogers = set()
+
+        self._requests: Dict[int, _RequestRecord] = {}
+        self._reviewers: Dict[int, _ReviewerAgg] = {}
+        self._window: List[Tuple[datetime, int]] = []
+        self._active_window: List[Tuple[datetime, int]] = []
+        # ID видео -> (ID проверяющего, оценка) отзывов в окне
+        self._video_scores: Dict[int, List[Tuple[int, float]]] = {}
+        self._deviation_low = MinMaxTracker()
+        self._deviation_high = MinMaxTracker()
+        self._review_overs = MinMaxTracker()
+        self._review_overs.set(-1, 0)
+        self._review_durations = MinMaxTracker()
+
+    @staticmethod
+    def _get_active_limit(limit_dt: datetime) -> datetime:
+        """Граница окна ReviewRequest.get_count_overs. Там дата
+        сравнивается строкой с isoformat(), поэтому весь день
+        limit_dt не входит в окно"""
+        return datetime.combine(limit_dt.date() + timedelta(days=1), time())
+
+    def invalidate(self):
+        """Сбрасывает состояние, следующее обращение перечитает БД"""
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self, now: datetime):
+        """Загружает состояние при первом обращении"""
+        if not self._loaded:
+            self.load(now)
+
+    def load(self, now: datetime = None) -> "RatingState":
+        """Загружает агрегаты из БД"""
+        now = now or datetime.now()
+        with self._lock:
+            self._reset(now)
+
+            for row in (
+                Task.select(
+                    Task.id,
+                    Task.implementer,
+                    Task.status,
+                    Task.score,
+                    Task.at_created,
+                    Theme.complexity,
+                )
+                .join(Theme)
+                .dicts()
+            ):
+                self._tasks[row["id"]] = _TaskRecord(
+                    row["implementer"],
+                    row["status"],
+                    row["score"],
+                    row["at_created"],
+                    row["complexity"],
+                )
+            for row in Video.select(Video.task, Video.at_created).dicts():
+                self._tasks[row["task"]].videos.append(
+                    julianday(row["at_created"])
+                )
+            for record in self._tasks.values():
+                self._apply_task(record, 1)
+
+            for row in (
+                ReviewRequest.select(
+                    ReviewRequest.reviewer,
+                    fn.COUNT(ReviewRequest.id).alias("count"),
+                )
+                .where(ReviewRequest.status == -1)
+                .group_by(ReviewRequest.reviewer)
+                .dicts()
+            ):
+                self._get_reviewer(row["reviewer"]).all_overs = row["count"]
+
+            for row in (
+                ReviewRequest.select(
+                    ReviewRequest.id,
+                    ReviewRequest.reviewer,
+                    ReviewRequest.video,
+                    ReviewRequest.status,
+                    ReviewRequest.at_created,
+                )
+                .where(ReviewRequest.at_created > self.limit_dt)
+                .dicts()
+            ):
+                self._requests[row["id"]] = _RequestRecord(
+                    row["id"],
+                    row["reviewer"],
+                    row["video"],
+                    row["status"],
+                    row["at_created"],
+                )
+            for row in (
+                Review.select(
+                    Review.id,
+                    Review.review_request,
+                    Review.score,
+                    Review.at_created,
+                )
+                .join(ReviewRequest)
+                .where(ReviewRequest.at_created > self.limit_dt)
+                .dicts()
+            ):
+                record = self._requests[row["review_request"]]
+                record.reviews.append(
+                    self._make_review(
+                        record, row["id"], row["score"], row["at_created"]
+                    )
+                )
+            for record in self._requests.values():
+                self._add_request(record)
+            for reviewer_id in self._reviewers:
+                self._refresh_reviewer(reviewer_id)
+
+            self._loaded = True
+        return self
+
+    # Блогеры
+
+    def _get_bloger(self, user_id: int) -> _BlogerAgg:
+        """Агрегаты блогера"""
+        agg = self._blogers.get(user_id)
+        if agg is None:
+            agg = self._blogers[user_id] = _BlogerAgg()
+        return agg
+
+    def _apply_task(self, record: _TaskRecord, sign: int):
+        """Добавляет (sign=1) или убирает (sign=-1) вклад задачи"""
+        agg = self._get_bloger(record.implementer)
+        agg.tasks += sign
+        if record.status == -1:
+            agg.overs += sign
+        if record.status not in (0, 1):
+            agg.score_sum += sign * record.score
+            agg.score_count += sign
+        if record.status != -1:
+            agg.present += sign
+            if record.status == 0:
+                # LEFT JOIN с видео даёт строку на каждое видео
+                rows = max(1, len(record.videos))
+                agg.open_count += sign * rows
+                agg.open_weight += sign * rows / record.complexity
+                agg.open_at += sign * rows * record.at_jd / record.complexity
+            else:
+                for video_jd in record.videos:
+                    agg.fixed_sum += (
+                        sign
+                        * (video_jd - record.at_jd)
+                        * 24
+                        / record.complexity
+                    )
+                    agg.fixed_count += sign
+        self._refresh_bloger(record.implementer)
+
+    def _refresh_bloger(self, user_id: int):
+        """Обновляет минимаксы по агрегатам блогера"""
+        agg = self._blogers[user_id]
+        if agg.score_count:
+            self._task_scores.set(user_id, agg.score_sum / agg.score_count)
+        else:
+            agg.score_sum = 0.0
+            self._task_scores.discard(user_id)
+
+        if agg.tasks:
+            self._task_overs.set(user_id, agg.overs)
+        else:
+            self._task_overs.discard(user_id)
+
+        if agg.open_count == 0:
+            agg.open_weight = agg.open_at = 0.0
+        if agg.fixed_count == 0:
+            agg.fixed_sum = 0.0
+        if agg.present and agg.open_count:
+            self._open_blogers.add(user_id)
+            self._task_durations.discard(user_id)
+        elif agg.present:
+            self._open_blogers.discard(user_id)
+            self._task_durations.set(user_id, agg.get_duration(0) or 0)
+        else:
+            self._open_blogers.discard(user_id)
+            self._task_durations.discard(user_id)
+
+    def _get_minmax_task_duration(self, now_jd: float) -> Tuple[float, float]:
+        """Минимакс продолжительности, как Task.get_minmax_duration"""
+        values = [
+            self._blogers[user_id].get_duration(now_jd) or 0
+            for user_id in self._open_blogers
+        ]
+        if self._task_durations.values:
+            values.extend(self._task_durations.minmax())
+        if not values:
+            return 0, 0
+        return min(values), max(values)
+
+    def _get_bloger_ratings(
+        self, user_id: int, minmax_duration: Tuple[float, float], now_jd
+    ) -> Tuple[float, float, float]:
+        """Рейтинги блогера при готовом минимаксе продолжительности"""
+        agg = self._blogers.get(user_id) or _BlogerAgg()
+
+        low, high = self._task_scores.minmax()
+        from_scores = (
+            0.7
+            if agg.score_count == 0 or high == low
+            else ((agg.score_sum / agg.score_count - low) / (high - low))
+        )
+
+        low, high = self._task_overs.minmax()
+        from_over = (
+            1
+            if agg.overs == 0 or high == low
+            else ((high - agg.overs) / (high - low))
+        )
+
+        low, high = minmax_duration
+        duration = agg.get_duration(now_jd)
+        from_duration = (
+            0.7
+            if duration is None or high == low
+            else ((high - duration) / (high - low))
+        )
+
+        return from_scores, from_over, from_duration
+
+    def get_bloger_ratings(
+        self, user_id: int, now: datetime = None
+    ) -> Tuple[float, float, float]:
+        """Рейтинги блогера по оценкам, просрочкам и продолжительности"""
+        now = now or datetime.now()
+        with self._lock:
+            self._ensure_loaded(now)
+            now_jd = julianday(now)
+            return self._get_bloger_ratings(
+                user_id, self._get_minmax_task_duration(now_jd), now_jd
+            )
+
+    def update_bloger_ratings(self, user_ids: Iterable[int]) -> List[User]:
+        """Обновляет рейтинг блогеров одним пакетным обновлением"""
+        now = datetime.now()
+        users = RatingEngine.select_users(user_ids)
+        with self._lock:
+            self._ensure_loaded(now)
+            now_jd = julianday(now)
+            minmax_duration = self._get_minmax_task_duration(now_jd)
+            for user in users:
+                ratings = self._get_bloger_ratings(
+                    user.id, minmax_duration, now_jd
+                )
+                user.bloger_rating = sum(ratings) / len(ratings)
+        RatingEngine.save(users, [User.bloger_rating])
+        return users
+
+    def update_bloger_rating(self, user: User) -> Tuple[float, ...]:
+        """Обновляет рейтинг блогера. Возвращает рейтинг и его
+        составляющие, как User.update_bloger_rating"""
+        ratings = self.get_bloger_ratings(user.id)
+        user.bloger_rating = sum(ratings) / len(ratings)
+        user.save()
+        return user.bloger_rating, *ratings
+
+    def on_task_changed(self, task: Task, video: Video = None):
+        """Задача выдана, снята, просрочена, оценена или опубликована.
+        С video — к задаче загружено новое видео"""
+        with self._lock:
+            if not self._loaded:
+                return
+            record = self._tasks.get(task.id)
+            if record is None:
+                record = self._tasks[task.id] = _TaskRecord(
+                    task.implementer_id,
+                    task.status,
+                    task.score,
+                    task.at_created,
+                    task.theme.complexity,
+                )
+                record.videos = [
+                    julianday(v.at_created)
+                    for v in Video.select(Video.at_created).where(
+                        Video.task == task.id
+                    )
+                ]
+            else:
+                self._apply_task(record, -1)
+                if video is not None:
+                    record.videos.append(julianday(video.at_created))
+            record.status = task.status
+            record.score = task.score
+            self._apply_task(record, 1)
+
+    def on_video_uploaded(self, video: Video):
+        """Блогер загрузил видео по задаче"""
+        self.on_task_changed(video.task, video)
+
+    # Проверяющие
+
+    def _get_reviewer(self, user_id: int) -> _ReviewerAgg:
+        """Агрегаты проверяющего"""
+        agg = self._reviewers.get(user_id)
+        if agg is None:
+            agg = self._reviewers[user_id] = _ReviewerAgg()
+        return agg
+
+    @staticmethod
+    def _make_review(record: _RequestRecord, review_id, score, at_created):
+        """Отзыв запроса с часами от запроса до отзыва"""
+        hours = (julianday(at_created) - julianday(record.at_created)) * 24
+        return review_id, score, hours
+
+    def _change_video_score(self, video_id, reviewer_id, score, sign):
+        """Добавляет или убирает оценку видео. Лучшая оценка видео
+        меняет отклонения всех его отзывов, их не больше нескольких"""
+        scores = self._video_scores.setdefault(video_id, [])
+        if scores:
+            best = min(s for _, s in scores)
+            for user_id, s in scores:
+                self._reviewers[user_id].deviation_sum -= abs(best - s)
+        if sign > 0:
+            scores.append((reviewer_id, score))
+        else:
+            scores.remove((reviewer_id, score))
+        self._get_reviewer(reviewer_id).reviews += sign
+
+        if not scores:
+            del self._video_scores[video_id]
+            self._deviation_low.discard(video_id)
+            self._deviation_high.discard(video_id)
+            return
+        best = min(s for _, s in scores)
+        for user_id, s in scores:
+            self._reviewers[user_id].deviation_sum += abs(best - s)
+        worst = max(s for _, s in scores)
+        avg = sum(s for _, s in scores) / len(scores)
+        deviations = (abs(avg - best), abs(avg - worst))
+        self._deviation_low.set(video_id, min(deviations))
+        self._deviation_high.set(video_id, max(deviations))
+
+    def _apply_request(self, record: _RequestRecord, sign: int):
+        """Добавляет или убирает вклад запроса в окне"""
+        agg = self._get_reviewer(record.reviewer)
+        if record.active:
+            agg.active += sign
+        if record.status == -1:
+            agg.overs += sign
+        for review_id, score, hours in record.reviews:
+            self._change_video_score(
+                record.video, record.reviewer, score, sign
+            )
+            if record.status == 1:
+                agg.durations += sign
+                agg.hours_sum += sign * hours
+                if sign > 0:
+                    self._review_durations.set(review_id, hours)
+                else:
+                    self._review_durations.discard(review_id)
+        if agg.reviews == 0:
+            agg.deviation_sum = 0.0
+        if agg.durations == 0:
+            agg.hours_sum = 0.0
+
+    def _add_request(self, record: _RequestRecord):
+        """Добавляет запрос в окно"""
+        record.active = record.at_created >= self._get_active_limit(
+            self.limit_dt
+        )
+        heapq.heappush(self._window, (record.at_created, record.id))
+        if record.active:
+            heapq.heappush(self._active_window, (record.at_created, record.id))
+        self._apply_request(record, 1)
+
+    def _refresh_reviewer(self, user_id: int):
+        """Обновляет минимакс просрочек по агрегатам проверяющего"""
+        agg = self._reviewers[user_id]
+        if agg.active:
+            self._review_overs.set(user_id, agg.all_overs)
+        else:
+            self._review_overs.discard(user_id)
+
+    def _advance(self, now: datetime):
+        """Убирает из окна запросы старше 30 дней"""
+        self.limit_dt = now - timedelta(days=30)
+        active_limit = self._get_active_limit(self.limit_dt)
+        while self._active_window and self._active_window[0][0] < active_limit:
+            _, rr_id = heapq.heappop(self._active_window)
+            record = self._requests.get(rr_id)
+            if record is not None and record.active:
+                record.active = False
+                self._get_reviewer(record.reviewer).active -= 1
+                self._refresh_reviewer(record.reviewer)
+        while self._window and self._window[0][0] <= self.limit_dt:
+            _, rr_id = heapq.heappop(self._window)
+            record = self._requests.pop(rr_id, None)
+            if record is not None:
+                self._apply_request(record, -1)
+                self._refresh_reviewer(record.reviewer)
+
+    def get_reviewer_ratings(
+        self, user_id: int, now: datetime = None
+    ) -> Tuple[float, float, float]:
+        """Рейтинги проверяющего по оценкам, просрочкам и продолжительности,
+        как RatingEngine.get_reviewer_ratings"""
+        now = now or datetime.now()
+        with self._lock:
+            self._ensure_loaded(now)
+            self._advance(now)
+            agg = self._reviewers.get(user_id) or _ReviewerAgg()
+
+            from_score = average_padded_sum(
+                _sum_from_max(
+                    agg.reviews,
+                    agg.deviation_sum,
+                    self._deviation_low.minmax()[0],
+                    self._deviation_high.minmax()[1],
+                ),
+                agg.reviews,
+            )
+
+            min_over, max_over = self._review_overs.minmax()
+            delta = max_over - min_over
+            from_over = 1 if delta == 0 else (max_over - agg.overs) / delta
+
+            min_dur, max_dur = self._review_durations.minmax()
+            from_duration = average_padded_sum(
+                _sum_from_max(
+                    agg.durations, agg.hours_sum, int(min_dur), int(max_dur)
+                ),
+                agg.durations,
+            )
+
+            return from_score, from_over, from_duration
+
+    def update_reviewer_rating(self, user: User) -> Tuple[float, ...]:
+        """Обновляет рейтинг проверяющего. Возвращает рейтинг и его
+        составляющие, как User.update_reviewer_rating"""
+        ratings = self.get_reviewer_ratings(user.id)
+        user.reviewer_rating = sum(ratings) / len(ratings)
+        user.save()
+        return user.reviewer_rating, *ratings
+
+    def get_report(self, user: User) -> str:
+        """Отчёт пользователя с рейтингами из состояния"""
+        return user.get_report(
+            self.get_bloger_ratings(user.id),
+            self.get_reviewer_ratings(user.id),
+        )
+
+    def on_request_changed(self, rr: ReviewRequest, review: Review = None):
+        """Запрос на проверку создан, просрочен или снят.
+        С review — по запросу получен отзыв"""
+        with self._lock:
+            if not self._loaded:
+                return
+            agg = self._get_reviewer(rr.reviewer_id)
+            record = self._requests.get(rr.id)
+            # Неизвестный запрос создан после загрузки, статус был 0
+            old_status = 0 if record is None else record.status
+            agg.all_overs += (rr.status == -1) - (old_status == -1)
+
+            if record is None:
+                if rr.at_created > self.limit_dt:
+                    record = self._requests[rr.id] = _RequestRecord(
+                        rr.id,
+                        rr.reviewer_id,
+                        rr.video_id,
+                        rr.status,
+                        rr.at_created,
+                    )
+                    if review is not None:
+                        record.reviews.append(
+                            self._make_review(
+                                record,
+                                review.id,
+                                review.score,
+                                review.at_created,
+                            )
+                        )
+                    self._add_request(record)
+            else:
+                self._apply_request(record, -1)
+                record.status = rr.status
+                if review is not None:
+                    record.reviews.append(
+                        self._make_review(
+                            record, review.id, review.score, review.at_created
+                        )
+                    )
+                self._apply_request(record, 1)
+            self._refresh_reviewer(rr.reviewer_id)
+
+    def on_review_created(self, review: Review):
+        """Проверяющий отправил отзыв по запросу"""
+        self.on_request_changed(review.review_request, review)
+
+    def on_request_deleted(self, rr: ReviewRequest):
+        """Запрос на проверку удалён вместе с отзывами"""
+        with self._lock:
+            if not self._loaded:
+                return
+            record = self._requests.pop(rr.id, None)
+            status = rr.status if record is None else record.status
+            agg = self._get_reviewer(rr.reviewer_id)
+            agg.all_overs -= status == -1
+            if record is not None:
+                self._apply_request(record, -1)
+            self._refresh_reviewer(rr.reviewer_id)
+
+
+rating_state = RatingState()
+
+
+def check_consistency(
+    state: RatingState = None, tolerance: float = 1e-4
+) -> List[Tuple[int, str, float, float]]:
+    """Сравнивает инкрементальные рейтинги с полным пересчётом.
+    Возвращает расхождения: ID пользователя, рейтинг,
+    значение состояния и значение пересчёта"""
+    state = state or rating_state
+    engine = create_rating_engine().load_bloger().load_reviewer()
+    now = datetime.now()
+    names = (
+        "bloger_from_scores",
+        "bloger_from_over",
+        "bloger_from_duration",
+        "reviewer_from_score",
+        "reviewer_from_over",
+        "reviewer_from_duration",
+    )
+    mismatches = []
+    for user in User.select(User.id):
+        expected = engine.get_bloger_ratings(
+            user.id
+        ) + engine.get_reviewer_ratings(user.id)
+        actual = state.get_bloger_ratings(
+            user.id, now
+        ) + state.get_reviewer_ratings(user.id, now)
+        for name, value, full in zip(names, actual, expected):
+            if abs(value - full) > tolerance:
+                mismatches.append((user.id, name, value, full))
+    return mismatches
+
+
+def main():
+    """Сравнивает агрегаты, загруженные из БД, с полным пересчётом"""
+    mismatches = check_consistency(RatingState().load())
+    for user_id, name, value, full in mismatches:
+        print(f"{user_id}\t{name}\t{value:.6f}\t{full:.6f}")
+    print(f"Расхождений: {len(mismatches)}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,6 @@ from datetime import datetime, timedelta
 from typing import List, Union
 
 from aiogram import Bot, F, Router
-from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import (
     CallbackQuery,
     InlineKeyboardButton,
@@ -13,18 +12,22 @@ from aiogram.types import (
 )
 from peewee import fn
 
+from capacity import review_capacity
 from common import (
     error_handler,
-    get_date_time,
     get_id,
     get_limit_score,
+    get_reply_request_id,
     send_message_admins,
     send_new_review_request,
     send_task,
     update_task_score,
     check_user_role,
 )
+from editor import editor
+from executor import run_db, run_db_heavy
 from filters import IsReview, IsReviewer
+from middlewares import UserContext
 from models import (
     TASK_STATUS,
     Review,
@@ -32,25 +35,113 @@ from models import (
     Task,
     Theme,
     User,
-    UserRole,
+    Role,
+    Video,
 )
+from outbox import outbox
+from rating_state import rating_state
+from reviewer_pool import reviewer_pool
+from scheduler import REVIEW_REMINDER_TIME, scheduler
+from roles import registry
 
 # pylint: disable=no-member
 
 router = Router()
 
 
+def save_review(
+    review_request: ReviewRequest, score: float, text: str
+) -> Review:
+    """Записывает отзыв и закрывает запрос на проверку"""
+    review = Review.create(
+        review_request=review_request,
+        score=score,
+        comment=text,
+    )
+    review_request.status = 1  # Проверено
+    review_request.save()
+    reviewer_pool.on_request_changed(review_request)
+    return review
+
+
+def get_reviews_count(video: Video) -> int:
+    """Число полученных отзывов на видео"""
+    return (
+        Review.select(Review)
+        .join(ReviewRequest)
+        .where((ReviewRequest.video == video) & (ReviewRequest.status == 1))
+        .count()
+    )
+
+
+def cancel_review_request(review_request: ReviewRequest):
+    """Снимает запрос на проверку с проверяющего"""
+    review_request.status = -1
+    review_request.save()
+    rating_state.on_request_changed(review_request)
+    reviewer_pool.on_request_changed(review_request)
+
+
+def add_reviewer_role(user: User):
+    """Выдаёт роль проверяющего и добавляет пользователя в пул"""
+    registry.add_user_role(user, IsReviewer.role)
+    reviewer_pool.on_role_changed(user)
+
+
+def remove_reviewer_role_from(user: User) -> bool:
+    """Снимает роль проверяющего и убирает пользователя из пула.
+    Возвращает False, если роли не было"""
+    if not registry.remove_user_role(user, IsReviewer.role):
+        return False
+    reviewer_pool.on_role_changed(user)
+    return True
+
+
+async def update_reviewer_rating(reviewer: User) -> List[float]:
+    """Обновляет рейтинг проверяющего и его место в пуле,
+    возвращает составляющие рейтинга"""
+    _, *ratings = await run_db_heavy(
+        rating_state.update_reviewer_rating, reviewer
+    )
+    reviewer_pool.on_rating_changed(reviewer)
+    return ratings
+
+
+def select_review_request(
+    message: Message, requests: List[ReviewRequest]
+) -> Union[ReviewRequest, None]:
+    """Запрос на проверку, к которому относится отзыв: указанный
+    в видео, на которое ответил проверяющий, или единственный открытый"""
+    rr_id = get_reply_request_id(message)
+    if rr_id is not None:
+        return next((rr for rr in requests if rr.id == rr_id), None)
+    return requests[0] if len(requests) == 1 else None
+
+
+def get_unselected_text(requests: List[ReviewRequest]) -> str:
+    """Ответ, если не удалось определить запрос на проверку отзыва"""
+    if len(requests) < 2:
+        return "Запрос на проверку не найден"
+    return (
+        "У Вас несколько видео на проверке. Отправьте отзыв ответом "
+        "на сообщение с видео, которое оцениваете:\n"
+        + "\n".join(
+            f"№{rr.id}: {rr.video.task.theme.title}" for rr in requests
+        )
+    )
+
+
 @router.message(F.text, IsReview())
 @error_handler()
-async def get_review(message: Message):
+async def get_review(message: Message, user_context: UserContext):
     """Получение оценки и отзыва"""
-    reviewer: User = User.get(tg_id=message.from_user.id)
-    review_request: ReviewRequest = ReviewRequest.get_or_none(
-        reviewer=reviewer, status=0  # На проверке
-    )
+    reviewer: User = user_context.user
+    # Запросы на проверку уже загружены фильтром IsReview
+    requests = user_context.get_review_requests()
+    review_request = select_review_request(message, requests)
 
     if review_request is None:
-        await message.answer(text="Запрос на проверку не найден")
+        await message.answer(text=get_unselected_text(requests))
         return
     text = message.text.strip()
     digit = text.find(" ")
@@ -66,24 +157,21 @@ async def get_review(message: Message):
     if digit < 0 or digit > 5:
         await message.answer(text=f"{digit} должно быть в пределах [0.0; 5.0]")
         return
-    Review.create(
-        review_request=review_request,
-        score=digit,
-        comment=text,
-    )
-    review_request.status = 1  # Проверено
-    review_request.save()
+    review = await run_db(save_review, review_request, digit, text)
 
-    reviewer.update_reviewer_score()
-    reviewer.update_reviewer_rating()
+    await run_db_heavy(rating_state.on_review_created, review)
+    await run_db_heavy(reviewer.update_reviewer_score)
+    ratings = await update_reviewer_rating(reviewer)
+    report = await run_db_heavy(reviewer.get_reviewer_report, ratings)
     await message.answer(
-        text=f"Спасибо, ответ записан.\n\n{reviewer.get_reviewer_report()}",
+        text=f"Спасибо, ответ записан.\n\n{report}",
         parse_mode="HTML",
         disable_web_page_preview=True,
     )
 
     implementer: User = review_request.video.task.implementer
-    await message.bot.send_message(
+    await outbox.send(
+        "send_message",
         chat_id=implementer.tg_id,
         text=f"Ваше видео оценили\n\n{text}",
     )
@@ -108,27 +196,24 @@ async def get_review(message: Message):
             ]
         ),
     )
-    reviews = (
-        Review.select(Review)
-        .join(ReviewRequest)
-        .where(
-            (ReviewRequest.video == review_request.video)
-            & (ReviewRequest.status == 1)
-        )
-    )
-
-    if reviews.count() < 5:
+    reviews_count = await run_db(get_reviews_count, review_request.video)
+    if reviews_count < review_capacity.per_video:
         await send_new_review_request(message.bot)
         return
 
-    task: Task = update_task_score(review_request.video.task)
+    task: Task = await run_db_heavy(
+        update_task_score, review_request.video.task
+    )
+    await run_db_heavy(rating_state.on_task_changed, task)
 
-    implementer.update_bloger_score()
-    implementer.update_bloger_rating()
+    await run_db_heavy(implementer.update_bloger_score)
+    _, *ratings = await run_db_heavy(
+        rating_state.update_bloger_rating, implementer
+    )
 
     await send_new_review_request(message.bot)
 
-    limit_score = get_limit_score()
+    limit_score = await run_db_heavy(get_limit_score)
     text = f"Закончена проверка Вашего видео по теме {task.theme.link}.\n"
     text += f"Попрош приема работы {(limit_score*5):04.2f}"
 
@@ -136,9 +221,11 @@ async def get_review(message: Message):
         text += "Оно ❤️достойного❤️ качества и будет опубликовано."
     elif task.status == -2:
         text += "Оно 💩низкого💩 качества и будет отправлено на переделку."
-    text += f"\n\n{implementer.get_bloger_report()}"
+    report = await run_db_heavy(implementer.get_bloger_report, ratings)
+    text += f"\n\n{report}"
 
-    await message.bot.send_message(
+    await outbox.send(
+        "send_message",
         chat_id=task.implementer.tg_id,
         text=text,
         parse_mode="HTML",
@@ -153,31 +240,15 @@ async def get_review(message: Message):
             f"{(task.score*100):05.2f}|{TASK_STATUS[task.status]}\n"
             f"Порог приёма работы: {(limit_score*100):05.2f}"
         ),
+        category="reviews",
     )
 
     await send_task(message.bot)
 
-    if (
-        implementer.get_bloger_rating_from_scores() >= limit_score
-        and Theme.select(fn.SUM(Theme.complexity).alias("th_comp"))
-        .join(Task)
-        .where(Task.implementer == implementer.id)
-        .first()
-        .th_comp
-        >= 10
-        and UserRole.select()
-        .where(
-            (UserRole.user == implementer.id)
-            & (UserRole.role == IsReviewer.role.id)
-        )
-        .count()
-        == 0
-    ):
-        UserRole.get_or_create(
-            user=implementer,
-            role=IsReviewer.role,
-        )
-        await message.bot.send_message(
+    if await run_db_heavy(can_be_reviewer, implementer, limit_score):
+        await run_db(add_reviewer_role, implementer)
+        await outbox.send(
+            "send_message",
             chat_id=implementer.tg_id,
             text="Вам выдана роль проверяющего. "
             "Ожидайте видео на проверку. "
@@ -188,13 +259,26 @@ async def get_review(message: Message):
         await send_message_admins(
             bot=message.bot,
             text=f"Роль проверяющего выдана {implementer.link}",
+            category="roles",
         )
 
 
+def can_be_reviewer(implementer: User, limit_score: float) -> bool:
+    """Проверяет, заслужил ли блогер роль проверяющего"""
+    return (
+        implementer.get_bloger_rating_from_scores() >= limit_score
+        and Theme.select(fn.SUM(Theme.complexity).alias("th_comp"))
+        .join(Task)
+        .where(Task.implementer == implementer.id)
+        .first()
+        .th_comp
+        >= 10
+        and not registry.has_role(implementer.id, IsReviewer.role)
+    )
+
+
 @error_handler()
-async def get_reviewer_user_role(
-    bot: Bot, user: User
-) -> Union[UserRole, None]:
+async def get_reviewer_user_role(bot: Bot, user: User) -> Union[Role, None]:
     """Проверяем наличие привилегии блогера"""
     return await check_user_role(
         bot=bot,
@@ -209,50 +293,70 @@ async def get_reviewer_user_role(
     )
 
 
-def get_reviewe_requests_by_notify() -> List[ReviewRequest]:
-    """ПОлучить запросы на проверку у которы подходит срок"""
-    due_date = get_date_time(hours=1)
-    # Запрос на выборку записей на проверке старше суток
-    return ReviewRequest.select().where(
-        (ReviewRequest.due_date == due_date) & (ReviewRequest.status == 0)
+def get_reviewe_requests_by_notify(
+    since: datetime, now: datetime
+) -> List[ReviewRequest]:
+    """ПОлучить запросы на проверку у которы подходит срок:
+    время напоминания попало в интервал (since; now]"""
+    return list(
+        ReviewRequest.select_with_task().where(
+            (ReviewRequest.due_date > since + REVIEW_REMINDER_TIME)
+            & (ReviewRequest.due_date <= now + REVIEW_REMINDER_TIME)
+            & (ReviewRequest.status == 0)
+        )
+    )
+
+
+def get_open_review_requests(user_id: int) -> List[ReviewRequest]:
+    """Открытые запросы на проверку у проверяющего"""
+    return list(
+        ReviewRequest.select().where(
+            (ReviewRequest.reviewer_id == user_id)
+            & (ReviewRequest.status == 0)
+        )
     )
 
 
-def get_old_reviewe_requests() -> List[ReviewRequest]:
+def get_review_request(rr_id: int) -> ReviewRequest:
+    """Запрос на проверку вместе с проверяющим, видео и темой"""
+    return (
+        ReviewRequest.select_with_task().where(ReviewRequest.id == rr_id).get()
+    )
+
+
+def get_old_reviewe_requests(now: datetime) -> List[ReviewRequest]:
     """ПОлучить запросы на проверку у которы прошел срок"""
-    now = datetime.now()
     # Запрос на выборку записей на проверке старше суток
-    return ReviewRequest.select().where(
-        (ReviewRequest.due_date <= now) & (ReviewRequest.status == 0)
+    return list(
+        ReviewRequest.select_with_task().where(
+            (ReviewRequest.due_date <= now) & (ReviewRequest.status == 0)
+        )
     )
 
 
 @error_handler()
-async def check_old_reviewer_requests(bot: Bot):
+async def check_old_reviewer_requests(
+    bot: Bot, _since: datetime, now: datetime
+):
     """Проверка устаревших запросов на проверку"""
 
-    rrs: List[ReviewRequest] = list(get_old_reviewe_requests())
+    rrs: List[ReviewRequest] = await run_db(get_old_reviewe_requests, now)
 
     for rr in rrs:
-        rr.status = -1
-        rr.save()
+        await run_db_heavy(cancel_review_request, rr)
         reviewer: User = rr.reviewer
         task: Task = rr.video.task
-        reviewer.update_reviewer_rating()
-
-        text = (
-            "Задача на проверку с Вас снята, "
-            f"ожидайте новую.\n\n{reviewer.get_reviewer_report()}"
+        ratings = await update_reviewer_rating(reviewer)
+        report = await run_db_heavy(reviewer.get_reviewer_report, ratings)
+
+        await outbox.send(
+            "send_message",
+            chat_id=reviewer.tg_id,
+            text="Задача на проверку с Вас снята, "
+            f"ожидайте новую.\n\n{report}",
+            parse_mode="HTML",
+            disable_web_page_preview=True,
         )
-        try:
-            await bot.send_message(
-                chat_id=reviewer.tg_id,
-                text=text,
-                parse_mode="HTML",
-                disable_web_page_preview=True,
-            )
-        except TelegramBadRequest as ex:
-            print(ex, text)
 
         await send_message_admins(
             bot=bot,
@@ -261,6 +365,7 @@ async def check_old_reviewer_requests(bot: Bot):
                 f"тему {task.theme.link} "
                 f"блогера {task.implementer.link}"
             ),
+            category="deadlines",
         )
 
         await send_new_review_request(bot)
@@ -271,27 +376,26 @@ async def check_old_reviewer_requests(bot: Bot):
 async def remove_reviewer_role(callback_query: CallbackQuery):
     """Удаляет роль проверяющего"""
     user_id = get_id(callback_query.data)
-    user: User = User.get_by_id(user_id)
-    user_role: UserRole = UserRole.get_or_none(user=user, role=IsReview.role)
-    if user_role is None:
+    user: User = await run_db(User.get_by_id, user_id)
+    if not await run_db(remove_reviewer_role_from, user):
         await callback_query.answer("Роль уже удалена")
         return
 
-    user_role.delete_instance()
     await callback_query.message.answer("Роль проверяющего удалена")
     await callback_query.message.delete()
-    user: User = User.get_by_id(user_id)
     await send_message_admins(
         bot=callback_query.bot,
         text=f"""🕴📨📹<b>Проверяющий {user.link} отказался от роли</b>""",
+        category="roles",
     )
 
-    rr: ReviewRequest = ReviewRequest.get_or_none(
-        ReviewRequest.reviewer_id == user_id, ReviewRequest.status == 0
+    # При REVIEWER_PARALLEL больше 1 открытых запросов может быть несколько
+    requests: List[ReviewRequest] = await run_db(
+        get_open_review_requests, user_id
     )
-    if rr:
-        rr.status = -1
-        rr.save()
+    for rr in requests:
+        await run_db_heavy(cancel_review_request, rr)
+    if requests:
         await send_new_review_request(callback_query.bot)
 
 
@@ -309,10 +413,11 @@ async def remove_reviewer_role_not_role(callback_query: CallbackQuery):
 async def to_extend(callback_query: CallbackQuery):
     """Обработать запрос на продление срока проверки."""
     rr_id = get_id(callback_query.data)
-    rr: ReviewRequest = ReviewRequest.get_by_id(rr_id)
+    rr: ReviewRequest = await run_db(get_review_request, rr_id)
 
     if rr.status != 0:
-        await callback_query.message.edit_text(
+        await editor.edit(
+            callback_query.message,
             text="Срок не может быть продлен. "
             f"Отзыв по теме <b>{rr.video.task.theme.title}</b> уже получен.",
             parse_mode="HTML",
@@ -321,9 +426,11 @@ async def to_extend(callback_query: CallbackQuery):
         return
 
     rr.due_date += timedelta(hours=1)
-    rr.save()
+    await run_db(rr.save)
+    scheduler.schedule_review_request(rr)
 
-    await callback_query.message.edit_text(
+    await editor.edit(
+        callback_query.message,
         text=f"Срок сдвинут до {rr.due_date}",
         reply_markup=None,
     )
@@ -335,15 +442,17 @@ async def to_extend(callback_query: CallbackQuery):
 Курс: {rr.video.task.theme.course.title}
 Тема: {rr.video.task.theme.title}
 Срок: {rr.due_date}""",
+        category="extensions",
     )
 
 
 @error_handler()
-async def send_notify_reviewers(bot: Bot):
+async def send_notify_reviewers(_bot: Bot, since: datetime, now: datetime):
     """Послать напоминалку проверяющему об окончании строка"""
 
-    for rr in list(get_reviewe_requests_by_notify()):
-        await bot.send_message(
+    for rr in await run_db(get_reviewe_requests_by_notify, since, now):
+        await outbox.send(
+            "send_message",
             chat_id=rr.reviewer.tg_id,
             text="До окончания срока проверки видео остался 1 час. "
             "Воспользуйтесь этой кнопкой, что бы продлить срок на 1 час",
@@ -358,12 +467,3 @@ async def send_notify_reviewers(bot: Bot):
                 ]
             ),
         )
-
-
-@error_handler()
-async def loop(bot: Bot):
-    """Основной цикл обработки"""
-    now = datetime.now()
-    if now.minute == 0:
-        await send_notify_reviewers(bot)
-        await check_old_reviewer_requests(bot)
@@ -0,0 +1,230 @@
+"""Пул проверяющих в памяти.
+
+Хранит проверяющих в порядке рейтинга, их открытые запросы на проверку
+и темы, которые они уже проверяли. Свободен проверяющий, у которого
+открыто меньше запросов, чем позволяет ReviewCapacity для его рейтинга.
+Выбор проверяющего для видео идёт по отсортированному списку свободных
+с проверками за O(1), без запросов к БД.
+"""
+
+import bisect
+import threading
+from collections import Counter
+from typing import Container, Dict, List, Tuple, Union
+
+from capacity import ReviewCapacity, review_capacity
+from models import ReviewRequest, Task, User, Video
+from roles import registry
+
+# pylint: disable=no-member
+
+REVIEWER_ROLE = "Проверяющий"
+
+
+# pylint: disable-next=too-many-instance-attributes
+class ReviewerPool:
+    """Проверяющие по ID пользователя.
+
+    Загружается при первом выборе, затем обновляется вызовами on_*.
+    Все изменения запросов на проверку, рейтингов и ролей проверяющих
+    должны сопровождаться вызовом on_*, иначе нужен invalidate.
+    """
+
+    def __init__(self, capacity: ReviewCapacity = review_capacity):
+        self.capacity = capacity
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        """Очищает пул"""
+        # ID проверяющего -> рейтинг
+        self._ratings: Dict[int, float] = {}
+        # Свободные проверяющие: (-рейтинг, ID) по возрастанию
+        self._vacant: List[Tuple[float, int]] = []
+        # ID проверяющего -> число открытых запросов
+        self._open: Counter = Counter()
+        # ID проверяющего -> ID темы -> число запросов по теме
+        self._themes: Dict[int, Counter] = {}
+        # ID запроса -> (ID проверяющего, ID темы, статус)
+        self._requests: Dict[int, Tuple[int, int, int]] = {}
+
+    def invalidate(self):
+        """Сбрасывает пул, следующий выбор перечитает БД"""
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self):
+        """Загружает пул при первом обращении"""
+        if not self._loaded:
+            self.load()
+
+    def load(self) -> "ReviewerPool":
+        """Загружает проверяющих и запросы на проверку из БД"""
+        with self._lock:
+            self._reset()
+            for rr_id, reviewer_id, status, theme_id in (
+                ReviewRequest.select(
+                    ReviewRequest.id,
+                    ReviewRequest.reviewer,
+                    ReviewRequest.status,
+                    Task.theme,
+                )
+                .join(Video)
+                .join(Task)
+                .tuples()
+            ):
+                self._add_request(rr_id, reviewer_id, theme_id, status)
+            member_ids = registry.get_member_ids(
+                registry.get_role(REVIEWER_ROLE)
+            )
+            for user_id, rating in (
+                User.select(User.id, User.reviewer_rating)
+                .where(User.id.in_(member_ids))
+                .tuples()
+            ):
+                self._ratings[user_id] = rating
+                self._update_vacancy(user_id)
+            self._loaded = True
+        return self
+
+    def _add_request(
+        self, rr_id: int, reviewer_id: int, theme_id: int, status: int
+    ):
+        """Учитывает запрос на проверку"""
+        self._requests[rr_id] = (reviewer_id, theme_id, status)
+        self._themes.setdefault(reviewer_id, Counter())[theme_id] += 1
+        self._open[reviewer_id] += status == 0
+
+    def _remove_request(self, rr_id: int):
+        """Перестаёт учитывать запрос на проверку"""
+        reviewer_id, theme_id, status = self._requests.pop(rr_id)
+        themes = self._themes[reviewer_id]
+        themes[theme_id] -= 1
+        if themes[theme_id] <= 0:
+            del themes[theme_id]
+        self._open[reviewer_id] -= status == 0
+        if self._open[reviewer_id] <= 0:
+            del self._open[reviewer_id]
+
+    def _update_vacancy(self, user_id: int, old_rating: float = None):
+        """Добавляет проверяющего в список свободных или убирает из него.
+        old_rating — рейтинг, с которым он мог быть в списке"""
+        rating = self._ratings.get(user_id)
+        old_rating = rating if old_rating is None else old_rating
+        if old_rating is not None:
+            old_key = (-old_rating, user_id)
+            index = bisect.bisect_left(self._vacant, old_key)
+            if index < len(self._vacant) and self._vacant[index] == old_key:
+                del self._vacant[index]
+        if rating is not None and self._get_free(user_id) > 0:
+            bisect.insort(self._vacant, (-rating, user_id))
+
+    def _get_free(self, user_id: int) -> int:
+        """Сколько ещё запросов можно выдать проверяющему"""
+        rating = self._ratings[user_id]
+        return self.capacity.get_parallel(rating) - self._open[user_id]
+
+    def get_vacant_ids(self) -> List[int]:
+        """ID свободных проверяющих по убыванию рейтинга"""
+        with self._lock:
+            self._ensure_loaded()
+            return [user_id for _, user_id in self._vacant]
+
+    def get_vacant_count(self) -> int:
+        """Число свободных проверяющих"""
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._vacant)
+
+    def get_free_slots(self) -> int:
+        """Сколько запросов ещё можно выдать всем проверяющим"""
+        with self._lock:
+            self._ensure_loaded()
+            return sum(self._get_free(user_id) for _, user_id in self._vacant)
+
+    def get_total_slots(self) -> int:
+        """Сколько запросов могут держать открытыми все проверяющие"""
+        with self._lock:
+            self._ensure_loaded()
+            return sum(
+                self.capacity.get_parallel(rating)
+                for rating in self._ratings.values()
+            )
+
+    def has_theme(self, user_id: int, theme_id: int) -> bool:
+        """Проверял ли пользователь тему"""
+        with self._lock:
+            self._ensure_loaded()
+            return theme_id in self._themes.get(user_id, ())
+
+    def pick(
+        self,
+        theme_id: int,
+        excluded: Container[int] = (),
+        used: Dict[int, int] = None,
+    ) -> Union[int, None]:
+        """ID свободного проверяющего с наибольшим рейтингом, который не
+        проверял тему и не входит в excluded, или None. used — сколько
+        запросов проверяющим уже выбрано, но ещё не создано. Пул не
+        меняется: запрос учитывается вызовом on_request_changed
+        после создания"""
+        used = used or {}
+        with self._lock:
+            self._ensure_loaded()
+            for _, user_id in self._vacant:
+                if user_id in excluded:
+                    continue
+                if used.get(user_id, 0) >= self._get_free(user_id):
+                    continue
+                if theme_id in self._themes.get(user_id, ()):
+                    continue
+                return user_id
+            return None
+
+    def on_request_changed(self, rr: ReviewRequest):
+        """Запрос на проверку создан или изменился его статус"""
+        with self._lock:
+            if not self._loaded:
+                return
+            record = self._requests.get(rr.id)
+            if record is None:
+                theme_id = rr.video.task.theme_id
+            else:
+                theme_id = record[1]
+                self._remove_request(rr.id)
+            self._add_request(rr.id, rr.reviewer_id, theme_id, rr.status)
+            self._update_vacancy(rr.reviewer_id)
+
+    def on_request_deleted(self, rr: ReviewRequest):
+        """Запрос на проверку удалён"""
+        with self._lock:
+            if not self._loaded or rr.id not in self._requests:
+                return
+            self._remove_request(rr.id)
+            self._update_vacancy(rr.reviewer_id)
+
+    def on_rating_changed(self, user: User):
+        """Изменился рейтинг проверяющего"""
+        with self._lock:
+            if not self._loaded or user.id not in self._ratings:
+                return
+            old_rating = self._ratings[user.id]
+            self._ratings[user.id] = user.reviewer_rating
+            self._update_vacancy(user.id, old_rating)
+
+    def on_role_changed(self, user: User):
+        """Пользователю выдана или с него снята роль проверяющего"""
+        with self._lock:
+            if not self._loaded:
+                return
+            old_rating = self._ratings.pop(user.id, None)
+            if registry.has_role(user.id, registry.get_role(REVIEWER_ROLE)):
+                self._ratings[user.id] = user.reviewer_rating
+            if old_rating is not None:
+                self._update_vacancy(user.id, old_rating)
+            elif user.id in self._ratings:
+                self._update_vacancy(user.id)
+
+
+reviewer_pool = ReviewerPool()
@@ -0,0 +1,109 @@
+"""Кэш ролей пользователей"""
+
+import threading
+from typing import Dict, List, Set, Union
+
+from models import Role, User, UserRole
+
+# pylint: disable=no-member
+
+
+class RoleRegistry:
+    """Держит в памяти роли и роли каждого пользователя.
+    Все изменения UserRole должны проходить через add_user_role и
+    remove_user_role, тогда кэш совпадает с БД без повторных запросов"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        # название роли -> роль
+        self._roles: Dict[str, Role] = {}
+        # ID пользователя -> ID его ролей
+        self._user_roles: Dict[int, Set[int]] = {}
+        # ID роли -> {ID пользователя: Telegram ID}
+        self._members: Dict[int, Dict[int, int]] = {}
+
+    def _ensure_loaded(self):
+        """Загружает роли из БД при первом обращении"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._roles = {role.name: role for role in Role.select()}
+            self._user_roles = {}
+            self._members = {role.id: {} for role in self._roles.values()}
+            for row in (
+                UserRole.select(UserRole.user, UserRole.role, User.tg_id)
+                .join(User)
+                .dicts()
+            ):
+                self._add(row["user"], row["tg_id"], row["role"])
+            self._loaded = True
+
+    def _add(self, user_id: int, tg_id: int, role_id: int):
+        """Добавляет роль пользователя в кэш"""
+        self._user_roles.setdefault(user_id, set()).add(role_id)
+        self._members.setdefault(role_id, {})[user_id] = tg_id
+
+    def _remove(self, user_id: int, role_id: int):
+        """Убирает роль пользователя из кэша"""
+        self._user_roles.get(user_id, set()).discard(role_id)
+        self._members.get(role_id, {}).pop(user_id, None)
+
+    def invalidate(self):
+        """Сбрасывает кэш, следующее обращение перечитает БД"""
+        with self._lock:
+            self._loaded = False
+
+    def get_role(self, name: str) -> Union[Role, None]:
+        """Возвращает роль по названию"""
+        self._ensure_loaded()
+        return self._roles.get(name)
+
+    def get_role_ids(self, user_id: int) -> Set[int]:
+        """Возвращает ID ролей пользователя"""
+        self._ensure_loaded()
+        return set(self._user_roles.get(user_id, ()))
+
+    def has_role(self, user_id: int, role: Role) -> bool:
+        """Проверяет наличие роли у пользователя"""
+        self._ensure_loaded()
+        return role.id in self._user_roles.get(user_id, ())
+
+    def get_member_ids(self, role: Role) -> List[int]:
+        """Возвращает ID всех пользователей с ролью"""
+        self._ensure_loaded()
+        return list(self._members.get(role.id, {}))
+
+    def get_member_tg_ids(self, role: Role) -> List[int]:
+        """Возвращает Telegram ID всех пользователей с ролью"""
+        self._ensure_loaded()
+        return list(self._members.get(role.id, {}).values())
+
+    def add_user_role(self, user: User, role: Role) -> bool:
+        """Выдаёт роль пользователю. Возвращает False,
+        если роль уже была выдана"""
+        with self._lock:
+            self._ensure_loaded()
+            if role.id in self._user_roles.get(user.id, ()):
+                return False
+            UserRole.get_or_create(user=user, role=role)
+            self._add(user.id, user.tg_id, role.id)
+            return True
+
+    def remove_user_role(self, user: User, role: Role) -> bool:
+        """Снимает роль с пользователя. Возвращает False,
+        если роли не было"""
+        with self._lock:
+            self._ensure_loaded()
+            if role.id not in self._user_roles.get(user.id, ()):
+                return False
+            UserRole.delete().where(  # pylint: disable=no-value-for-parameter
+                (UserRole.user == user.id) & (UserRole.role == role.id)
+            ).execute()
+            self._remove(user.id, role.id)
+            return True
+
+
+registry = RoleRegistry()
@@ -0,0 +1,207 @@
+"""Планировщик фоновых задач по срокам.
+
+В min-куче хранятся ближайшие моменты событий: сроки задач и
+запросов на проверку, напоминания, публикации в канале. Планировщик
+спит ровно до ближайшего события, а обработчик события выбирает все
+просроченные записи запросом по диапазону, поэтому опоздавшее
+пробуждение ничего не пропускает.
+"""
+
+import asyncio
+import functools
+import heapq
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+
+from aiogram import Bot
+
+from models import ReviewRequest, Task, Theme
+from supervisor import Supervisor, supervisor
+
+# pylint: disable=no-member
+
+# Виды событий в порядке обработки при совпадении времени
+RATINGS = "ratings"
+TASK_RESERVE = "task_reserve"
+TASK_DUE = "task_due"
+REVIEW_REMINDER = "review_reminder"
+REVIEW_DUE = "review_due"
+CHANNEL_VIDEO = "channel_video"
+CHANNEL_POLL = "channel_poll"
+KINDS = (
+    RATINGS,
+    TASK_RESERVE,
+    TASK_DUE,
+    REVIEW_REMINDER,
+    REVIEW_DUE,
+    CHANNEL_VIDEO,
+    CHANNEL_POLL,
+)
+# Напоминание проверяющему до окончания срока
+REVIEW_REMINDER_TIME = timedelta(hours=1)
+# Наибольший сон: после него время сверяется с часами заново
+MAX_SLEEP = 3600
+# Через сколько повторить событие, пропущенное из-за идущего запуска
+RETRY_DELAY = timedelta(minutes=1)
+
+# Обработчик получает бота и границы интервала (since; now]:
+# время прошлого запуска обработчика и текущее время
+Handler = Callable[[Bot, datetime, datetime], Awaitable]
+
+
+def get_next_time(now: datetime, hour: int = None) -> datetime:
+    """Ближайшее после now начало часа, а если задан hour —
+    ближайшее начало этого часа суток"""
+    next_time = now.replace(minute=0, second=0, microsecond=0)
+    step = timedelta(hours=1) if hour is None else timedelta(days=1)
+    if hour is not None:
+        next_time = next_time.replace(hour=hour)
+    while next_time <= now:
+        next_time += step
+    return next_time
+
+
+# pylint: disable-next=too-many-instance-attributes
+class Scheduler:
+    """Min-куча событий (время, вид). Одинаковые события хранятся
+    один раз, устаревшие безвредны: обработчик просто ничего не найдёт"""
+
+    def __init__(
+        self,
+        clock: Callable[[], datetime] = datetime.now,
+        jobs: Supervisor = supervisor,
+    ):
+        self.clock = clock
+        self.jobs = jobs
+        self.started_at = clock()
+        self._heap: List[Tuple[datetime, int, str]] = []
+        self._queued: Set[Tuple[datetime, str]] = set()
+        self._handlers: Dict[str, Handler] = {}
+        self._periods: Dict[str, timedelta] = {}
+        self._last_run: Dict[str, datetime] = {}
+        self._changed: asyncio.Event = None
+        self._task: asyncio.Task = None
+
+    def register(
+        self,
+        kind: str,
+        handler: Handler,
+        period: timedelta = None,
+        first: datetime = None,
+    ):
+        """Назначает обработчик вида событий. Периодическое событие
+        после срабатывания планируется снова через period"""
+        if kind not in KINDS:
+            raise ValueError(f"Неизвестный вид события: {kind}")
+        self._handlers[kind] = handler
+        if period is not None:
+            self._periods[kind] = period
+        if first is not None:
+            self.schedule(kind, first)
+
+    def schedule(self, kind: str, when: datetime):
+        """Добавляет событие. Событие в прошлом сработает сразу"""
+        if (when, kind) in self._queued:
+            return
+        self._queued.add((when, kind))
+        heapq.heappush(self._heap, (when, KINDS.index(kind), kind))
+        if self._changed is not None:
+            self._changed.set()
+
+    def schedule_task(self, task: Task):
+        """Планирует предложение продлить задачу и её срок"""
+        if task.status != 0:
+            return
+        self.schedule(TASK_RESERVE, task.due_date - task.get_reserve_time())
+        self.schedule(TASK_DUE, task.due_date)
+
+    def schedule_review_request(self, rr: ReviewRequest):
+        """Планирует напоминание проверяющему и срок проверки"""
+        if rr.status != 0:
+            return
+        self.schedule(REVIEW_REMINDER, rr.due_date - REVIEW_REMINDER_TIME)
+        self.schedule(REVIEW_DUE, rr.due_date)
+
+    def load(self):
+        """Планирует сроки всех выданных задач и запросов на проверку"""
+        for task in (
+            Task.select(Task, Theme).join(Theme).where(Task.status == 0)
+        ):
+            self.schedule_task(task)
+        for rr in ReviewRequest.select().where(ReviewRequest.status == 0):
+            self.schedule_review_request(rr)
+
+    def get_next_time(self) -> datetime:
+        """Время ближайшего события или None"""
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> List[str]:
+        """Забирает наступившие события, возвращает их виды по порядку.
+        Периодические события планируются на следующий срок после now"""
+        kinds = []
+        while self._heap and self._heap[0][0] <= now:
+            when, _, kind = heapq.heappop(self._heap)
+            self._queued.discard((when, kind))
+            if kind not in kinds:
+                kinds.append(kind)
+            period = self._periods.get(kind)
+            if period is not None:
+                while when <= now:
+                    when += period
+                self.schedule(kind, when)
+        return kinds
+
+    def run_due(self, bot: Bot) -> List[asyncio.Task]:
+        """Запускает обработчики наступивших событий через jobs,
+        не дожидаясь их. Если обработчик ещё выполняется, непериодическое
+        событие повторяется через RETRY_DELAY: интервал (since; now]
+        не сдвигается, поэтому ничего не теряется"""
+        now = self.clock()
+        tasks = []
+        for kind in self.pop_due(now):
+            handler = self._handlers.get(kind)
+            if handler is None:
+                continue
+            since = self._last_run.get(kind, self.started_at)
+            task = self.jobs.start(
+                kind, functools.partial(handler, bot, since, now)
+            )
+            if task is None:
+                if kind not in self._periods:
+                    self.schedule(kind, now + RETRY_DELAY)
+                continue
+            self._last_run[kind] = now
+            tasks.append(task)
+        return tasks
+
+    def start(self, bot: Bot):
+        """Запускает цикл планировщика в текущем цикле событий"""
+        self.started_at = self.clock()
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        """Останавливает цикл планировщика и отменяет идущие запуски"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.jobs.stop()
+
+    async def _run(self, bot: Bot):
+        """Спит до ближайшего события или до добавления нового"""
+        while True:
+            self._changed.clear()
+            self.run_due(bot)
+            timeout = MAX_SLEEP
+            next_time = self.get_next_time()
+            if next_time is not None:
+                delay = (next_time - self.clock()).total_seconds()
+                timeout = min(MAX_SLEEP, max(0.0, delay))
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+scheduler = Scheduler()
@@ -0,0 +1,154 @@
+"""Запуск фоновых задач под надзором.
+
+Каждая задача имеет имя, одновременно идёт не больше одного её запуска.
+Для каждого запуска запоминаются начало, конец, длительность и ошибка,
+статистика доступна администраторам командой /jobs.
+"""
+
+import asyncio
+import html
+import os
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, List
+
+from dotenv import load_dotenv
+
+# Загрузка переменных из .env
+load_dotenv()
+# Сколько последних запусков каждой задачи хранить
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "20"))
+
+
+class JobRun:
+    """Один запуск задачи"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = datetime.now()
+        self.finished_at: datetime = None
+        self.duration = 0.0
+        # running, ok, error, cancelled
+        self.status = "running"
+        self.error: str = None
+
+
+class JobStats:
+    """Статистика запусков одной задачи"""
+
+    def __init__(self, history: int = JOB_HISTORY):
+        self.runs: Deque[JobRun] = deque(maxlen=history)
+        self.count = 0
+        self.failures = 0
+        self.skipped = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.current: JobRun = None
+
+    @property
+    def avg_duration(self) -> float:
+        """Средняя длительность завершённых запусков"""
+        return self.total_duration / self.count if self.count else 0.0
+
+    def add(self, run: JobRun):
+        """Учитывает завершённый запуск"""
+        self.runs.append(run)
+        self.count += 1
+        self.failures += run.status == "error"
+        self.total_duration += run.duration
+        self.max_duration = max(self.max_duration, run.duration)
+
+
+class Supervisor:
+    """Запускает именованные задачи, не допуская их наложения"""
+
+    def __init__(self, history: int = JOB_HISTORY):
+        self.history = history
+        self.stats: Dict[str, JobStats] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _get_stats(self, name: str) -> JobStats:
+        """Статистика задачи"""
+        if name not in self.stats:
+            self.stats[name] = JobStats(self.history)
+        return self.stats[name]
+
+    def is_running(self, name: str) -> bool:
+        """Идёт ли сейчас запуск задачи"""
+        return name in self._tasks
+
+    def start(
+        self, name: str, factory: Callable[[], Awaitable]
+    ) -> asyncio.Task:
+        """Запускает задачу в фоне. Если предыдущий запуск ещё идёт,
+        новый пропускается и возвращается None"""
+        if self.is_running(name):
+            self._get_stats(name).skipped += 1
+            print(f"Задача {name} ещё выполняется, запуск пропущен")
+            return None
+        task = asyncio.create_task(self._run(name, factory))
+        self._tasks[name] = task
+        return task
+
+    async def _run(self, name: str, factory: Callable[[], Awaitable]):
+        """Выполняет задачу и записывает результат запуска"""
+        stats = self._get_stats(name)
+        run = stats.current = JobRun(name)
+        started = time.perf_counter()
+        try:
+            await factory()
+            run.status = "ok"
+        except asyncio.CancelledError:
+            run.status = "cancelled"
+            raise
+        except Exception as ex:  # pylint: disable=broad-exception-caught
+            traceback.print_exc()
+            run.status = "error"
+            run.error = repr(ex)
+        finally:
+            run.duration = time.perf_counter() - started
+            run.finished_at = datetime.now()
+            stats.current = None
+            stats.add(run)
+            del self._tasks[name]
+
+    async def wait(self):
+        """Дожидается завершения идущих запусков"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def stop(self):
+        """Отменяет идущие запуски и дожидается их завершения"""
+        for task in self._tasks.values():
+            task.cancel()
+        await self.wait()
+
+    def get_report(self) -> str:
+        """Статистика задач для администратора"""
+        lines: List[str] = ["⏱<b>Фоновые задачи</b>"]
+        for name, stats in sorted(self.stats.items()):
+            line = (
+                f"<b>{name}</b>: запусков {stats.count}, "
+                f"ошибок {stats.failures}, пропущено {stats.skipped}, "
+                f"среднее {stats.avg_duration:.2f}с, "
+                f"максимум {stats.max_duration:.2f}с"
+            )
+            if stats.current is not None:
+                line += f"\nвыполняется с {stats.current.started_at:%H:%M:%S}"
+            if stats.runs:
+                last = stats.runs[-1]
+                line += (
+                    f"\nпоследний: {last.started_at:%d.%m %H:%M:%S}, "
+                    f"{last.duration:.2f}с, {last.status}"
+                )
+                if last.error:
+                    line += f"\n{html.escape(last.error[:200], quote=False)}"
+            lines.append(line)
+        if len(lines) == 1:
+            lines.append("Запусков ещё не было")
+        return "\n\n".join(lines)
+
+
+supervisor = Supervisor()
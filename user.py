@@ -1,23 +1,26 @@
 """Модуль обработки пользовательских команд"""
 
-from typing import List, Dict
+from typing import Tuple
 
 from aiogram import F, Router
 from aiogram.filters import Command
 from aiogram.types import (
     BotCommand,
     CallbackQuery,
-    InlineKeyboardButton,
-    InlineKeyboardMarkup,
     KeyboardButton,
     Message,
     ReplyKeyboardMarkup,
 )
-from peewee import fn
 
-from common import error_handler, send_message_admins, send_task
+from catalogue import catalogue
+from common import error_handler, get_id, send_message_admins, send_task
+from editor import editor
+from executor import run_db_heavy
 from filters import IsAdmin, IsBloger, IsUser
-from models import Course, Task, Theme, User, UserCourse, UserRole
+from middlewares import UserContext
+from models import Course, User, UserCourse
+from rating_state import rating_state
+from roles import registry
 
 # pylint: disable=no-member
 
@@ -25,7 +28,7 @@ router = Router()
 
 
 @router.message(Command("set_fio"))
-async def set_fio(message: Message):
+async def set_fio(message: Message, user_context: UserContext):
     """Обрабатывает команду /set_fio для установки ФИО пользователя"""
     data = message.text.replace("  ", " ").split(maxsplit=1)
     if len(data) < 2:
@@ -36,7 +39,7 @@ async def set_fio(message: Message):
         await message.answer(text="Ожидается 3 слова")
         return
 
-    user = User.get(tg_id=message.from_user.id)
+    user = user_context.user
     user.comment = fio
     user.save()
 
@@ -64,13 +67,14 @@ async def set_fio(message: Message):
     await send_message_admins(
         bot=message.bot,
         text=f"Пользователь @{user.username} указал свои ФИО {user.comment}",
+        category="users",
     )
 
 
 @router.message(Command("start"))
-async def start(message: Message):
+async def start(message: Message, user_context: UserContext):
     """Обрабатывает команду /start для регистрации/приветствия пользователя"""
-    user: User = User.get_or_none(tg_id=message.from_user.id)
+    user: User = user_context.user
 
     if user is None:
 
@@ -80,7 +84,9 @@ async def start(message: Message):
         )
 
         await send_message_admins(
-            bot=message.bot, text=f"Регистрация пользователя @{user.username}"
+            bot=message.bot,
+            text=f"Регистрация пользователя @{user.username}",
+            category="users",
         )
 
     elif user.username != message.from_user.username:
@@ -98,7 +104,7 @@ async def start(message: Message):
 
     reply_markup = None
 
-    if UserRole.get_or_none(user=user, role=IsAdmin.role):
+    if user_context.has_role(IsAdmin.role):
 
         keyboard = [
             [
@@ -132,11 +138,11 @@ async def start(message: Message):
 
 
 @router.message(Command("report"), IsUser())
-async def report(message: Message):
+async def report(message: Message, user_context: UserContext):
     """Обрабатывает команду /report для получения отчета пользователя"""
-    user: User = User.get(tg_id=message.from_user.id)
+    user: User = user_context.user
     await message.answer(
-        text=user.get_report(),
+        text=await run_db_heavy(rating_state.get_report, user),
         parse_mode="HTML",
         disable_web_page_preview=True,
     )
@@ -144,14 +150,12 @@ async def report(message: Message):
 
 @router.message(Command("bloger_on"), IsUser())
 @error_handler()
-async def bloger_on(message: Message):
+async def bloger_on(message: Message, user_context: UserContext):
     """Пользователь подает заявку стать блогером"""
 
-    user = User.get(tg_id=message.from_user.id)
-    UserRole.get_or_create(
-        user=user,
-        role=IsBloger.role,
-    )
+    user = user_context.user
+    registry.add_user_role(user, IsBloger.role)
+    catalogue.on_role_changed(user)
 
     await message.answer(
         text="Теперь вы Блогер.\n"
@@ -163,190 +167,72 @@ async def bloger_on(message: Message):
         bot=message.bot,
         text=f"""<b>Роль Блогер выдана</b>
 Пользователь: @{user.username}|{user.comment}""",
+        category="roles",
     )
 
     await send_task(message.bot)
 
 
-def get_text_by_result(result):
-    """Форматировать список курсов"""
-
-    text = "<b>Список курсов</b>\n"
-
-    for course_id in result:
-        course: Dict[int, Dict] = result[course_id]
-        course_text: str = (
-            f"\n<b>{course['title']}</b>|{course['bloger_count']} желающих\n"
-        )
-
-        for theme_text in course["themes"]:
-            course_text += theme_text
-
-        text += course_text
-
-    return text
-
-
-def get_data_by_courses(user: User):
-    """Получает данные о курсах для пользователя."""
-    themes_done = Theme.select(Theme.id).join(Task).where(Task.status >= 2)
-
-    courses = (
-        Course.select(
-            Course.id.alias("course_id"),
-            Course.title.alias(alias="course_title"),
-            Theme.id.alias("theme_id"),
-            Theme.title.alias(alias="theme_title"),
-            Theme.url.alias(alias="theme_url"),
-            Theme.complexity.alias(alias="theme_complexity"),
-        )
-        .join(Theme, on=Theme.course == Course.id)
-        .where((~Theme.id << themes_done))
-    )
-
-    data: Dict[int, Dict] = {}
-
-    for row in courses.dicts():
-        if row["course_id"] not in data:
-
-            bloger_count = (
-                UserCourse.select(fn.COUNT(UserCourse.id))
-                .join(UserRole, on=UserRole.user == UserCourse.user)
-                .where(
-                    (UserCourse.course_id == row["course_id"])
-                    & (UserRole.role_id == IsBloger.role.id)
-                )
-                .scalar()
-            )
-
-            user_course: UserCourse = UserCourse.get_or_none(
-                user=user,
-                course=row["course_id"],
-            )
-
-            data[row["course_id"]] = {
-                "title": row["course_title"],
-                "themes": {},
-                "bloger_count": bloger_count,
-                "button_text": (
-                    f'{"✅" if user_course else "❌"}{row["course_title"]}'
-                ),
-                "callback_data": (
-                    f"del_user_course_{row['course_id']}"
-                    if user_course
-                    else f"add_user_course_{row['course_id']}"
-                ),
-            }
-
-        course = data[row["course_id"]]
-        # if len(course['themes']) < 3:
-        course["themes"][row["theme_id"]] = {
-            "title": row["theme_title"],
-            "url": row["theme_url"],
-            "complexity": row["theme_complexity"],
-        }
-
-    course_ids: List[int] = sorted(
-        data,
-        key=lambda k: -data[k]["bloger_count"] * 10 + len(data[k]["themes"]),
-    )
-
-    inline_keyboard = []
-
-    result = {}
-
-    theme_ind = -1
-    run = True
-    while run:
-        run = False
-        theme_ind += 1
-
-        for course_id in course_ids:
-
-            course = data[course_id]
-
-            if course_id not in result:
-
-                result[course_id] = {
-                    "title": course["title"],
-                    "themes": [],
-                    "bloger_count": course["bloger_count"],
-                    "button_text": course["button_text"],
-                    "callback_data": course["callback_data"],
-                }
-
-            themes = list(course["themes"].values())
-
-            if theme_ind < len(themes):
-                theme: Dict[int, str] = themes[theme_ind]
-                theme_text = (
-                    f'<a href="{theme["url"]}">{theme["title"]}</a>'
-                    f'|{theme["complexity"]}\n'
-                )
-                if len(get_text_by_result(result) + theme_text) >= 4096:
-                    continue
-                run = True
-                result[course_id]["themes"].append(theme_text)
-
-            if len(get_text_by_result(result)) >= 4096:
-                continue
+@router.message(Command("courses"), IsUser())
+@error_handler()
+async def show_courses(message: Message, user_context: UserContext):
+    """Обработчик команды /courses."""
+    user = user_context.user
+    await message.answer(**await run_db_heavy(catalogue.get_data, user))
 
-    for course_id in course_ids:
-        course = data[course_id]
-        inline_keyboard.append(
-            [
-                InlineKeyboardButton(
-                    text=course["button_text"],
-                    callback_data=course["callback_data"],
-                )
-            ]
-        )
 
-    return {
-        "text": get_text_by_result(result),
-        "reply_markup": InlineKeyboardMarkup(inline_keyboard=inline_keyboard),
-        "parse_mode": "HTML",
-        "disable_web_page_preview": True,
-    }
+def get_course_callback(data: str) -> Tuple[int, int]:
+    """ID курса и номер страницы из callback_data кнопки подписки.
+    В кнопках прежних сообщений номера страницы нет"""
+    parts = data.split("_")
+    return int(parts[3]), int(parts[4]) if len(parts) > 4 else 0
 
 
-@router.message(Command("courses"), IsUser())
+@router.callback_query(F.data.startswith("courses_page_"), IsUser())
 @error_handler()
-async def show_courses(message: Message):
-    """Обработчик команды /courses."""
-    await message.answer(
-        **get_data_by_courses(User.get(tg_id=message.from_user.id))
+async def show_courses_page(
+    callback: CallbackQuery, user_context: UserContext
+):
+    """Обработчик перехода по страницам списка курсов."""
+    await editor.edit(
+        callback.message,
+        **await run_db_heavy(
+            catalogue.get_data, user_context.user, get_id(callback.data)
+        ),
     )
 
 
 @router.callback_query(F.data.startswith("add_user_course_"), IsUser())
 @error_handler()
-async def add_user_course(callback: CallbackQuery):
+async def add_user_course(callback: CallbackQuery, user_context: UserContext):
     """Обработчик добавления курса пользователю."""
-    user = User.get(tg_id=callback.from_user.id)
-    course = Course.get_by_id(
-        int(callback.data[(callback.data.rfind("_") + 1) :])
-    )
-    UserCourse.get_or_create(
+    user = user_context.user
+    course_id, page = get_course_callback(callback.data)
+    course = Course.get_by_id(course_id)
+    _, created = UserCourse.get_or_create(
         user=user,
         course=course,
     )
-    await callback.message.edit_text(**get_data_by_courses(user=user))
+    if created:
+        catalogue.on_subscription_changed(user, course.id, 1)
+    await editor.edit(
+        callback.message, **await run_db_heavy(catalogue.get_data, user, page)
+    )
     await send_message_admins(
         bot=callback.bot,
         text=f"Пользователь {user.comment} подписался на курс {course.title}",
+        category="users",
     )
     await send_task(callback.bot)
 
 
 @router.callback_query(F.data.startswith("del_user_course_"), IsUser())
 @error_handler()
-async def del_user_course(callback: CallbackQuery):
+async def del_user_course(callback: CallbackQuery, user_context: UserContext):
     """Обработчик удаления курса у пользователя."""
-    user = User.get(tg_id=callback.from_user.id)
-    course = Course.get_by_id(
-        int(callback.data[(callback.data.rfind("_") + 1) :])
-    )
+    user = user_context.user
+    course_id, page = get_course_callback(callback.data)
+    course = Course.get_by_id(course_id)
 
     user_course = UserCourse.get_or_none(
         user=user,
@@ -355,10 +241,14 @@ async def del_user_course(callback: CallbackQuery):
 
     if user_course:
         user_course.delete_instance(recursive=True)
+        catalogue.on_subscription_changed(user, course.id, -1)
 
-    await callback.message.edit_text(**get_data_by_courses(user))
+    await editor.edit(
+        callback.message, **await run_db_heavy(catalogue.get_data, user, page)
+    )
 
     await send_message_admins(
         bot=callback.bot,
         text=f"Пользователь {user.comment} отписался от курса {course.title}",
+        category="users",
     )